@@ -10,6 +10,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
 import os
+import json
+import jwt
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -18,6 +20,11 @@ load_dotenv()
 # Import services
 from app.services.firebase_service import FirebaseService
 from app.services.redis_service import RedisService
+from app.services.cache_service import CacheService
+from app.services.audit_queue import AuditQueue
+from app.services.audit_archive import AuditArchive
+from app.services.auth_service import AuthService
+from app.services.password_service import PasswordService
 from app.websocket_manager import WebSocketManager
 
 # Import routers
@@ -29,15 +36,24 @@ async def lifespan(app: FastAPI):
     Application lifespan manager for startup and shutdown events.
     """
     # Startup
+    await PasswordService.initialize()
     print("🔥 Initializing Firebase service...")
     await FirebaseService.initialize()
     print("📡 Initializing Redis service...")
     await RedisService.initialize()
+    await CacheService.start()
+    await app.state.websocket_manager.start()
+    await AuditQueue.start()
+    await AuditArchive.start()
     print("🚀 ClipVault Backend Started Successfully")
     
     yield
     
     # Shutdown
+    await AuditArchive.stop()
+    print("📝 Draining audit queue...")
+    await AuditQueue.stop()
+    await PasswordService.close()
     print("🔥 Closing Firebase service...")
     await FirebaseService.close()
     print("📡 Closing Redis service...")
@@ -81,10 +97,12 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
     )
 
-    # Initialize WebSocket Manager
+    # Initialize WebSocket Manager (routers publish through app.state)
     websocket_manager = WebSocketManager()
+    app.state.websocket_manager = websocket_manager
 
     # Include API routers
     app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
@@ -123,26 +141,58 @@ def create_app() -> FastAPI:
                 detail=f"Service unhealthy: {str(e)}"
             )
 
+    @app.get("/metrics", tags=["Health"])
+    async def metrics():
+        """Runtime metrics for tuning caches and background workers."""
+        return {
+            "cache": CacheService.get_stats(),
+            "websocket": websocket_manager.get_stats(),
+            "audit_queue": AuditQueue.get_stats(),
+            "auth_token_cache": AuthService.get_stats()
+        }
+
     @app.websocket("/ws/{client_id}")
-    async def websocket_endpoint(websocket: WebSocket, client_id: str):
+    async def websocket_endpoint(websocket: WebSocket, client_id: str, token: str = "", shared: bool = False):
         """
         WebSocket endpoint for real-time clipboard synchronization.
         
+        New clipboard items are pushed as {"type": "clipboard_item", "item": {...}} to
+        the owner's connected devices, and to every connection that subscribed to the
+        shared feed. Content copied again within the dedup window is pushed to the same
+        clients as {"type": "clipboard_copy", "item": {"id", "copy_count", "last_copied_at"}}.
+        Clients may send {"type": "subscribe", "shared": true|false} to change that
+        subscription, or "ping" to receive "pong".
+        
         Args:
             websocket: WebSocket connection
             client_id: Unique client identifier
+            token: JWT access token (query parameter)
+            shared: Subscribe to clipboard items from all users
         """
-        await websocket_manager.connect(websocket, client_id)
+        try:
+            payload = AuthService.decode_token(token)
+            user_id = payload.get("sub")
+        except jwt.InvalidTokenError:
+            user_id = None
+        if not user_id:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        
+        await websocket_manager.connect(websocket, client_id, user_id=user_id, shared=shared)
         try:
             while True:
                 data = await websocket.receive_text()
-                # Echo back for now - can be extended for clipboard sync
-                await websocket_manager.send_personal_message(
-                    f"Clipboard sync: {data}", 
-                    client_id
-                )
+                if data == "ping":
+                    await websocket_manager.send_personal_message("pong", client_id)
+                    continue
+                try:
+                    message = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(message, dict) and message.get("type") == "subscribe":
+                    websocket_manager.set_shared(client_id, bool(message.get("shared")))
         except WebSocketDisconnect:
-            websocket_manager.disconnect(client_id)
+            websocket_manager.disconnect(client_id, websocket)
 
     return app
 
@@ -4,12 +4,19 @@ Audit Logs Router for ClipVault (Firebase)
 Handles audit log management using Firebase Firestore.
 """
 
-from fastapi import APIRouter, HTTPException, status, Depends, Request, Query
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any
 from app.services.firebase_service import FirebaseService
-from datetime import datetime, timedelta
+from app.services.audit_archive import AuditArchive
+from app.services.auth_service import get_current_user_id
+from datetime import datetime
+import csv
+import io
+import json
 import uuid
+import zlib
 
 router = APIRouter()
 
@@ -24,131 +31,205 @@ class AuditLogResponse(BaseModel):
     ip_address: str
     details: str
     hash_chain: Optional[str] = None
+    seq: Optional[int] = None
     metadata: Optional[Dict[str, Any]] = None
 
-# Helper function to get user ID from request
-async def get_current_user_id(request: Request) -> str:
-    """Extract user ID from JWT token in Authorization header"""
-    import jwt
-    import os
-    
-    auth_header = request.headers.get("Authorization", "")
-    
-    if not auth_header or not auth_header.startswith("Bearer "):
-        print("⚠️ No auth header provided, cannot extract user ID")
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    # Extract token and decode properly
-    token = auth_header.replace("Bearer ", "")
-    
-    try:
-        # Use the same JWT settings as auth.py
-        SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key")
-        ALGORITHM = os.getenv("ALGORITHM", "HS256")
-        
-        # Decode and verify JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        
-        if not user_id:
-            print("⚠️ No user ID found in JWT token")
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        print(f"✅ Extracted user ID from JWT for audit: {user_id}")
-        return user_id
-        
-    except jwt.ExpiredSignatureError:
-        print("⚠️ JWT token has expired")
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError as e:
-        print(f"⚠️ Invalid JWT token: {e}")
-        raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception as e:
-        print(f"⚠️ Error decoding JWT token: {e}")
-        raise HTTPException(status_code=401, detail="Token decode error")
-
 @router.get("/", response_model=List[AuditLogResponse])
 async def get_audit_logs(
-    request: Request,
+    response: Response,
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Opaque next_cursor token from a previous page"),
     status_filter: Optional[str] = Query(None),
-    search: Optional[str] = Query(None)
+    search: Optional[str] = Query(None, description="Match logs with words starting with every search word"),
+    user_id: str = Depends(get_current_user_id)
 ):
-    """Get audit logs for the authenticated user"""
+    """Get audit logs for the authenticated user
+    
+    Logs are returned newest first. When more logs exist, the token for the next
+    page is returned in the X-Next-Cursor header; pass it back as `cursor`.
+    """
     try:
-        user_id = await get_current_user_id(request)
+        page = await FirebaseService.get_user_audit_page(user_id, limit, offset, status_filter, search, cursor)
         
-        # Get real audit logs from Firebase
-        logs = await FirebaseService.get_user_audit_logs(user_id, limit, offset, status_filter, search)
+        if page['next_cursor']:
+            response.headers["X-Next-Cursor"] = page['next_cursor']
         
-        return logs
+        return page['items']
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error fetching audit logs: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch audit logs")
 
 @router.get("/stats")
-async def get_audit_stats(request: Request):
-    """Get audit log statistics"""
+async def get_audit_stats(
+    window_hours: int = Query(24, ge=1, le=24 * 7, description="Hours counted in window_events"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Get audit log statistics from the per-user hourly rollups"""
     try:
-        user_id = await get_current_user_id(request)
-        
-        # Get all audit logs to calculate real stats (increased limit to get more data)
-        all_logs = await FirebaseService.get_user_audit_logs(user_id, limit=1000, offset=0)
-        
-        # Calculate real statistics
-        total_events = len(all_logs)
-        success_events = sum(1 for log in all_logs if log.get('status') == 'success')
-        security_events = sum(1 for log in all_logs if log.get('status') in ['error', 'warning'])
-        failed_attempts = sum(1 for log in all_logs if log.get('status') == 'error')
-        
-        # Calculate events in last 24 hours
-        now = datetime.utcnow()
-        last_24h = now - timedelta(hours=24)
-        last_24h_events = 0
-        
-        for log in all_logs:
-            try:
-                log_time = datetime.fromisoformat(log.get('timestamp', '').replace('Z', ''))
-                if log_time > last_24h:
-                    last_24h_events += 1
-            except (ValueError, TypeError):
-                continue
-        
-        # Calculate success rate
-        success_rate = (success_events / total_events * 100) if total_events > 0 else 100.0
-        
-        stats = {
-            "total_events": total_events,
-            "success_rate": round(success_rate, 1),
-            "security_events": security_events,
-            "failed_attempts": failed_attempts,
-            "last_24h": last_24h_events
-        }
-        
-        return stats
+        return await FirebaseService.get_audit_stats(user_id, window_hours)
         
     except Exception as e:
         print(f"Error fetching audit stats: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch audit stats")
 
+# Columns of CSV exports; NDJSON exports carry every field
+EXPORT_COLUMNS = ["id", "seq", "timestamp", "action", "user", "device", "status",
+                  "ip_address", "details", "hash_chain", "metadata"]
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+async def _export_logs(user_id: str, status_filter: Optional[str], archived: bool) -> AsyncIterator[Dict[str, Any]]:
+    """Live logs, then (if asked) archived ones, all newest first"""
+    async for log in FirebaseService.iter_user_audit_logs(user_id, status_filter):
+        yield log
+    if archived:
+        async for log in AuditArchive.iter_logs(user_id):
+            if not status_filter or log.get("status") == status_filter:
+                yield log
+
+async def _export_lines(user_id: str, export_format: str, status_filter: Optional[str],
+                        archived: bool) -> AsyncIterator[str]:
+    """Serialized export rows, one log at a time"""
+    logs = _export_logs(user_id, status_filter, archived)
+    if export_format == "ndjson":
+        async for log in logs:
+            yield json.dumps(log, default=str) + "\n"
+        return
+    
+    row = io.StringIO()
+    writer = csv.writer(row)
+    writer.writerow(EXPORT_COLUMNS)
+    yield row.getvalue()
+    async for log in logs:
+        row.seek(0)
+        row.truncate()
+        log["metadata"] = json.dumps(log.get("metadata") or {}, default=str)
+        writer.writerow([log.get(column, "") for column in EXPORT_COLUMNS])
+        yield row.getvalue()
+
+async def _export_body(user_id: str, export_format: str, status_filter: Optional[str],
+                       archived: bool, compress: bool) -> AsyncIterator[bytes]:
+    """Export rows grouped into chunks of about EXPORT_CHUNK_BYTES, gzipped on the fly if asked"""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+    chunk = bytearray()
+    try:
+        async for line in _export_lines(user_id, export_format, status_filter, archived):
+            chunk += line.encode("utf-8")
+            if len(chunk) >= EXPORT_CHUNK_BYTES:
+                data = compressor.compress(bytes(chunk)) if compressor else bytes(chunk)
+                chunk.clear()
+                if data:
+                    yield data
+    except Exception as e:
+        # Headers are already sent: abort the chunked transfer so the client sees
+        # a failed download, never a short file with a valid ending
+        print(f"Error streaming audit export: {e}")
+        raise
+    if compressor:
+        yield compressor.compress(bytes(chunk)) + compressor.flush()
+    elif chunk:
+        yield bytes(chunk)
+
+@router.get("/export")
+async def export_audit_logs(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    compress: bool = Query(False, alias="gzip", description="Gzip the export on the fly"),
+    status_filter: Optional[str] = Query(None),
+    archived: bool = Query(False, description="Also export logs moved to the archive"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Download all of the user's audit logs, newest first, as NDJSON or CSV
+    
+    Rows are streamed as they are read, so exports of any size run in constant memory.
+    """
+    filename = f"audit-logs-{datetime.utcnow():%Y%m%d-%H%M%S}.{export_format}" + (".gz" if compress else "")
+    return StreamingResponse(
+        _export_body(user_id, export_format, status_filter, archived, compress),
+        media_type="application/gzip" if compress else EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/archive", response_model=List[AuditLogResponse])
+async def get_archived_audit_logs(
+    since: Optional[datetime] = Query(None, description="Earliest created_at (inclusive)"),
+    until: Optional[datetime] = Query(None, description="Latest created_at (exclusive)"),
+    limit: int = Query(100, ge=1, le=1000),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Audit logs moved to the archive, newest first
+    
+    Only segments overlapping [since, until) are read; page back in time by
+    passing the oldest returned timestamp as `until`.
+    """
+    try:
+        logs = []
+        async for log in AuditArchive.iter_logs(user_id, since, until):
+            logs.append(log)
+            if len(logs) >= limit:
+                break
+        return logs
+        
+    except Exception as e:
+        print(f"Error reading archived audit logs: {e}")
+        raise HTTPException(status_code=500, detail="Failed to read archived audit logs")
+
+@router.get("/archive/segments")
+async def get_audit_archive_segments(user_id: str = Depends(get_current_user_id)):
+    """Time index of the user's archived segments, newest first"""
+    segments = await FirebaseService.get_audit_archive_segments(user_id)
+    return [{key: segment.get(key) for key in ('id', 'start_at', 'end_at', 'count', 'min_seq', 'max_seq', 'size_bytes')}
+            for segment in segments]
+
+@router.get("/verify")
+async def verify_audit_chain(
+    from_seq: Optional[int] = Query(None, ge=0, description="First sequence number (default: the latest entries)"),
+    to_seq: Optional[int] = Query(None, ge=0, description="Sequence number after the last one checked"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Verify a range of the user's audit hash chain against its checkpoints"""
+    try:
+        return await FirebaseService.verify_audit_chain(user_id, from_seq, to_seq)
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error verifying audit chain: {e}")
+        raise HTTPException(status_code=500, detail="Failed to verify audit chain")
+
+@router.get("/{log_id}/proof")
+async def get_audit_proof(log_id: str, user_id: str = Depends(get_current_user_id)):
+    """Merkle inclusion proof of one audit log in its checkpoint"""
+    try:
+        proof = await FirebaseService.get_audit_proof(user_id, log_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Error building audit proof: {e}")
+        raise HTTPException(status_code=500, detail="Failed to build audit proof")
+    
+    if proof is None:
+        raise HTTPException(status_code=404, detail="Audit log not found")
+    return proof
+
 @router.post("/")
 async def create_audit_log(
     action: str,
     details: str,
     request: Request,
     status: str = "success",
-    device: Optional[str] = None
+    device: Optional[str] = None,
+    user_id: str = Depends(get_current_user_id)
 ):
     """Create a new audit log entry"""
     try:
-        user_id = await get_current_user_id(request)
-        
         # Create new audit log
         new_log = {
             "action": action,
-            "user": "test@test.com",  # TODO: Get from JWT properly
+            "user": request.state.token_claims.get("email", "unknown"),
             "device": device or "API",
             "status": status,
             "ip_address": request.client.host if request.client else "127.0.0.1",
@@ -9,18 +9,15 @@ from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from app.services.firebase_service import FirebaseService
+from app.services.audit_queue import AuditQueue
+from app.services.user_agent import parse_user_agent
+from app.services.auth_service import AuthService, bearer_token
 from app.schemas.schemas import UserResponse
-import os
 import jwt
 from datetime import datetime, timedelta
 
 router = APIRouter()
 
-# JWT settings
-SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key")
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
-
 class RegisterRequest(BaseModel):
     email: EmailStr
     name: str
@@ -40,7 +37,8 @@ class TokenResponse(BaseModel):
 async def register_user(data: RegisterRequest, request: Request):
     """
     Register endpoint using Firebase Firestore for user storage.
-    Also creates device entry and audit log.
+    Also creates device entry and audit log; the user and device writes are
+    committed together in one batch and the audit log is written behind.
     """
     try:
         # Check if user already exists in Firebase
@@ -48,8 +46,9 @@ async def register_user(data: RegisterRequest, request: Request):
         if existing_user:
             raise HTTPException(status_code=400, detail="Email already registered")
         
-        # Create user in Firebase
-        user_id = await FirebaseService.create_user({
+        # Create user in Firebase Auth; the profile write joins the batch below
+        uow = FirebaseService.unit_of_work()
+        created_user = await uow.create_user({
             "email": data.email,
             "name": data.name,
             "password": data.password,
@@ -57,6 +56,7 @@ async def register_user(data: RegisterRequest, request: Request):
             "role": "user",
             "is_active": True
         })
+        user_id = created_user["id"]
         
         # Get client IP and User-Agent for device detection
         client_ip = request.client.host if request.client else "unknown"
@@ -89,9 +89,7 @@ async def register_user(data: RegisterRequest, request: Request):
         }
         
         print(f"🔧 REGISTRATION DEBUG - Creating device with data: {device_data}")
-        device_id = await FirebaseService.create_device(device_data)
-        print(f"🔧 REGISTRATION DEBUG - Device created with ID: {device_id}")
-        print(f"✅ Device registered: {device_data['name']} ({device_id})")
+        device_id = uow.create_device(device_data)
         
         # Create audit log for user registration
         audit_data = {
@@ -111,11 +109,10 @@ async def register_user(data: RegisterRequest, request: Request):
             }
         }
         
-        audit_id = await FirebaseService.create_audit_log(audit_data)
-        print(f"✅ Audit log created: {audit_id}")
-        
-        # Get the created user
-        created_user = await FirebaseService.get_user_by_id(user_id)
+        await uow.commit()
+        print(f"✅ Device registered: {device_data['name']} ({device_id})")
+        audit_id = await AuditQueue.enqueue(audit_data)
+        print(f"✅ Audit log queued: {audit_id}")
         print(f"✅ User registered in Firebase: {data.email}")
         
         return UserResponse(**created_user)
@@ -168,10 +165,10 @@ async def login_user(data: LoginRequest, request: Request):
                 print(f"❌ Demo login failed: Invalid password for {data.email}")
                 raise HTTPException(status_code=401, detail="Invalid credentials")
         else:
-            # Try Firebase user lookup
+            # Try Firebase user lookup (one query for the user and password check)
             try:
-                firebase_user = await FirebaseService.get_user_by_email(data.email)
-                if firebase_user and await FirebaseService.verify_password(data.email, data.password):
+                firebase_user = await FirebaseService.authenticate(data.email, data.password)
+                if firebase_user:
                     print(f"✅ Firebase login successful for {data.email}")
                     user_id = firebase_user["id"]
                     access_token = create_access_token({"sub": firebase_user["id"], "email": firebase_user["email"]})
@@ -195,20 +192,14 @@ async def login_user(data: LoginRequest, request: Request):
             print(f"📱 Device info extracted: {device_info}")
             
             # Check if this device already exists for this user
-            existing_devices = await FirebaseService.get_user_devices(user_id)
-            print(f"📋 Found {len(existing_devices)} existing devices for user")
             device_signature = f"{device_info['platform']}-{device_info['browser']}-{client_ip}"
+            existing_device = await FirebaseService.get_device_by_signature(user_id, device_signature)
             
-            existing_device = None
-            for device in existing_devices:
-                device_meta = device.get('metadata', {})
-                if device_meta.get('device_signature') == device_signature:
-                    existing_device = device
-                    break
-            
+            # Device writes are committed in one batch; the audit log is written behind
+            uow = FirebaseService.unit_of_work()
             if existing_device:
                 # Update existing device's last_seen and online status
-                await FirebaseService.update_device_activity(existing_device['id'], user_id)
+                uow.update_device_activity(existing_device['id'], user_id)
                 print(f"✅ Updated existing device activity: {existing_device['name']}")
                 
                 # Create audit log for existing device login
@@ -229,9 +220,6 @@ async def login_user(data: LoginRequest, request: Request):
                         "existing_device": True
                     }
                 }
-                
-                audit_id = await FirebaseService.create_audit_log(audit_data)
-                print(f"✅ Existing device login audit log created: {audit_id}")
             else:
                 # Create new device entry for this login
                 device_data = {
@@ -254,7 +242,7 @@ async def login_user(data: LoginRequest, request: Request):
                     }
                 }
                 
-                device_id = await FirebaseService.create_device(device_data)
+                device_id = uow.create_device(device_data)
                 print(f"✅ New device registered on login: {device_data['name']} ({device_id})")
                 
                 # Create audit log for new device login
@@ -274,9 +262,10 @@ async def login_user(data: LoginRequest, request: Request):
                         "device_type": device_info['device_type']
                     }
                 }
-                
-                audit_id = await FirebaseService.create_audit_log(audit_data)
-                print(f"✅ New device audit log created: {audit_id}")
+            
+            await uow.commit()
+            audit_id = await AuditQueue.enqueue(audit_data)
+            print(f"✅ Login audit log queued: {audit_id}")
             
             return TokenResponse(access_token=access_token, token_type="bearer")
         
@@ -296,11 +285,10 @@ async def logout_user(request: Request):
     """
     try:
         # Get user ID from JWT token
-        auth_header = request.headers.get("Authorization", "")
-        if auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
+        token = bearer_token(request)
+        if token:
             try:
-                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+                payload = AuthService.decode_token(token)
                 user_id = payload.get("sub")
                 
                 if user_id:
@@ -311,13 +299,10 @@ async def logout_user(request: Request):
                     device_signature = f"{device_info['platform']}-{device_info['browser']}-{client_ip}"
                     
                     # Find and update the current device to offline
-                    existing_devices = await FirebaseService.get_user_devices(user_id)
-                    for device in existing_devices:
-                        device_meta = device.get('metadata', {})
-                        if device_meta.get('device_signature') == device_signature:
-                            await FirebaseService.update_device_status(device['id'], False)
-                            print(f"✅ Device set to offline on logout: {device['name']}")
-                            break
+                    device = await FirebaseService.get_device_by_signature(user_id, device_signature)
+                    if device:
+                        await FirebaseService.update_device_status(device['id'], False, user_id)
+                        print(f"✅ Device set to offline on logout: {device['name']}")
                     
                     # Create audit log for logout
                     audit_data = {
@@ -334,8 +319,8 @@ async def logout_user(request: Request):
                         }
                     }
                     
-                    await FirebaseService.create_audit_log(audit_data)
-                    print(f"✅ Logout audit log created for user: {user_id}")
+                    await AuditQueue.enqueue(audit_data)
+                    print(f"✅ Logout audit log queued for user: {user_id}")
                     
             except jwt.ExpiredSignatureError:
                 print("⚠️ Logout attempt with expired token")
@@ -359,12 +344,11 @@ async def get_me(request: Request):
     Get current user info from JWT token, supporting both Firebase and demo users.
     """
     try:
-        auth_header = request.headers.get("Authorization", "")
-        if not auth_header.startswith("Bearer "):
+        token = bearer_token(request)
+        if not token:
             raise HTTPException(status_code=401, detail="Invalid authorization header")
         
-        token = auth_header.replace("Bearer ", "")
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = AuthService.decode_token(token)
         user_id = payload.get("sub")
         email = payload.get("email")
         
@@ -420,11 +404,10 @@ async def get_current_device(request: Request):
         
         # Get user ID if authenticated
         user_id = None
-        auth_header = request.headers.get("Authorization", "")
-        if auth_header.startswith("Bearer "):
-            token = auth_header.replace("Bearer ", "")
+        token = bearer_token(request)
+        if token:
             try:
-                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+                payload = AuthService.decode_token(token)
                 user_id = payload.get("sub")
             except:
                 pass
@@ -444,159 +427,12 @@ async def get_current_device(request: Request):
 # Helper to create JWT
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return AuthService.create_access_token(data, expires_delta)
 
 def extract_device_info(user_agent: str) -> dict:
     """
     Extract detailed device information from User-Agent string.
     Returns device name, type, platform, browser details, and OS version.
+    Parsing is rule-table driven and cached per User-Agent (see app.services.user_agent).
     """
-    if not user_agent or user_agent == "unknown":
-        return {
-            "device_name": "Unknown Device",
-            "device_type": "desktop",
-            "platform": "Unknown",
-            "browser": "Unknown",
-            "os_version": "Unknown"
-        }
-    
-    user_agent_lower = user_agent.lower()
-    
-    # Detect platform/OS with version
-    platform = "Unknown"
-    os_version = "Unknown"
-    
-    if "windows nt 10" in user_agent_lower:
-        platform = "Windows"
-        os_version = "10/11"
-    elif "windows nt 6.3" in user_agent_lower:
-        platform = "Windows"
-        os_version = "8.1"
-    elif "windows nt 6.2" in user_agent_lower:
-        platform = "Windows"
-        os_version = "8"
-    elif "windows nt 6.1" in user_agent_lower:
-        platform = "Windows"
-        os_version = "7"
-    elif "windows" in user_agent_lower:
-        platform = "Windows"
-        os_version = "Unknown"
-    elif "mac os x 10_15" in user_agent_lower or "mac os x 10.15" in user_agent_lower:
-        platform = "macOS"
-        os_version = "Catalina"
-    elif "mac os x 11_" in user_agent_lower or "mac os x 11." in user_agent_lower:
-        platform = "macOS"
-        os_version = "Big Sur"
-    elif "mac os x 12_" in user_agent_lower or "mac os x 12." in user_agent_lower:
-        platform = "macOS"
-        os_version = "Monterey"
-    elif "mac os x 13_" in user_agent_lower or "mac os x 13." in user_agent_lower:
-        platform = "macOS"
-        os_version = "Ventura"
-    elif "mac os x 14_" in user_agent_lower or "mac os x 14." in user_agent_lower:
-        platform = "macOS"
-        os_version = "Sonoma"
-    elif "macintosh" in user_agent_lower or "mac os" in user_agent_lower:
-        platform = "macOS"
-        os_version = "Unknown"
-    elif "ubuntu" in user_agent_lower:
-        platform = "Ubuntu"
-    elif "linux" in user_agent_lower:
-        platform = "Linux"
-    elif "android 13" in user_agent_lower:
-        platform = "Android"
-        os_version = "13"
-    elif "android 12" in user_agent_lower:
-        platform = "Android"
-        os_version = "12"
-    elif "android 11" in user_agent_lower:
-        platform = "Android"
-        os_version = "11"
-    elif "android 10" in user_agent_lower:
-        platform = "Android"
-        os_version = "10"
-    elif "android" in user_agent_lower:
-        platform = "Android"
-        os_version = "Unknown"
-    elif "iphone os 17_" in user_agent_lower:
-        platform = "iOS"
-        os_version = "17"
-    elif "iphone os 16_" in user_agent_lower:
-        platform = "iOS"
-        os_version = "16"
-    elif "iphone os 15_" in user_agent_lower:
-        platform = "iOS"
-        os_version = "15"
-    elif "iphone" in user_agent_lower or "ipad" in user_agent_lower:
-        platform = "iOS"
-        os_version = "Unknown"
-    
-    # Detect device type with more accuracy
-    device_type = "desktop"
-    if "mobile" in user_agent_lower or "android" in user_agent_lower or "iphone" in user_agent_lower:
-        device_type = "mobile"
-    elif "tablet" in user_agent_lower or "ipad" in user_agent_lower:
-        device_type = "tablet"
-    elif "tv" in user_agent_lower or "smart" in user_agent_lower:
-        device_type = "tv"
-    
-    # Detect browser with version
-    browser = "Unknown"
-    browser_version = "Unknown"
-    
-    if "edg/" in user_agent_lower:
-        browser = "Edge"
-        try:
-            browser_version = user_agent.split("Edg/")[1].split()[0]
-        except:
-            pass
-    elif "chrome/" in user_agent_lower and "edg" not in user_agent_lower:
-        browser = "Chrome"
-        try:
-            browser_version = user_agent.split("Chrome/")[1].split()[0]
-        except:
-            pass
-    elif "firefox/" in user_agent_lower:
-        browser = "Firefox"
-        try:
-            browser_version = user_agent.split("Firefox/")[1].split()[0]
-        except:
-            pass
-    elif "safari/" in user_agent_lower and "chrome" not in user_agent_lower:
-        browser = "Safari"
-        try:
-            browser_version = user_agent.split("Version/")[1].split()[0]
-        except:
-            pass
-    elif "opera" in user_agent_lower:
-        browser = "Opera"
-    
-    # Generate comprehensive device name
-    device_name = f"{platform}"
-    if os_version != "Unknown":
-        device_name += f" {os_version}"
-    
-    if browser != "Unknown":
-        device_name += f" - {browser}"
-        if browser_version != "Unknown":
-            device_name += f" {browser_version.split('.')[0]}"  # Just major version
-    
-    if device_type == "mobile":
-        device_name = f"Mobile {device_name}"
-    elif device_type == "tablet":
-        device_name = f"Tablet {device_name}"
-    elif device_type == "tv":
-        device_name = f"Smart TV {device_name}"
-    
-    return {
-        "device_name": device_name,
-        "device_type": device_type,
-        "platform": platform,
-        "browser": browser,
-        "browser_version": browser_version,
-        "os_version": os_version
-    }
+    return parse_user_agent(user_agent)
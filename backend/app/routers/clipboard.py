@@ -4,12 +4,12 @@ Clipboard Router for ClipVault (Firebase)
 Handles clipboard item management using Firebase Firestore.
 """
 
-from fastapi import APIRouter, HTTPException, status, Depends, Request, Query
+from fastapi import APIRouter, HTTPException, status, Depends, Request, Response, Query
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from app.services.firebase_service import FirebaseService
+from app.services.auth_service import get_current_user_id
 from firebase_admin import firestore
-from datetime import datetime, timedelta
 import uuid
 
 router = APIRouter()
@@ -63,80 +63,54 @@ class ClipboardItemResponse(BaseModel):
     user_id: Optional[str] = None
     created_at: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
-
-# Helper function to get user ID from request
-async def get_current_user_id(request: Request) -> str:
-    """Extract user ID from JWT token in Authorization header"""
-    import jwt
-    import os
-    
-    auth_header = request.headers.get("Authorization", "")
-    
-    if not auth_header or not auth_header.startswith("Bearer "):
-        print("⚠️ No auth header provided, cannot extract user ID")
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    # Extract token and decode properly
-    token = auth_header.replace("Bearer ", "")
-    
-    try:
-        # Use the same JWT settings as auth.py
-        SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key")
-        ALGORITHM = os.getenv("ALGORITHM", "HS256")
-        
-        # Decode and verify JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        
-        if not user_id:
-            print("⚠️ No user ID found in JWT token")
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        print(f"✅ Extracted user ID from JWT: {user_id}")
-        return user_id
-        
-    except jwt.ExpiredSignatureError:
-        print("⚠️ JWT token has expired")
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError as e:
-        print(f"⚠️ Invalid JWT token: {e}")
-        raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception as e:
-        print(f"⚠️ Error decoding JWT token: {e}")
-        raise HTTPException(status_code=401, detail="Token decode error")
+    copy_count: int = 1
+    last_copied_at: Optional[str] = None
 
 @router.get("/")
 async def get_clipboard_items(
-    request: Request,
+    response: Response,
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
-    shared: bool = Query(False, description="Include shared clipboard items from all users")
+    cursor: Optional[str] = Query(None, description="Opaque next_cursor token from a previous page"),
+    shared: bool = Query(False, description="Include shared clipboard items from all users"),
+    user_id: str = Depends(get_current_user_id)
 ):
-    """Get clipboard items - can include shared items from all users when shared=true"""
+    """Get clipboard items - can include shared items from all users when shared=true.
+    
+    Items are returned newest first. When more items exist, the token for the
+    next page is returned in the X-Next-Cursor header; pass it back as `cursor`.
+    """
     try:
-        user_id = await get_current_user_id(request)
         print(f"📋 Getting clipboard items for user: {user_id} (shared={shared})")
         
         if shared:
             # SHARED MODE: Get ALL clipboard items from ALL users
             print("🌐 SHARED MODE: Getting clipboard items from all users")
             try:
-                print("🧪 About to call FirebaseService.get_all_clipboard_items...")
-                items = await FirebaseService.get_all_clipboard_items(limit, offset)
-                print(f"📋 Shared mode: Found {len(items)} items from all users")
+                page = await FirebaseService.get_all_clipboard_page(limit, offset, cursor)
+                print(f"📋 Shared mode: Found {len(page['items'])} items from all users")
+            except ValueError:
+                raise
             except Exception as e:
                 print(f"❌ Shared mode failed: {e}")
                 import traceback
                 traceback.print_exc()
                 print("🔄 Falling back to user items")
-                items = await FirebaseService.get_user_clipboard_items(user_id, limit, offset)
+                page = await FirebaseService.get_user_clipboard_page(user_id, limit, offset)
         else:
             # PRIVATE MODE: Get only user's own clipboard items
-            items = await FirebaseService.get_user_clipboard_items(user_id, limit, offset)
-            print(f"📋 Found {len(items)} private clipboard items for user {user_id}")
+            page = await FirebaseService.get_user_clipboard_page(user_id, limit, offset, cursor)
+            print(f"📋 Found {len(page['items'])} private clipboard items for user {user_id}")
         
-        return items
+        if page['next_cursor']:
+            response.headers["X-Next-Cursor"] = page['next_cursor']
         
+        return page['items']
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"❌ Error fetching clipboard items: {e}")
         import traceback
@@ -146,11 +120,11 @@ async def get_clipboard_items(
 @router.post("/", response_model=ClipboardItemResponse)
 async def create_clipboard_item(
     item_data: ClipboardItemCreate,
-    request: Request
+    request: Request,
+    user_id: str = Depends(get_current_user_id)
 ):
     """Create a new clipboard item"""
     try:
-        user_id = await get_current_user_id(request)
         print(f"📋 Creating clipboard item for user: {user_id}")
         print(f"📋 Item content: {item_data.content[:50]}...")
         
@@ -167,13 +141,29 @@ async def create_clipboard_item(
         item_id = await FirebaseService.create_clipboard_item(new_item_data)
         print(f"📋 Created clipboard item with ID: {item_id}")
         
-        # Return the created item with ID
+        # Return the created item with ID (or the earlier item the copy was collapsed into)
         new_item_data["id"] = item_id
-        new_item_data["created_at"] = datetime.utcnow().isoformat()
+        new_item_data["created_at"] = new_item_data["created_at"].isoformat()
+        new_item_data["last_copied_at"] = new_item_data["last_copied_at"].isoformat()
+        created_item = ClipboardItemResponse(**new_item_data)
         
         print(f"✅ Created clipboard item: {item_data.content[:50]}... ({item_id})")
         
-        return new_item_data
+        # Push to the owner's other devices and shared subscribers, without internal fields
+        try:
+            manager = request.app.state.websocket_manager
+            if created_item.copy_count > 1:
+                await manager.publish_clipboard_copy(user_id, {
+                    "id": item_id,
+                    "copy_count": created_item.copy_count,
+                    "last_copied_at": created_item.last_copied_at
+                })
+            else:
+                await manager.publish_clipboard_item(created_item.model_dump())
+        except Exception as e:
+            print(f"⚠️ Failed to publish clipboard item {item_id}: {e}")
+        
+        return created_item
         
     except Exception as e:
         print(f"Error creating clipboard item: {e}")
@@ -201,100 +191,54 @@ async def clear_all_clipboard_items(request: Request):
 @router.get("/search/{query}")
 async def search_clipboard_items(
     query: str,
-    request: Request,
+    response: Response,
     limit: int = Query(20, ge=1, le=50),
-    shared: bool = Query(True, description="Search shared clipboard items from all users")
+    cursor: Optional[str] = Query(None, description="Opaque next_cursor token from a previous page"),
+    shared: bool = Query(True, description="Search shared clipboard items from all users"),
+    user_id: str = Depends(get_current_user_id)
 ):
-    """Search clipboard items by content - defaults to shared mode"""
+    """Search clipboard items by content - defaults to shared mode
+    
+    Answered from the search index: items containing every query word, whole-word
+    matches ranked first. The next page token is returned in the X-Next-Cursor header.
+    """
     try:
-        user_id = await get_current_user_id(request)
         print(f"🔍 Searching clipboard items for query: '{query}' (shared={shared})")
         
-        if shared:
-            # Search all clipboard items from all users
-            all_items = await FirebaseService.get_all_clipboard_items(limit=1000, offset=0)
-            print(f"🔍 Searching through {len(all_items)} shared items")
-        else:
-            # Search only user's own items
-            all_items = await FirebaseService.get_user_clipboard_items(user_id, limit=1000, offset=0)
-            print(f"🔍 Searching through {len(all_items)} personal items")
+        page = await FirebaseService.search_clipboard_items(
+            query, None if shared else user_id, limit=limit, cursor=cursor
+        )
         
-        # Filter items that match the search query
-        matching_items = []
-        for item in all_items:
-            content = item.get('content', '').lower()
-            if query.lower() in content:
-                matching_items.append(item)
+        if page['next_cursor']:
+            response.headers["X-Next-Cursor"] = page['next_cursor']
         
-        print(f"🔍 Found {len(matching_items)} matching items")
-        return matching_items[:limit]
+        print(f"🔍 Found {len(page['items'])} matching items")
+        return page['items']
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error searching clipboard items: {e}")
         raise HTTPException(status_code=500, detail="Failed to search clipboard items")
 
 @router.get("/stats")
 async def get_clipboard_stats(
-    request: Request,
-    shared: bool = Query(True, description="Get shared clipboard stats from all users")
+    shared: bool = Query(True, description="Get shared clipboard stats from all users"),
+    user_id: str = Depends(get_current_user_id)
 ):
-    """Get clipboard statistics - defaults to shared mode"""
+    """Get clipboard statistics - defaults to shared mode
+    
+    Served from counters maintained on every write, so the cost does not depend
+    on how many clipboard items exist.
+    """
     try:
-        user_id = await get_current_user_id(request)
         print(f"📊 Getting clipboard stats (shared={shared})")
         
-        if shared:
-            # Get ALL clipboard items from ALL users for shared stats
-            all_items = await FirebaseService.get_all_clipboard_items(limit=10000, offset=0)
-            print(f"📊 Calculating stats from {len(all_items)} shared items")
-        else:
-            # Get only user's own items
-            all_items = await FirebaseService.get_user_clipboard_items(user_id, limit=1000, offset=0)
-            print(f"📊 Calculating stats from {len(all_items)} personal items")
-        
-        # Calculate real statistics
-        total_items = len(all_items)
-        
-        # Count by content type
-        text_items = sum(1 for item in all_items if item.get('content_type') == 'text')
-        image_items = sum(1 for item in all_items if item.get('content_type') == 'image')
-        file_items = sum(1 for item in all_items if item.get('content_type') == 'file')
-        
-        # Calculate items in last 24 hours
-        now = datetime.utcnow()
-        last_24h = now - timedelta(hours=24)
-        recent_items = 0
-        
-        for item in all_items:
-            try:
-                item_time = datetime.fromisoformat(item.get('created_at', '').replace('Z', ''))
-                if item_time > last_24h:
-                    recent_items += 1
-            except (ValueError, TypeError):
-                continue
-        
-        # Calculate total data size (estimate)
-        total_size_bytes = sum(len(item.get('content', '').encode('utf-8')) for item in all_items)
-        total_size_mb = round(total_size_bytes / (1024 * 1024), 2)
-        
-        # Count unique users (only in shared mode)
-        unique_users = len(set(item.get('user_id', '') for item in all_items if item.get('user_id'))) if shared else 1
-        
-        stats = {
-            "total_items": total_items,
-            "text_items": text_items,
-            "image_items": image_items,
-            "file_items": file_items,
-            "recent_items": recent_items,
-            "total_size_mb": total_size_mb,
-            "sync_count": total_items,  # Assuming each item represents a sync
-            "unique_users": unique_users,
-            "is_shared": shared
-        }
+        stats = await FirebaseService.get_clipboard_stats(None if shared else user_id)
         
         print(f"📊 Clipboard stats: {stats}")
         return stats
         
     except Exception as e:
         print(f"Error fetching clipboard stats: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch clipboard stats")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to fetch clipboard stats")
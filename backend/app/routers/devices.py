@@ -6,10 +6,9 @@ from fastapi import APIRouter, HTTPException, status, Depends, Request, Query
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from app.services.firebase_service import FirebaseService
+from app.services.auth_service import get_current_user_id
 from datetime import datetime
 import uuid
-import jwt
-import os
 
 router = APIRouter()
 
@@ -34,50 +33,10 @@ class DeviceResponse(BaseModel):
     created_at: str
     metadata: Optional[Dict[str, Any]] = None
 
-# Helper function to get user ID from request
-async def get_current_user_id(request: Request) -> str:
-    """Extract user ID from JWT token in Authorization header"""
-    auth_header = request.headers.get("Authorization", "")
-    
-    if not auth_header or not auth_header.startswith("Bearer "):
-        print("⚠️ No auth header provided, cannot extract user ID")
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    # Extract token and decode properly
-    token = auth_header.replace("Bearer ", "")
-    
-    try:
-        # Use the same JWT settings as auth.py
-        SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key")
-        ALGORITHM = os.getenv("ALGORITHM", "HS256")
-        
-        # Decode and verify JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        
-        if not user_id:
-            print("⚠️ No user ID found in JWT token")
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        print(f"✅ Extracted user ID from JWT: {user_id}")
-        return user_id
-        
-    except jwt.ExpiredSignatureError:
-        print("⚠️ JWT token has expired")
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError as e:
-        print(f"⚠️ Invalid JWT token: {e}")
-        raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception as e:
-        print(f"⚠️ Error decoding JWT token: {e}")
-        raise HTTPException(status_code=401, detail="Token decode error")
-
 @router.get("/", response_model=List[DeviceResponse])
-async def get_devices(request: Request):
+async def get_devices(user_id: str = Depends(get_current_user_id)):
     """Get devices for the authenticated user"""
     try:
-        user_id = await get_current_user_id(request)
-        
         # Get real devices from Firebase
         devices = await FirebaseService.get_user_devices(user_id)
         
@@ -90,12 +49,11 @@ async def get_devices(request: Request):
 @router.post("/", response_model=DeviceResponse)
 async def register_device(
     device_data: DeviceCreate,
-    request: Request
+    request: Request,
+    user_id: str = Depends(get_current_user_id)
 ):
     """Register a new device"""
     try:
-        user_id = await get_current_user_id(request)
-        
         # Prepare device data for Firebase
         new_device_data = {
             "name": device_data.name,
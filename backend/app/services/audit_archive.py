@@ -0,0 +1,295 @@
+import os
+import gzip
+import json
+import uuid
+import shutil
+import asyncio
+import tempfile
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.services.firebase_service import FirebaseService
+
+
+class _LocalStore:
+    """Segment files under a local directory"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def put(self, local_path: str, name: str):
+        destination = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(local_path, destination)
+
+    def fetch(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+
+class _BucketStore:
+    """Segment files in a Cloud Storage bucket (the project's Firebase Storage)"""
+
+    def __init__(self, bucket: str, prefix: str):
+        from firebase_admin import storage
+        self.bucket = storage.bucket(bucket)
+        self.prefix = prefix.strip("/")
+
+    def _blob(self, name: str):
+        return self.bucket.blob(f"{self.prefix}/{name}" if self.prefix else name)
+
+    def put(self, local_path: str, name: str):
+        self._blob(name).upload_from_filename(local_path, content_type="application/gzip")
+        os.remove(local_path)
+
+    def fetch(self, name: str) -> str:
+        handle, local_path = tempfile.mkstemp(suffix=".ndjson.gz")
+        os.close(handle)
+        self._blob(name).download_to_filename(local_path)
+        return local_path
+
+
+class AuditArchive:
+    """Moves cold audit logs out of live storage into gzip NDJSON segment files.
+
+    run_once() archives every log older than AUDIT_RETENTION_DAYS, scanning
+    newest first in rounds of about AUDIT_ARCHIVE_SEGMENT_ROWS logs. Each round
+    writes one segment per user, stores it (segments are never modified
+    afterwards), records it in the audit_archive_segments time index and only
+    then deletes its logs from live storage in batches. Chained logs wait until
+    their block's checkpoint is sealed, so the chain can still be verified from
+    the archive (see logs_by_seq()).
+
+    start() runs the job every AUDIT_ARCHIVE_INTERVAL_HOURS on whichever worker
+    holds the "audit_archive" lease. The job is opt-in: it only runs once both
+    AUDIT_RETENTION_DAYS and AUDIT_ARCHIVE_URL are set, because deleting logs
+    whose segments land on a disk wiped by the next redeploy loses them.
+
+    Tuning:
+        AUDIT_RETENTION_DAYS          age at which logs are archived (default 0, which disables the job)
+        AUDIT_ARCHIVE_URL             local directory or gs://bucket/prefix (required, no default)
+        AUDIT_ARCHIVE_SEGMENT_ROWS    logs per archiving round, which bounds segment size (default 50000)
+        AUDIT_ARCHIVE_INTERVAL_HOURS  time between runs of the job (default 24)
+    """
+    _instance = None
+    _store = None
+    _worker: Optional[asyncio.Task] = None
+    _holder = uuid.uuid4().hex
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AuditArchive, cls).__new__(cls)
+        return cls._instance
+
+    @classmethod
+    def _retention_days(cls) -> float:
+        return float(os.getenv("AUDIT_RETENTION_DAYS", 0))
+
+    @classmethod
+    def _segment_rows(cls) -> int:
+        return max(1, int(os.getenv("AUDIT_ARCHIVE_SEGMENT_ROWS", 50000)))
+
+    @classmethod
+    def _interval(cls) -> float:
+        return float(os.getenv("AUDIT_ARCHIVE_INTERVAL_HOURS", 24)) * 3600
+
+    @classmethod
+    def _get_store(cls):
+        if cls._store is None:
+            url = os.getenv("AUDIT_ARCHIVE_URL")
+            if not url:
+                raise RuntimeError("AUDIT_ARCHIVE_URL is not set; refusing to archive audit logs")
+            if url.startswith("gs://"):
+                bucket, _, prefix = url[len("gs://"):].partition("/")
+                cls._store = _BucketStore(bucket, prefix)
+            else:
+                cls._store = _LocalStore(url[len("file://"):] if url.startswith("file://") else url)
+        return cls._store
+
+    @classmethod
+    async def start(cls):
+        """Start the periodic archiving job (only if AUDIT_RETENTION_DAYS and AUDIT_ARCHIVE_URL are set)"""
+        if cls._retention_days() <= 0:
+            return
+        if not os.getenv("AUDIT_ARCHIVE_URL"):
+            print("⚠️ AUDIT_RETENTION_DAYS is set but AUDIT_ARCHIVE_URL is not; audit archiving is disabled")
+            return
+        if cls._worker is not None and not cls._worker.done():
+            return
+        cls._worker = asyncio.create_task(cls._run())
+        print(f"✅ Audit archiving every {cls._interval() / 3600:g}h (retention {cls._retention_days():g} days)")
+
+    @classmethod
+    async def stop(cls):
+        """Stop the job, abandoning a run in progress (the next run picks it up)"""
+        if cls._worker is None:
+            return
+        cls._worker.cancel()
+        await asyncio.gather(cls._worker, return_exceptions=True)
+        cls._worker = None
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            try:
+                if await FirebaseService.acquire_lease("audit_archive", cls._holder, cls._interval()):
+                    await cls.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Audit archiving failed: {e}")
+            await asyncio.sleep(cls._interval())
+
+    @staticmethod
+    def _serialize(log_data: Dict[str, Any]) -> str:
+        log_data = {key: value for key, value in log_data.items() if key != 'search_tokens'}
+        if hasattr(log_data.get('created_at'), 'isoformat'):
+            log_data['created_at'] = log_data['created_at'].isoformat()
+        return json.dumps(log_data, default=str)
+
+    @staticmethod
+    def _append_member(path: str, lines: List[str]):
+        # Each append adds a gzip member; readers see the concatenation as one stream
+        with gzip.open(path, "at", encoding="utf-8") as segment_file:
+            segment_file.writelines(lines)
+
+    @classmethod
+    async def run_once(cls, retention_days: Optional[float] = None) -> Dict[str, int]:
+        """Archive every log older than the retention age; returns counts"""
+        days = cls._retention_days() if retention_days is None else retention_days
+        if days <= 0:
+            raise ValueError("Audit archiving needs a retention age above 0 days (AUDIT_RETENTION_DAYS)")
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        totals = {'archived': 0, 'segments': 0, 'skipped': 0}
+        heads: Dict[str, Dict[str, Any]] = {}
+
+        pages = FirebaseService.iter_audit_logs_before(cutoff, page_size=min(500, cls._segment_rows()))
+        exhausted = False
+        while not exhausted:
+            workdir = tempfile.mkdtemp(prefix="audit-archive-")
+            segments: Dict[str, Dict[str, Any]] = {}
+            rows = 0
+            try:
+                while rows < cls._segment_rows():
+                    try:
+                        page = await pages.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    new_users = list({log['user_id'] for log in page if log.get('user_id')} - heads.keys())
+                    if new_users:
+                        found = await FirebaseService.get_audit_chain_heads(new_users)
+                        heads.update({user_id: found.get(user_id, {}) for user_id in new_users})
+
+                    lines: Dict[str, List[str]] = {}
+                    for log_data in page:
+                        user_id = log_data.get('user_id') or "_none"
+                        head = heads.get(user_id, {})
+                        seq = log_data.get('seq')
+                        if seq is not None and seq >= head.get('sealed_blocks', 0) * head.get('checkpoint_size', 0):
+                            totals['skipped'] += 1
+                            continue
+                        segment = segments.setdefault(user_id, {
+                            'ids': [], 'path': os.path.join(workdir, f"{uuid.uuid4().hex}.ndjson.gz"),
+                            'start_at': log_data['created_at'], 'end_at': log_data['created_at'],
+                            'min_seq': None, 'max_seq': None
+                        })
+                        segment['ids'].append(log_data['id'])
+                        segment['start_at'] = min(segment['start_at'], log_data['created_at'])
+                        segment['end_at'] = max(segment['end_at'], log_data['created_at'])
+                        if seq is not None:
+                            segment['min_seq'] = seq if segment['min_seq'] is None else min(segment['min_seq'], seq)
+                            segment['max_seq'] = seq if segment['max_seq'] is None else max(segment['max_seq'], seq)
+                        lines.setdefault(user_id, []).append(cls._serialize(log_data) + "\n")
+                        rows += 1
+                    for user_id, user_lines in lines.items():
+                        await asyncio.to_thread(cls._append_member, segments[user_id]['path'], user_lines)
+
+                for user_id, segment in segments.items():
+                    await cls._commit_segment(user_id, segment)
+                    totals['segments'] += 1
+                    totals['archived'] += len(segment['ids'])
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        print(f"🗄️ Archived {totals['archived']} audit logs older than {days:g} days into "
+              f"{totals['segments']} segments ({totals['skipped']} unsealed logs kept)")
+        return totals
+
+    @classmethod
+    async def _commit_segment(cls, user_id: str, segment: Dict[str, Any]):
+        """Store a segment, index it, then delete its logs from live storage"""
+        segment_id = uuid.uuid4().hex
+        name = f"{user_id}/{segment['end_at']:%Y%m%dT%H%M%S}-{segment_id}.ndjson.gz"
+        size_bytes = os.path.getsize(segment['path'])
+        await asyncio.to_thread(cls._get_store().put, segment['path'], name)
+        await FirebaseService.add_audit_archive_segment({
+            'id': segment_id,
+            'user_id': user_id,
+            'name': name,
+            'start_at': segment['start_at'],
+            'end_at': segment['end_at'],
+            'count': len(segment['ids']),
+            'min_seq': segment['min_seq'],
+            'max_seq': segment['max_seq'],
+            'size_bytes': size_bytes,
+            'created_at': datetime.utcnow()
+        })
+        await FirebaseService.delete_audit_logs(segment['ids'])
+
+    @classmethod
+    async def _read_segment(cls, segment: Dict[str, Any], batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Batches of raw logs from one segment file, in file order (newest first)"""
+        store = cls._get_store()
+        local_path = await asyncio.to_thread(store.fetch, segment['name'])
+        segment_file = await asyncio.to_thread(gzip.open, local_path, "rt", encoding="utf-8")
+        try:
+            while True:
+                lines = await asyncio.to_thread(lambda: list(islice(segment_file, batch_size)))
+                if not lines:
+                    return
+                yield [json.loads(line) for line in lines]
+        finally:
+            segment_file.close()
+            if isinstance(store, _BucketStore):
+                os.remove(local_path)
+
+    @staticmethod
+    def _as_utc(value: Any) -> datetime:
+        moment = datetime.fromisoformat(value) if isinstance(value, str) else value
+        return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+    @classmethod
+    async def iter_logs(cls, user_id: str, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None) -> AsyncIterator[Dict[str, Any]]:
+        """A user's archived logs with since <= created_at < until, newest first
+
+        Only segments whose time range overlaps the window are read. Logs come
+        back in the API form, like live audit log reads.
+        """
+        since = cls._as_utc(since) if since else None
+        until = cls._as_utc(until) if until else None
+        for segment in await FirebaseService.get_audit_archive_segments(user_id):
+            if (since and cls._as_utc(segment['end_at']) < since) or (until and cls._as_utc(segment['start_at']) >= until):
+                continue
+            async for logs in cls._read_segment(segment):
+                for log_data in logs:
+                    created_at = cls._as_utc(log_data['created_at'])
+                    if (since and created_at < since) or (until and created_at >= until):
+                        continue
+                    log_data['timestamp'] = log_data['created_at']
+                    yield log_data
+
+    @classmethod
+    async def logs_by_seq(cls, user_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+        """Archived chained logs with start <= seq < end, for chain verification"""
+        logs = []
+        for segment in await FirebaseService.get_audit_archive_segments(user_id):
+            if segment.get('min_seq') is None or segment['max_seq'] < start or segment['min_seq'] >= end:
+                continue
+            async for batch in cls._read_segment(segment):
+                for log_data in batch:
+                    if log_data.get('seq') is not None and start <= log_data['seq'] < end:
+                        log_data['created_at'] = cls._as_utc(log_data['created_at'])
+                        logs.append(log_data)
+        return logs
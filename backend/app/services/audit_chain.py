@@ -0,0 +1,100 @@
+"""
+Hashing for ClipVault's tamper-evident audit trail.
+
+Each user's audit logs carry a gap-free sequence number `seq`, reserved per
+write batch, and `hash_chain`, the SHA-256 leaf hash of the log's content and
+seq. Leaf hashes never depend on earlier entries, so concurrent writers do not
+serialize on the previous hash.
+
+Logs are sealed in fixed-size blocks of `checkpoint_size` entries (a power of
+two). A block's checkpoint stores the Merkle tree over its leaf hashes and
+chains the block to the one before it:
+
+  leaf   = H(0x00 || canonical JSON of the log)
+  node   = H(0x01 || left || right)
+  chain  = H(prev_chain || root)          prev_chain of block 0 is GENESIS
+
+Proving one entry needs its log, its block's checkpoint and log2(size) sibling
+hashes; verifying a range rehashes only the blocks that overlap it.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+GENESIS = "0" * 64
+
+# Log fields covered by the leaf hash; anything else (search tokens, the hash
+# itself) may be rewritten without breaking the chain
+HASHED_FIELDS = ("id", "user_id", "seq", "created_at", "action", "details", "user",
+                 "device", "status", "ip_address", "metadata")
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _canonical_time(value: Any) -> Any:
+    if not isinstance(value, datetime):
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def leaf_hash(log_data: Dict[str, Any]) -> str:
+    """Leaf hash of one audit log"""
+    fields = {name: log_data.get(name) for name in HASHED_FIELDS}
+    fields["created_at"] = _canonical_time(fields["created_at"])
+    payload = json.dumps(fields, sort_keys=True, separators=(",", ":"), default=str)
+    return _sha256(b"\x00" + payload.encode("utf-8"))
+
+
+def node_hash(left: str, right: str) -> str:
+    return _sha256(b"\x01" + bytes.fromhex(left) + bytes.fromhex(right))
+
+
+def chain_hash(prev_chain: str, root: str) -> str:
+    return _sha256(bytes.fromhex(prev_chain) + bytes.fromhex(root))
+
+
+def merkle_nodes(leaves: List[str]) -> List[str]:
+    """Every node of the tree over a power-of-two number of leaves, level by level
+
+    The leaves come first and the root last.
+    """
+    if not leaves or len(leaves) & (len(leaves) - 1):
+        raise ValueError("Merkle tree needs a power-of-two number of leaves")
+    nodes = list(leaves)
+    level = leaves
+    while len(level) > 1:
+        level = [node_hash(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        nodes.extend(level)
+    return nodes
+
+
+def inclusion_proof(nodes: List[str], index: int) -> List[Dict[str, str]]:
+    """Sibling hashes from leaf `index` up to the root of a merkle_nodes() tree"""
+    width = (len(nodes) + 1) // 2
+    proof = []
+    offset = 0
+    while width > 1:
+        sibling = index ^ 1
+        proof.append({"position": "left" if sibling < index else "right",
+                      "hash": nodes[offset + sibling]})
+        offset += width
+        index //= 2
+        width //= 2
+    return proof
+
+
+def root_from_proof(leaf: str, proof: List[Dict[str, str]]) -> str:
+    """Recompute a root from a leaf hash and its inclusion proof"""
+    current = leaf
+    for step in proof:
+        if step["position"] == "left":
+            current = node_hash(step["hash"], current)
+        else:
+            current = node_hash(current, step["hash"])
+    return current
@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from app.services.firebase_service import FirebaseService
+
+class AuditQueue:
+    """In-process write-behind queue for audit logs.
+
+    Request handlers call enqueue(), which stamps the log with its id and
+    created_at and returns immediately. A background task writes queued logs in
+    Firestore batches, flushing when AUDIT_BATCH_SIZE logs are waiting or
+    AUDIT_FLUSH_INTERVAL_MS after the first one arrived, whichever comes first.
+    stop() drains everything still queued, so call it from the lifespan shutdown
+    before FirebaseService.close(). Each flush also retries audit checkpoint
+    seals that are due (see FirebaseService.retry_audit_seals()).
+
+    Until start() is called (scripts, tests) enqueue() writes the log inline.
+
+    Tuning:
+        AUDIT_BATCH_SIZE          logs per Firestore batch (default 500, the batch limit)
+        AUDIT_FLUSH_INTERVAL_MS   longest a log waits before its batch is written (default 1000)
+        AUDIT_QUEUE_MAX_SIZE      queued logs before enqueue() waits for room (default 10000)
+        AUDIT_FLUSH_RETRIES       attempts per batch before it is dropped (default 3)
+    """
+    _instance = None
+    _queue: Optional[asyncio.Queue] = None
+    _worker: Optional[asyncio.Task] = None
+    _stats: Dict[str, float] = {}
+
+    MAX_BATCH_SIZE = 500
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AuditQueue, cls).__new__(cls)
+        return cls._instance
+
+    @classmethod
+    def _batch_size(cls) -> int:
+        return max(1, min(int(os.getenv("AUDIT_BATCH_SIZE", cls.MAX_BATCH_SIZE)), cls.MAX_BATCH_SIZE))
+
+    @classmethod
+    def _flush_interval(cls) -> float:
+        return float(os.getenv("AUDIT_FLUSH_INTERVAL_MS", 1000)) / 1000
+
+    @classmethod
+    def _retries(cls) -> int:
+        return max(1, int(os.getenv("AUDIT_FLUSH_RETRIES", 3)))
+
+    @classmethod
+    def _reset_stats(cls):
+        cls._stats = {
+            'enqueued': 0, 'written': 0, 'failed': 0, 'flushes': 0,
+            'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0
+        }
+
+    @classmethod
+    async def start(cls):
+        """Start the background flush task"""
+        if cls._worker is not None and not cls._worker.done():
+            return
+        cls._reset_stats()
+        cls._queue = asyncio.Queue(maxsize=int(os.getenv("AUDIT_QUEUE_MAX_SIZE", 10000)))
+        cls._worker = asyncio.create_task(cls._run())
+        print(f"✅ Audit queue started (batches of {cls._batch_size()}, flush every {cls._flush_interval() * 1000:.0f}ms)")
+
+    @classmethod
+    async def stop(cls):
+        """Write every queued log, then stop the background task"""
+        if cls._worker is None:
+            return
+        pending = cls._queue.qsize()
+        await cls._queue.join()
+        cls._worker.cancel()
+        await asyncio.gather(cls._worker, return_exceptions=True)
+        cls._worker = None
+        cls._queue = None
+        print(f"✅ Audit queue drained ({pending} pending logs written)")
+
+    @classmethod
+    async def enqueue(cls, log_data: Dict[str, Any]) -> str:
+        """Queue an audit log for writing; returns its id"""
+        log_id = FirebaseService._stamp_audit_log(log_data)
+        if cls._worker is None or cls._worker.done():
+            await FirebaseService.write_audit_logs([log_data])
+            return log_id
+        cls._stats['enqueued'] += 1
+        try:
+            cls._queue.put_nowait(log_data)
+        except asyncio.QueueFull:
+            await cls._queue.put(log_data)
+        return log_id
+
+    @classmethod
+    async def _run(cls):
+        """Collect logs into batches and write them until cancelled"""
+        while True:
+            batch = [await cls._queue.get()]
+            deadline = time.monotonic() + cls._flush_interval()
+            while len(batch) < cls._batch_size():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(cls._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await cls._flush(batch)
+            finally:
+                for _ in batch:
+                    cls._queue.task_done()
+
+    @classmethod
+    async def _flush(cls, batch: List[Dict[str, Any]]):
+        """Write one batch, retrying with backoff before giving up on it"""
+        start = time.perf_counter()
+        for attempt in range(1, cls._retries() + 1):
+            try:
+                await FirebaseService.write_audit_logs(batch)
+                cls._stats['written'] += len(batch)
+                break
+            except Exception as e:
+                print(f"⚠️ Audit flush of {len(batch)} logs failed (attempt {attempt}): {e}")
+                if attempt == cls._retries():
+                    cls._stats['failed'] += len(batch)
+                    print(f"❌ Dropped {len(batch)} audit logs after {attempt} attempts")
+                else:
+                    await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        cls._stats['flushes'] += 1
+        cls._stats['last_flush_ms'] = elapsed_ms
+        cls._stats['max_flush_ms'] = max(cls._stats['max_flush_ms'], elapsed_ms)
+        cls._stats['total_flush_ms'] += elapsed_ms
+        # Blocks left unsealed by a failed seal would otherwise wait for the user's next block
+        await FirebaseService.retry_audit_seals()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """Queue depth, throughput counters and flush latency"""
+        stats = cls._stats or {}
+        flushes = stats.get('flushes', 0)
+        return {
+            'running': cls._worker is not None and not cls._worker.done(),
+            'depth': cls._queue.qsize() if cls._queue is not None else 0,
+            'batch_size': cls._batch_size(),
+            'flush_interval_ms': cls._flush_interval() * 1000,
+            'enqueued': stats.get('enqueued', 0),
+            'written': stats.get('written', 0),
+            'failed': stats.get('failed', 0),
+            'flushes': flushes,
+            'last_flush_ms': round(stats.get('last_flush_ms', 0.0), 1),
+            'max_flush_ms': round(stats.get('max_flush_ms', 0.0), 1),
+            'avg_flush_ms': round(stats.get('total_flush_ms', 0.0) / flushes, 1) if flushes else 0.0
+        }
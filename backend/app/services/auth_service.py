@@ -0,0 +1,128 @@
+"""
+Shared JWT authentication for ClipVault routers and the WebSocket endpoint.
+
+Settings are read from the environment once, at import. Verified token claims
+are cached in a bounded LRU keyed by the token's SHA-256 until the token's
+`exp`, so a burst of dashboard requests with the same bearer token verifies the
+signature once. Routers declare the principal with:
+
+    user_id: str = Depends(get_current_user_id)
+
+which also stores it on request.state (user_id and token_claims).
+"""
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+import jwt
+from fastapi import HTTPException, Request
+
+# JWT settings
+SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key")
+ALGORITHM = os.getenv("ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+
+
+class AuthService:
+    """Issues and verifies access tokens, caching verified claims
+
+    Tuning:
+        AUTH_TOKEN_CACHE_SIZE  verified tokens kept in memory (default 10000)
+    """
+    _instance = None
+    _claims: "OrderedDict[bytes, tuple]" = OrderedDict()
+    _stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'rejected': 0}
+    _max_entries = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AuthService, cls).__new__(cls)
+        return cls._instance
+
+    @classmethod
+    def create_access_token(cls, data: dict, expires_delta: Optional[timedelta] = None) -> str:
+        to_encode = data.copy()
+        expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+        to_encode.update({"exp": expire})
+        return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+    @classmethod
+    def decode_token(cls, token: str) -> Dict[str, Any]:
+        """Verified claims of a token; raises jwt.ExpiredSignatureError / jwt.InvalidTokenError
+
+        Tokens without an `exp` claim are verified every time rather than cached.
+        """
+        key = hashlib.sha256(token.encode()).digest()
+        entry = cls._claims.get(key)
+        if entry is not None:
+            expires_at, claims = entry
+            if expires_at > time.time():
+                cls._claims.move_to_end(key)
+                cls._stats['hits'] += 1
+                return dict(claims)
+            del cls._claims[key]
+            cls._stats['rejected'] += 1
+            raise jwt.ExpiredSignatureError("Signature has expired")
+
+        cls._stats['misses'] += 1
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.InvalidTokenError:
+            cls._stats['rejected'] += 1
+            raise
+        if isinstance(claims.get('exp'), (int, float)):
+            cls._claims[key] = (claims['exp'], claims)
+            while len(cls._claims) > cls._max_entries:
+                cls._claims.popitem(last=False)
+        return dict(claims)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """Token cache occupancy and hit/miss counters"""
+        lookups = cls._stats['hits'] + cls._stats['misses']
+        return dict(cls._stats,
+                    cached_tokens=len(cls._claims),
+                    max_entries=cls._max_entries,
+                    hit_rate=round(cls._stats['hits'] / lookups, 3) if lookups else 0.0)
+
+
+def bearer_token(request: Request) -> Optional[str]:
+    """Token from an 'Authorization: Bearer ...' header, if present"""
+    auth_header = request.headers.get("Authorization", "")
+    if not auth_header.startswith("Bearer "):
+        return None
+    return auth_header.replace("Bearer ", "")
+
+
+async def get_current_user_id(request: Request) -> str:
+    """FastAPI dependency: the authenticated user's ID from the bearer token"""
+    user_id = getattr(request.state, "user_id", None)
+    if user_id:
+        return user_id
+
+    token = bearer_token(request)
+    if not token:
+        print("⚠️ No auth header provided, cannot extract user ID")
+        raise HTTPException(status_code=401, detail="Authorization header required")
+
+    try:
+        payload = AuthService.decode_token(token)
+    except jwt.ExpiredSignatureError:
+        print("⚠️ JWT token has expired")
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError as e:
+        print(f"⚠️ Invalid JWT token: {e}")
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    user_id = payload.get("sub")
+    if not user_id:
+        print("⚠️ No user ID found in JWT token")
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    request.state.user_id = user_id
+    request.state.token_claims = payload
+    return user_id
@@ -0,0 +1,177 @@
+import copy
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.services.redis_service import RedisService
+
+class CacheService:
+    """Two-tier read-through cache: a bounded in-process TTL LRU backed by Redis.
+
+    Keys are namespaced as "<namespace>:<id>" (e.g. "user:123", "devices:123") and
+    hit/miss counters are kept per namespace. Only JSON-serializable values are
+    cached, and None results are never cached.
+
+    Invalidations are published on the INVALIDATION_CHANNEL so every worker process
+    evicts the key from its own in-process tier (see start()). An invalidation that
+    lands while a load for the key is in flight bumps the key's generation, and the
+    load's result is then returned to its callers but not cached in either tier.
+
+    Tuning:
+        CACHE_MAX_ENTRIES        in-process LRU capacity (default 10000)
+        CACHE_LOCAL_TTL_SECONDS  in-process TTL (default 30)
+        CACHE_REDIS_TTL_SECONDS  Redis TTL (default 300)
+    """
+    _instance = None
+    _local: "OrderedDict[str, tuple]" = OrderedDict()
+    _inflight: Dict[str, asyncio.Future] = {}
+    _generations: Dict[str, int] = {}
+    _stats: Dict[str, Dict[str, int]] = {}
+    _node_id = uuid.uuid4().hex
+    _bus_connected = False
+
+    REDIS_PREFIX = "cache:"
+    INVALIDATION_CHANNEL = "cache:invalidate"
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(CacheService, cls).__new__(cls)
+        return cls._instance
+
+    @classmethod
+    def _max_entries(cls) -> int:
+        return int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+
+    @classmethod
+    def _local_ttl(cls) -> float:
+        return float(os.getenv("CACHE_LOCAL_TTL_SECONDS", 30))
+
+    @classmethod
+    def _redis_ttl(cls) -> int:
+        return int(os.getenv("CACHE_REDIS_TTL_SECONDS", 300))
+
+    @classmethod
+    def _count(cls, key: str, counter: str):
+        namespace = key.split(':', 1)[0]
+        stats = cls._stats.setdefault(namespace, {
+            'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'invalidations': 0, 'remote_invalidations': 0
+        })
+        stats[counter] += 1
+
+    @classmethod
+    def _get_local(cls, key: str) -> Optional[Any]:
+        entry = cls._local.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del cls._local[key]
+            return None
+        cls._local.move_to_end(key)
+        return value
+
+    @classmethod
+    def _set_local(cls, key: str, value: Any):
+        cls._local[key] = (time.monotonic() + cls._local_ttl(), value)
+        cls._local.move_to_end(key)
+        while len(cls._local) > cls._max_entries():
+            cls._local.popitem(last=False)
+
+    @classmethod
+    async def get_or_load(cls, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for key, calling loader on a miss in both tiers
+
+        Concurrent misses for the same key share a single loader call.
+        """
+        value = cls._get_local(key)
+        if value is not None:
+            cls._count(key, 'local_hits')
+            return copy.deepcopy(value)
+
+        value = await RedisService.get(cls.REDIS_PREFIX + key)
+        if value is not None:
+            cls._count(key, 'redis_hits')
+            cls._set_local(key, value)
+            return copy.deepcopy(value)
+
+        cls._count(key, 'misses')
+        pending = cls._inflight.get(key)
+        if pending is not None:
+            return copy.deepcopy(await asyncio.shield(pending))
+
+        future = asyncio.get_running_loop().create_future()
+        cls._inflight[key] = future
+        generation = cls._generations.setdefault(key, 0)
+        try:
+            value = await loader()
+            if value is not None and cls._generations.get(key) == generation:
+                cls._set_local(key, value)
+                await RedisService.set(cls.REDIS_PREFIX + key, value, expire=cls._redis_ttl())
+            future.set_result(value)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not reported as never retrieved
+            future.exception()
+            raise
+        finally:
+            if cls._inflight.get(key) is future:
+                del cls._inflight[key]
+            if key not in cls._inflight:
+                cls._generations.pop(key, None)
+        return copy.deepcopy(value)
+
+    @classmethod
+    def _evict(cls, key: str):
+        """Drop key from the in-process tier and mark any load in flight as stale"""
+        cls._local.pop(key, None)
+        if key in cls._generations:
+            cls._generations[key] += 1
+            # Later callers start a fresh load instead of sharing the stale one
+            cls._inflight.pop(key, None)
+
+    @classmethod
+    async def start(cls):
+        """Join the cross-worker invalidation bus (call after RedisService.initialize)"""
+        cls._bus_connected = await RedisService.subscribe(cls.INVALIDATION_CHANNEL, cls._on_invalidation)
+        if cls._bus_connected:
+            print("✅ Cache invalidation bus connected")
+        else:
+            print(f"⚠️ Cache invalidation bus unavailable, local entries may be stale for up to {cls._local_ttl():.0f}s")
+
+    @classmethod
+    async def _on_invalidation(cls, message: Any):
+        """Evict keys invalidated by another worker"""
+        if not isinstance(message, dict) or message.get('origin') == cls._node_id:
+            return
+        for key in message.get('keys', []):
+            cls._evict(key)
+            cls._count(key, 'remote_invalidations')
+
+    @classmethod
+    async def invalidate(cls, *keys: str):
+        """Evict keys from both tiers after a write and tell the other workers"""
+        for key in keys:
+            cls._evict(key)
+            cls._count(key, 'invalidations')
+            await RedisService.delete(cls.REDIS_PREFIX + key)
+        await RedisService.publish(cls.INVALIDATION_CHANNEL, {'origin': cls._node_id, 'keys': list(keys)})
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """Hit/miss counters per namespace plus local tier occupancy"""
+        namespaces = {}
+        for namespace, stats in cls._stats.items():
+            lookups = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+            hit_rate = (stats['local_hits'] + stats['redis_hits']) / lookups if lookups else 0.0
+            namespaces[namespace] = dict(stats, hit_rate=round(hit_rate, 3))
+        return {
+            'invalidation_bus': cls._bus_connected,
+            'local_entries': len(cls._local),
+            'max_entries': cls._max_entries(),
+            'local_ttl_seconds': cls._local_ttl(),
+            'redis_ttl_seconds': cls._redis_ttl(),
+            'namespaces': namespaces
+        }
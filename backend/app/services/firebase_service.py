@@ -1,17 +1,40 @@
 import firebase_admin
-from firebase_admin import credentials, firestore, auth
-from typing import Dict, List, Optional, Any
+from firebase_admin import credentials, firestore, firestore_async, auth
+from typing import AsyncIterator, Dict, List, Optional, Any
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+import time
 import uuid
+import hashlib
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-import hashlib
+from app.services import audit_chain
+from app.services.cache_service import CacheService
+from app.services.password_service import PasswordService
+from app.storage import StorageEngine, create_engine
+from app.storage.base import as_utc
+
+# Namespace for signature-keyed device ids (see FirebaseService.device_id_for_signature)
+DEVICE_ID_NAMESPACE = uuid.UUID('5f6b7c1e-3d2a-4e8b-9c4f-0a1d2e3f4b5c')
 
 class FirebaseService:
+    """Data access for ClipVault over a pluggable storage engine (see app.storage)
+    
+    STORAGE_ENGINE selects where records live: "firestore" (default), "sql"
+    (SQLite or PostgreSQL at DATABASE_URL), "log" (SQL plus an append-only
+    clipboard log on local disk, for single-node deployments) or "memory", a
+    process-local engine for load tests and local development. Caching,
+    password hashing, Firebase Auth and the audit hash chain are handled here
+    for every engine.
+    """
     _instance = None
+    _storage: Optional[StorageEngine] = None
+    # Firestore client state, set when the Firestore engine is in use
     _db = None
     _executor = None
+    _engine = None
+    _background_tasks = set()
+    _pending_seals: Dict[str, float] = {}
     
     def __new__(cls):
         if cls._instance is None:
@@ -19,8 +42,23 @@ class FirebaseService:
         return cls._instance
     
     @classmethod
-    async def initialize(cls):
-        """Initialize Firebase connection"""
+    async def initialize(cls, engine: Optional[str] = None):
+        """Initialize the storage engine (and the Firebase connection it needs)
+        
+        FIRESTORE_ENGINE selects how Firestore calls are made: "async" (default) awaits
+        the native AsyncClient on the event loop, "thread" runs the blocking client in
+        a thread pool of FIRESTORE_EXECUTOR_WORKERS threads.
+        """
+        storage = os.getenv("STORAGE_ENGINE", "firestore").lower()
+        if storage != "firestore":
+            try:
+                cls._storage = create_engine(storage)
+            except ValueError as e:
+                raise Exception(str(e))
+            await cls._storage.open()
+            print(f"✅ Using {storage} storage engine (Firebase Auth disabled)")
+            return
+        
         try:
             # Get Firebase configuration from environment
             import json
@@ -47,16 +85,24 @@ class FirebaseService:
             else:
                 raise Exception("No Firebase credentials found. Set FIREBASE_CREDENTIALS (JSON) or GOOGLE_APPLICATION_CREDENTIALS (file path)")
             
-            # Initialize Firebase Admin SDK
-            firebase_admin.initialize_app(cred, {
-                'projectId': project_id
-            })
+            # Initialize Firebase Admin SDK (once per process)
+            if not firebase_admin._apps:
+                firebase_admin.initialize_app(cred, {
+                    'projectId': project_id
+                })
             
-            cls._db = firestore.client()
-            cls._executor = ThreadPoolExecutor(max_workers=10)
+            engine = (engine or os.getenv("FIRESTORE_ENGINE", "async")).lower()
+            if engine not in ("async", "thread"):
+                raise Exception(f"Unknown FIRESTORE_ENGINE '{engine}', expected 'async' or 'thread'")
             
-            print(f"✅ Firebase Firestore connected to project: {project_id}")
+            cls._engine = engine
+            cls._db = firestore_async.client() if engine == "async" else firestore.client()
+            # Still needed for Firebase Auth calls and by the thread engine
+            cls._executor = ThreadPoolExecutor(max_workers=int(os.getenv("FIRESTORE_EXECUTOR_WORKERS", 10)))
+            cls._storage = create_engine("firestore", db=cls._db, mode=engine, executor=cls._executor)
             
+            print(f"✅ Firebase Firestore connected to project: {project_id} ({engine} engine)")
+        
         except Exception as e:
             print(f"❌ Firebase connection failed: {e}")
             print("📝 To use Firebase:")
@@ -64,111 +110,137 @@ class FirebaseService:
             print("   2. Download service account key to backend/firebase-service-account-key.json")
             print("   3. Update FIREBASE_PROJECT_ID in .env file")
             print("   4. See FIREBASE_REAL_SETUP.md for detailed instructions")
+            print("   Or set STORAGE_ENGINE=memory to run without Firebase")
             raise Exception("Firebase connection required")
     
     @classmethod
     async def close(cls):
-        """Close Firebase connection"""
-        if cls._executor:
-            cls._executor.shutdown(wait=True)
-        print("❌ Firebase Firestore disconnected")
+        """Close the storage engine"""
+        if cls._storage:
+            await cls._storage.close()
+        print(f"❌ {cls._storage.name if cls._storage else 'Firebase'} storage disconnected")
     
     @classmethod
-    async def _run_in_executor(cls, func, *args, **kwargs):
-        """Run Firestore operations in thread executor"""
-        if not cls._db:
+    def _get_storage(cls) -> StorageEngine:
+        if not cls._storage:
             raise Exception("Firebase not initialized")
-        
+        return cls._storage
+    
+    @classmethod
+    async def _run_in_executor(cls, func, *args, **kwargs):
+        """Run blocking Firebase Admin calls (e.g. Firebase Auth) in the thread executor"""
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(
-            cls._executor, 
+            cls._executor,
             lambda: func(*args, **kwargs)
         )
     
     @classmethod
-    def _hash_password(cls, password: str) -> str:
-        """Hash password using SHA256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+    async def _execute(cls, func, *args, **kwargs):
+        """Run a raw Firestore operation (e.g. `query.get`) on the Firestore engine
+        
+        For maintenance scripts that query collections through `_db` directly.
+        """
+        storage = cls._get_storage()
+        if storage.name != "firestore":
+            raise Exception(f"Raw Firestore access needs STORAGE_ENGINE=firestore, not {storage.name}")
+        return await storage._execute(func, *args, **kwargs)
+    
+    @classmethod
+    def _spawn(cls, coro):
+        """Run a coroutine in the background, keeping a reference until it finishes"""
+        task = asyncio.create_task(coro)
+        cls._background_tasks.add(task)
+        task.add_done_callback(cls._background_tasks.discard)
     
     # Users Collection with Firebase Auth Integration
     @classmethod
     async def create_user(cls, user_data: Dict[str, Any]) -> str:
         """Create a new user with Firebase Auth and Firestore"""
+        profile = await cls._prepare_user_profile(user_data)
+        user_id = profile['id']
+        await cls._get_storage().create_user(profile)
+        await CacheService.invalidate(f"user:{user_id}", f"user_email:{user_data['email']}")
+        return user_id
+    
+    @classmethod
+    async def _prepare_user_profile(cls, user_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create the Firebase Auth account and return the profile to store
+        
+        Without a Firebase app (e.g. the memory engine) the password is hashed
+        and kept in the profile instead.
+        """
         # Real Firebase implementation
-        try:
-            # Create user in Firebase Auth
-            firebase_user = await cls._run_in_executor(
-                auth.create_user,
-                email=user_data['email'],
-                password=user_data.get('password', ''),
-                display_name=user_data.get('name', ''),
-                disabled=False
-            )
-            
-            user_id = firebase_user.uid
-            
-            # Remove password from user_data (Firebase Auth handles it)
-            user_data_copy = user_data.copy()
-            user_data_copy.pop('password', None)
-            
-            # Create user profile in Firestore
-            user_data_copy.update({
-                'id': user_id,
-                'firebase_uid': user_id,
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat()
-            })
-            
-            await cls._run_in_executor(
-                cls._db.collection('users').document(user_id).set,
-                user_data_copy
-            )
-            
-            return user_id
-            
-        except Exception as e:
-            print(f"Error creating Firebase user: {e}")
-            # Fallback to manual user creation for development
-            user_id = str(uuid.uuid4())
-            if 'password' in user_data:
-                user_data['password_hash'] = cls._hash_password(user_data['password'])
-                del user_data['password']
-            
-            user_data.update({
-                'id': user_id,
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat()
-            })
+        if firebase_admin._apps:
+            try:
+                # Create user in Firebase Auth
+                firebase_user = await cls._run_in_executor(
+                    auth.create_user,
+                    email=user_data['email'],
+                    password=user_data.get('password', ''),
+                    display_name=user_data.get('name', ''),
+                    disabled=False
+                )
+                
+                user_id = firebase_user.uid
+                
+                # Remove password from user_data (Firebase Auth handles it)
+                user_data_copy = user_data.copy()
+                user_data_copy.pop('password', None)
+                
+                # Create user profile in Firestore
+                user_data_copy.update({
+                    'id': user_id,
+                    'firebase_uid': user_id,
+                    'created_at': datetime.utcnow().isoformat(),
+                    'updated_at': datetime.utcnow().isoformat()
+                })
+                return user_data_copy
             
-            await cls._run_in_executor(
-                cls._db.collection('users').document(user_id).set,
-                user_data
-            )
-            return user_id
+            except Exception as e:
+                print(f"Error creating Firebase user: {e}")
+        
+        # Fallback to manual user creation for development
+        user_id = str(uuid.uuid4())
+        if 'password' in user_data:
+            user_data['password_hash'] = await PasswordService.hash(user_data['password'])
+            del user_data['password']
+        
+        user_data.update({
+            'id': user_id,
+            'created_at': datetime.utcnow().isoformat(),
+            'updated_at': datetime.utcnow().isoformat()
+        })
+        return user_data
+    
+    @classmethod
+    def unit_of_work(cls) -> "UnitOfWork":
+        """Start a unit of work that commits user and device writes in one batch"""
+        return UnitOfWork(cls)
     
     @classmethod
     async def get_user_by_id(cls, user_id: str) -> Optional[Dict[str, Any]]:
-        """Get user by ID"""
-        doc = await cls._run_in_executor(
-            cls._db.collection('users').document(user_id).get
-        )
-        if doc.exists:
-            user_data = doc.to_dict()
+        """Get user by ID (cached)"""
+        return await CacheService.get_or_load(f"user:{user_id}", lambda: cls._load_user_by_id(user_id))
+    
+    @classmethod
+    async def _load_user_by_id(cls, user_id: str) -> Optional[Dict[str, Any]]:
+        user_data = await cls._get_storage().get_user(user_id)
+        if user_data:
             user_data.pop('password_hash', None)  # Remove password hash
-            return user_data
-        return None
+        return user_data
     
     @classmethod
     async def get_user_by_email(cls, email: str) -> Optional[Dict[str, Any]]:
-        """Get user by email"""
-        query = cls._db.collection('users').where('email', '==', email).limit(1)
-        docs = await cls._run_in_executor(query.get)
-        
-        for doc in docs:
-            user_data = doc.to_dict()
+        """Get user by email (cached)"""
+        return await CacheService.get_or_load(f"user_email:{email}", lambda: cls._load_user_by_email(email))
+    
+    @classmethod
+    async def _load_user_by_email(cls, email: str) -> Optional[Dict[str, Any]]:
+        user_data = await cls._get_storage().find_user_by_email(email)
+        if user_data:
             user_data.pop('password_hash', None)  # Remove password hash
-            return user_data
-        return None
+        return user_data
     
     @classmethod
     async def verify_firebase_token(cls, id_token: str) -> Optional[Dict[str, Any]]:
@@ -185,11 +257,45 @@ class FirebaseService:
             # Get user profile from Firestore
             user = await cls.get_user_by_id(user_id)
             return user
-            
+        
         except Exception as e:
             print(f"Firebase token verification failed: {e}")
             return None
     
+    @classmethod
+    async def authenticate(cls, email: str, password: str) -> Optional[Dict[str, Any]]:
+        """Look up a user and check their password with a single query
+        
+        Returns the user (without password_hash) or None. Users created through
+        Firebase Auth have no password_hash and are accepted, as in verify_password.
+        Legacy SHA-256 hashes are upgraded to bcrypt in the background on success.
+        """
+        user_data = await cls._get_storage().find_user_by_email(email)
+        if not user_data:
+            return None
+        
+        stored_hash = user_data.pop('password_hash', None)
+        if stored_hash:
+            valid, needs_rehash = await PasswordService.verify(password, stored_hash)
+            if not valid:
+                return None
+            if needs_rehash:
+                cls._spawn(cls._rehash_password(user_data['id'], password))
+        return user_data
+    
+    @classmethod
+    async def _rehash_password(cls, user_id: str, password: str):
+        """Replace a user's stored hash with a bcrypt hash at the current cost"""
+        try:
+            password_hash = await PasswordService.hash(password)
+            await cls._get_storage().update_user(
+                user_id,
+                {'password_hash': password_hash, 'updated_at': datetime.utcnow().isoformat()}
+            )
+            print(f"🔐 Upgraded password hash for user: {user_id}")
+        except Exception as e:
+            print(f"⚠️ Password rehash failed for user {user_id}: {e}")
+    
     @classmethod
     async def verify_password(cls, email: str, password: str) -> bool:
         """Verify user password"""
@@ -198,76 +304,91 @@ class FirebaseService:
         # we'll check if the user has a password_hash (fallback mode)
         # or use Firebase Auth (proper mode)
         
-        query = cls._db.collection('users').where('email', '==', email).limit(1)
-        docs = await cls._run_in_executor(query.get)
+        user_data = await cls._get_storage().find_user_by_email(email)
+        if not user_data:
+            return False
         
-        for doc in docs:
-            user_data = doc.to_dict()
-            # Check if this user has a password hash (development fallback)
-            stored_hash = user_data.get('password_hash')
-            if stored_hash:
-                return stored_hash == cls._hash_password(password)
-            else:
-                # This user was created with Firebase Auth
-                # For development, we'll allow password verification
-                # In production, use Firebase Auth SDK on client side
-                return True  # Allow login for Firebase Auth users in development
-                
-        return False
+        # Check if this user has a password hash (development fallback)
+        stored_hash = user_data.get('password_hash')
+        if stored_hash:
+            valid, _ = await PasswordService.verify(password, stored_hash)
+            return valid
+        # This user was created with Firebase Auth
+        # For development, we'll allow password verification
+        # In production, use Firebase Auth SDK on client side
+        return True  # Allow login for Firebase Auth users in development
     
     # Devices Collection
     @classmethod
     async def create_device(cls, device_data: Dict[str, Any]) -> str:
         """Create a new device"""
-        device_id = str(uuid.uuid4())
+        device_id = cls._stamp_device(device_data)
+        
+        await cls._get_storage().create_device(device_data)
+        await CacheService.invalidate(f"devices:{device_data.get('user_id')}")
+        return device_id
+    
+    @staticmethod
+    def device_id_for_signature(user_id: str, device_signature: str) -> str:
+        """Deterministic device id for a user's device signature, so lookups are a point read"""
+        return str(uuid.uuid5(DEVICE_ID_NAMESPACE, f"{user_id}:{device_signature}"))
+    
+    @staticmethod
+    def _stamp_device(device_data: Dict[str, Any], device_id: Optional[str] = None) -> str:
+        """Assign a new device its id (random unless given) and timestamps"""
+        device_id = device_id or str(uuid.uuid4())
         device_data.update({
             'id': device_id,
             'created_at': datetime.utcnow(),
             'last_seen': datetime.utcnow()
         })
-        
-        await cls._run_in_executor(
-            cls._db.collection('devices').document(device_id).set,
-            device_data
-        )
         return device_id
     
+    @staticmethod
+    def _device_activity_update() -> Dict[str, Any]:
+        now = datetime.utcnow()
+        return {'is_online': True, 'last_seen': now, 'updated_at': now}
+    
     @classmethod
     async def get_user_devices(cls, user_id: str) -> List[Dict[str, Any]]:
-        """Get all devices for a user"""
+        """Get all devices for a user (cached)"""
         try:
-            devices_ref = cls._db.collection('devices').where('user_id', '==', user_id)
-            docs = await cls._run_in_executor(devices_ref.get)
-            
-            devices = []
-            for doc in docs:
-                device_data = doc.to_dict()
-                device_data['id'] = doc.id
-                # Convert datetime objects to ISO strings for JSON serialization
-                if 'created_at' in device_data and hasattr(device_data['created_at'], 'isoformat'):
-                    device_data['created_at'] = device_data['created_at'].isoformat()
-                if 'last_seen' in device_data and hasattr(device_data['last_seen'], 'isoformat'):
-                    device_data['last_seen'] = device_data['last_seen'].isoformat()
-                devices.append(device_data)
-            
-            return devices
+            return await CacheService.get_or_load(f"devices:{user_id}", lambda: cls._get_storage().list_user_devices(user_id))
         except Exception as e:
             print(f"Error fetching user devices: {e}")
             # Return empty list on error
             return []
     
+    @classmethod
+    async def get_device_by_id(cls, device_id: str) -> Optional[Dict[str, Any]]:
+        """Get a device by ID"""
+        return await cls._get_storage().get_device(device_id)
+    
+    @classmethod
+    async def get_device_by_signature(cls, user_id: str, device_signature: str) -> Optional[Dict[str, Any]]:
+        """Find a user's device by its signature with a point read
+        
+        Devices created before signature-keyed ids have random ids; those are found
+        with an indexed (user_id, metadata.device_signature) lookup instead.
+        """
+        device_id = cls.device_id_for_signature(user_id, device_signature)
+        device = await cls.get_device_by_id(device_id)
+        if device and device.get('user_id') == user_id:
+            return device
+        return await cls._get_storage().find_device_by_signature(user_id, device_signature)
+    
     @classmethod
     async def update_device_trust(cls, device_id: str, user_id: str, is_trusted: bool) -> bool:
         """Update device trust status"""
         try:
-            device_ref = cls._db.collection('devices').document(device_id)
-            await cls._run_in_executor(
-                device_ref.update,
+            await cls._get_storage().update_device(
+                device_id,
                 {
                     'is_trusted': is_trusted,
                     'updated_at': datetime.utcnow()
                 }
             )
+            await CacheService.invalidate(f"devices:{user_id}")
             return True
         except Exception as e:
             print(f"Error updating device trust: {e}")
@@ -277,25 +398,34 @@ class FirebaseService:
     async def delete_device(cls, device_id: str, user_id: str) -> bool:
         """Delete a device"""
         try:
-            device_ref = cls._db.collection('devices').document(device_id)
-            await cls._run_in_executor(device_ref.delete)
+            await cls._get_storage().delete_device(device_id)
+            await CacheService.invalidate(f"devices:{user_id}")
             return True
         except Exception as e:
             print(f"Error deleting device: {e}")
             return False
     
     @classmethod
-    async def update_device_status(cls, device_id: str, is_online: bool) -> bool:
-        """Update device online status"""
+    async def update_device_status(cls, device_id: str, is_online: bool, user_id: Optional[str] = None) -> bool:
+        """Update device online status
+        
+        Pass the owning user_id when known; otherwise it is read from the device so
+        the user's cached device list can be invalidated.
+        """
         try:
-            device_ref = cls._db.collection('devices').document(device_id)
-            await cls._run_in_executor(
-                device_ref.update,
+            storage = cls._get_storage()
+            await storage.update_device(
+                device_id,
                 {
                     'is_online': is_online,
                     'last_seen': datetime.utcnow()
                 }
             )
+            if user_id is None:
+                device = await storage.get_device(device_id)
+                user_id = device.get('user_id') if device else None
+            if user_id:
+                await CacheService.invalidate(f"devices:{user_id}")
             return True
         except Exception as e:
             print(f"Error updating device status: {e}")
@@ -305,15 +435,8 @@ class FirebaseService:
     async def update_device_activity(cls, device_id: str, user_id: str) -> bool:
         """Update device activity (last_seen and online status) for login"""
         try:
-            device_ref = cls._db.collection('devices').document(device_id)
-            await cls._run_in_executor(
-                device_ref.update,
-                {
-                    'is_online': True,
-                    'last_seen': datetime.utcnow(),
-                    'updated_at': datetime.utcnow()
-                }
-            )
+            await cls._get_storage().update_device(device_id, cls._device_activity_update())
+            await CacheService.invalidate(f"devices:{user_id}")
             print(f"✅ Updated device activity for device: {device_id}")
             return True
         except Exception as e:
@@ -323,86 +446,126 @@ class FirebaseService:
     # Clipboard Items Collection
     @classmethod
     async def create_clipboard_item(cls, item_data: Dict[str, Any]) -> str:
-        """Create a new clipboard item"""
-        item_id = str(uuid.uuid4())
+        """Create a new clipboard item, updating its search index and statistics with it
+        
+        The content is hashed (SHA-256) and stored once per hash by the engine.
+        Copying the same content again within CLIPBOARD_DEDUP_WINDOW_SECONDS
+        (default 300, 0 to always store a new item) of the user's item with it
+        only bumps that item's copy_count and last_copied_at; item_data is then
+        updated to describe that item and its id is returned. The window runs
+        from the item's first copy, so content copied again later starts a new
+        item at the top of the list.
+        """
+        now = datetime.utcnow()
+        content = (item_data.get('content') or '').encode('utf-8')
         item_data.update({
-            'id': item_id,
-            'created_at': datetime.utcnow()
+            'id': str(uuid.uuid4()),
+            'created_at': now,
+            'content_hash': hashlib.sha256(content).hexdigest(),
+            'size_bytes': len(content),
+            'copy_count': 1,
+            'last_copied_at': now
         })
         
-        await cls._run_in_executor(
-            cls._db.collection('clipboard_items').document(item_id).set,
-            item_data
-        )
-        return item_id
+        window = float(os.getenv("CLIPBOARD_DEDUP_WINDOW_SECONDS", 300))
+        copied_since = now - timedelta(seconds=window) if window > 0 else None
+        copied = await cls._get_storage().create_clipboard_item(item_data, copied_since)
+        if copied:
+            item_data.update(copied)
+            print(f"📋 Same content copied again, bumped item {copied['id']} to {copied['copy_count']} copies")
+        # Engines hand back naive or aware datetimes; callers get UTC-aware ones like list responses
+        item_data['created_at'] = as_utc(item_data['created_at'])
+        item_data['last_copied_at'] = as_utc(item_data['last_copied_at'])
+        return item_data['id']
     
     @classmethod
-    async def get_user_clipboard_items(cls, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    async def get_user_clipboard_page(cls, user_id: str, limit: int = 50, offset: int = 0,
+                                      cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get one page of a user's clipboard items plus the cursor for the next page"""
+        print(f"🔍 Querying clipboard items for user: {user_id}")
+        page = await cls._get_storage().get_clipboard_page(user_id, limit, offset, cursor)
+        print(f"🔍 Returning {len(page['items'])} items for user {user_id}")
+        return page
+    
+    @classmethod
+    async def get_all_clipboard_page(cls, limit: int = 50, offset: int = 0,
+                                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get one page of ALL users' clipboard items plus the cursor for the next page"""
+        print(f"🔍 Querying ALL clipboard items (shared mode)")
+        page = await cls._get_storage().get_clipboard_page(None, limit, offset, cursor)
+        print(f"🔍 Returning {len(page['items'])} shared clipboard items")
+        return page
+    
+    @classmethod
+    async def get_user_clipboard_items(cls, user_id: str, limit: int = 50, offset: int = 0,
+                                       cursor: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get clipboard items for a user with pagination"""
         try:
-            print(f"🔍 Querying clipboard items for user: {user_id}")
-            query = cls._db.collection('clipboard_items').where('user_id', '==', user_id)
-            # Temporarily remove ordering to test basic query
-            # query = query.order_by('created_at', direction=firestore.Query.DESCENDING)
-            query = query.limit(limit)
-            
-            docs = await cls._run_in_executor(query.get)
-            print(f"🔍 Found {len(docs)} documents for user {user_id}")
-            
-            items = []
-            for doc in docs:
-                item_data = doc.to_dict()
-                item_data['id'] = doc.id
-                print(f"🔍 Document data: {item_data}")
-                # Convert datetime objects to ISO strings for JSON serialization
-                if 'created_at' in item_data and hasattr(item_data['created_at'], 'isoformat'):
-                    item_data['created_at'] = item_data['created_at'].isoformat()
-                items.append(item_data)
-            
-            print(f"🔍 Returning {len(items)} items")
-            return items
+            page = await cls.get_user_clipboard_page(user_id, limit, offset, cursor)
+            return page['items']
+        except ValueError:
+            raise
         except Exception as e:
             print(f"Error fetching user clipboard items: {e}")
             return []
-
+    
     @classmethod
-    async def get_all_clipboard_items(cls, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    async def get_all_clipboard_items(cls, limit: int = 50, offset: int = 0,
+                                      cursor: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get ALL clipboard items from ALL users for shared clipboard functionality"""
         try:
-            print(f"🔍 Querying ALL clipboard items (shared mode)")
-            query = cls._db.collection('clipboard_items')
-            # Order by created_at descending to get newest items first
-            try:
-                query = query.order_by('created_at', direction=firestore.Query.DESCENDING)
-            except Exception as e:
-                print(f"⚠️ Could not order by created_at: {e}, continuing without ordering")
-            
-            query = query.limit(limit)
-            
-            docs = await cls._run_in_executor(query.get)
-            print(f"🔍 Found {len(docs)} total clipboard documents")
-            
-            items = []
-            for doc in docs:
-                item_data = doc.to_dict()
-                item_data['id'] = doc.id
-                # Convert datetime objects to ISO strings for JSON serialization
-                if 'created_at' in item_data and hasattr(item_data['created_at'], 'isoformat'):
-                    item_data['created_at'] = item_data['created_at'].isoformat()
-                items.append(item_data)
-            
-            print(f"🔍 Returning {len(items)} shared clipboard items")
-            return items
+            page = await cls.get_all_clipboard_page(limit, offset, cursor)
+            return page['items']
+        except ValueError:
+            raise
         except Exception as e:
             print(f"Error fetching all clipboard items: {e}")
             return []
     
+    # Clipboard Search
+    
+    @classmethod
+    async def search_clipboard_items(cls, query_text: str, user_id: Optional[str] = None, limit: int = 20,
+                                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Search clipboard items of one user (or everyone when user_id is None)
+        
+        Every query token must occur in the item content (case-insensitive). Returns
+        {'items', 'next_cursor'}; each item carries a relevance `score`. A page scans at
+        most SEARCH_SCAN_BUDGET candidates, so next_cursor may be set with fewer than
+        `limit` items when matches are sparse.
+        """
+        return await cls._get_storage().search_clipboard_items(query_text, user_id, limit, cursor)
+    
+    @classmethod
+    async def reindex_clipboard_search(cls, page_size: int = 500) -> int:
+        """Rebuild the search index of every existing clipboard item (one-off backfill)"""
+        indexed = await cls._get_storage().reindex_clipboard_search(page_size)
+        print(f"🔍 Indexed {indexed} clipboard items for search")
+        return indexed
+    
+    # Clipboard Statistics
+    
+    @classmethod
+    async def get_clipboard_stats(cls, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Read materialized clipboard statistics for one user, or for everyone when user_id is None"""
+        return await cls._get_storage().get_clipboard_stats(user_id)
+    
+    @classmethod
+    async def rebuild_clipboard_stats(cls, page_size: int = 500) -> Dict[str, int]:
+        """Recompute all clipboard statistics from the stored items
+        
+        One-off backfill for items written before counters existed; run it while
+        clipboard writes are paused, since it overwrites the live counters.
+        """
+        result = await cls._get_storage().rebuild_clipboard_stats(page_size)
+        print(f"📊 Rebuilt clipboard stats from {result['items']} items for {result['users']} users")
+        return result
+    
     @classmethod
     async def delete_clipboard_item(cls, item_id: str, user_id: str) -> bool:
         """Delete a clipboard item"""
         try:
-            item_ref = cls._db.collection('clipboard_items').document(item_id)
-            await cls._run_in_executor(item_ref.delete)
+            await cls._get_storage().delete_clipboard_item(item_id)
             return True
         except Exception as e:
             print(f"Error deleting clipboard item: {e}")
@@ -418,79 +581,413 @@ class FirebaseService:
             'created_at': datetime.utcnow()
         })
         
-        await cls._run_in_executor(
-            cls._db.collection('security_events').document(event_id).set,
-            event_data
-        )
+        await cls._get_storage().create_security_event(event_data)
         return event_id
     
     # Audit Logs Collection
     @classmethod
     async def create_audit_log(cls, log_data: Dict[str, Any]) -> str:
         """Create a new audit log"""
+        log_id = cls._stamp_audit_log(log_data)
+        await cls.write_audit_logs([log_data])
+        return log_id
+    
+    @classmethod
+    async def write_audit_logs(cls, logs: List[Dict[str, Any]]):
+        """Write already-stamped audit logs with their stats rollups (see AuditQueue)
+        
+        The engine reserves each user's next `seq` numbers as it writes; users whose
+        chain completed a block get it sealed in the background.
+        """
+        completed = await cls._get_storage().write_audit_logs(logs, cls._audit_checkpoint_size())
+        for user_id in completed:
+            cls._spawn(cls._seal_in_background(user_id))
+    
+    @staticmethod
+    def _stamp_audit_log(log_data: Dict[str, Any]) -> str:
+        """Assign a new audit log its id and timestamp"""
         log_id = str(uuid.uuid4())
         log_data.update({
             'id': log_id,
             'created_at': datetime.utcnow()
         })
-        
-        await cls._run_in_executor(
-            cls._db.collection('audit_logs').document(log_id).set,
-            log_data
-        )
         return log_id
     
     @classmethod
-    async def get_user_audit_logs(cls, user_id: str, limit: int = 50, offset: int = 0, 
+    async def get_user_audit_page(cls, user_id: str, limit: int = 50, offset: int = 0,
+                                  status_filter: Optional[str] = None, search: Optional[str] = None,
+                                  cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get one page of a user's audit logs, newest first, plus the next page cursor
+        
+        `status_filter` is an equality filter and `search` matches logs in which every
+        search word starts a word of the action, details or user. Multi-word searches
+        verify the extra words after the index lookup and scan at most
+        AUDIT_SEARCH_SCAN_BUDGET logs per page, so next_cursor may be set on a short
+        page.
+        """
+        return await cls._get_storage().get_user_audit_page(user_id, limit, offset, status_filter, search, cursor)
+    
+    @classmethod
+    async def get_user_audit_logs(cls, user_id: str, limit: int = 50, offset: int = 0,
                                  status_filter: Optional[str] = None, search: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get audit logs for a user with filtering and pagination"""
         try:
-            # Query logs for the specific user
-            query = cls._db.collection('audit_logs').where('user_id', '==', user_id)
-            
-            # Apply status filter if provided
-            if status_filter:
-                query = query.where('status', '==', status_filter)
-            
-            # Get all matching documents (client-side sorting due to Firestore index limitations)
-            query = query.limit(limit * 2)  # Get more to account for filtering
-            
-            docs = await cls._run_in_executor(query.get)
-            
-            logs = []
-            for doc in docs:
-                log_data = doc.to_dict()
-                log_data['id'] = doc.id
-                
-                # Convert datetime objects to ISO strings for JSON serialization
-                if 'created_at' in log_data:
-                    if hasattr(log_data['created_at'], 'isoformat'):
-                        log_data['created_at'] = log_data['created_at'].isoformat()
-                    # Also set timestamp for compatibility
-                    log_data['timestamp'] = log_data['created_at']
-                
-                # Apply search filter if provided
-                if search:
-                    searchable_text = f"{log_data.get('action', '')} {log_data.get('details', '')} {log_data.get('user', '')}".lower()
-                    if search.lower() not in searchable_text:
-                        continue
-                
-                logs.append(log_data)
-            
-            # Sort by created_at/timestamp in descending order (newest first)
-            try:
-                logs.sort(key=lambda x: x.get('timestamp', x.get('created_at', '')), reverse=True)
-            except Exception:
-                pass  # If sorting fails, return unsorted
-            
-            # Apply offset and final limit
-            start_index = offset
-            end_index = offset + limit
-            
-            return logs[start_index:end_index]
-            
+            page = await cls.get_user_audit_page(user_id, limit, offset, status_filter, search)
+            return page['items']
         except Exception as e:
             print(f"Error fetching user audit logs: {e}")
             import traceback
             traceback.print_exc()
-            return []
\ No newline at end of file
+            return []
+    
+    @classmethod
+    def iter_user_audit_logs(cls, user_id: str, status_filter: Optional[str] = None,
+                             page_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Every audit log of a user, newest first, for exports
+        
+        Pages are read with cursors, so memory stays at one page however many logs
+        there are.
+        """
+        return cls._get_storage().iter_user_audit_logs(user_id, status_filter, page_size)
+    
+    @classmethod
+    async def reindex_audit_search(cls, page_size: int = 500) -> int:
+        """Rebuild the search index of every existing audit log (one-off backfill)"""
+        indexed = await cls._get_storage().reindex_audit_search(page_size)
+        print(f"🔍 Indexed {indexed} audit logs for search")
+        return indexed
+    
+    # Audit Archive (see AuditArchive)
+    
+    @classmethod
+    def iter_audit_logs_before(cls, cutoff: datetime, page_size: int = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Pages of raw audit logs (all users) created before `cutoff`, newest first"""
+        return cls._get_storage().iter_audit_logs_before(cutoff, page_size)
+    
+    @classmethod
+    async def get_audit_chain_heads(cls, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Chain heads (next_seq, checkpoint_size, sealed_blocks) of users that have one"""
+        return await cls._get_storage().get_audit_chain_heads(user_ids)
+    
+    @classmethod
+    async def delete_audit_logs(cls, log_ids: List[str]):
+        await cls._get_storage().delete_audit_logs(log_ids)
+    
+    @classmethod
+    async def add_audit_archive_segment(cls, segment: Dict[str, Any]):
+        await cls._get_storage().add_audit_archive_segment(segment)
+    
+    @classmethod
+    async def get_audit_archive_segments(cls, user_id: str) -> List[Dict[str, Any]]:
+        """A user's archived segments, newest first"""
+        return await cls._get_storage().get_audit_archive_segments(user_id)
+    
+    @classmethod
+    async def acquire_lease(cls, name: str, holder: str, ttl_seconds: float) -> bool:
+        """Take or renew the named lease unless another holder's is still valid
+        
+        Used to run periodic jobs on only one worker process at a time.
+        """
+        return await cls._get_storage().acquire_lease(name, holder, ttl_seconds)
+    
+    # Audit Statistics
+    #
+    # Rollups are updated in the same atomic write as the logs they count, so the
+    # stats endpoint reads all-time totals and hour buckets instead of scanning logs.
+    
+    @classmethod
+    async def get_audit_stats(cls, user_id: str, window_hours: int = 24) -> Dict[str, Any]:
+        """Read a user's audit statistics from the rollups
+        
+        `last_24h` and the window counts sum the hour buckets overlapping the last
+        24 (or `window_hours`) hours, so they are exact to the hour.
+        """
+        return await cls._get_storage().get_audit_stats(user_id, window_hours)
+    
+    @classmethod
+    async def rebuild_audit_stats(cls, page_size: int = 500) -> Dict[str, int]:
+        """Recompute all audit rollups from the stored logs
+        
+        One-off backfill for logs written before rollups existed; run it while
+        audit writes are paused, since it overwrites the live counters.
+        """
+        result = await cls._get_storage().rebuild_audit_stats(page_size)
+        print(f"📊 Rebuilt audit stats from {result['logs']} logs for {result['users']} users")
+        return result
+    
+    # Audit Hash Chain
+    #
+    # Tamper evidence for each user's audit stream (hashing rules in audit_chain).
+    # The chain head holds next_seq to reserve, checkpoint_size and sealed_blocks;
+    # checkpoint `block` holds the Merkle tree and chain hash of the logs with
+    # block*size <= seq < (block+1)*size. New chains use AUDIT_CHECKPOINT_SIZE
+    # (default 64, rounded down to a power of two); an existing chain keeps the
+    # size it was created with. A user left with complete blocks unsealed (a
+    # failed seal, logs of the block not visible yet) is retried from the
+    # AuditQueue flush every AUDIT_SEAL_RETRY_SECONDS (default 30).
+    
+    @classmethod
+    def _audit_checkpoint_size(cls) -> int:
+        size = max(2, int(os.getenv("AUDIT_CHECKPOINT_SIZE", 64)))
+        return 1 << (size.bit_length() - 1)
+    
+    @classmethod
+    async def _get_audit_head(cls, user_id: str) -> Optional[Dict[str, Any]]:
+        return (await cls._get_storage().get_audit_chain_heads([user_id])).get(user_id)
+    
+    @classmethod
+    def _seal_retry_interval(cls) -> float:
+        return float(os.getenv("AUDIT_SEAL_RETRY_SECONDS", 30))
+    
+    @classmethod
+    async def seal_audit_checkpoints(cls, user_id: str) -> int:
+        """Write checkpoints for a user's complete, unsealed blocks; returns how many
+        
+        Runs after a write completes a block. Sealing is deterministic, so two
+        workers sealing the same block write the same checkpoint. If a complete
+        block is left unsealed the user is kept pending for retry_audit_seals().
+        """
+        cls._pending_seals[user_id] = time.monotonic() + cls._seal_retry_interval()
+        head = await cls._get_audit_head(user_id)
+        if not head:
+            cls._pending_seals.pop(user_id, None)
+            return 0
+        sealed, block = await cls._seal_audit_blocks(user_id, head)
+        if block >= head['next_seq'] // head['checkpoint_size']:
+            cls._pending_seals.pop(user_id, None)
+        return sealed
+    
+    @classmethod
+    async def _seal_in_background(cls, user_id: str):
+        try:
+            await cls.seal_audit_checkpoints(user_id)
+        except Exception as e:
+            print(f"⚠️ Sealing audit checkpoints for user {user_id} failed, will retry: {e}")
+    
+    @classmethod
+    async def retry_audit_seals(cls):
+        """Seal again for users whose complete blocks were left unsealed, once their retry is due"""
+        now = time.monotonic()
+        for user_id in [user_id for user_id, due in cls._pending_seals.items() if due <= now]:
+            await cls._seal_in_background(user_id)
+    
+    @classmethod
+    async def _seal_audit_blocks(cls, user_id: str, head: Dict[str, Any]) -> tuple:
+        """Seal complete blocks from head's sealed_blocks on; returns (blocks sealed, first unsealed block)"""
+        storage = cls._get_storage()
+        size = head['checkpoint_size']
+        block = head.get('sealed_blocks', 0)
+        
+        prev_chain = audit_chain.GENESIS
+        if block > 0:
+            previous = (await storage.get_audit_checkpoints(user_id, [block - 1])).get(block - 1)
+            if not previous:
+                print(f"❌ Audit checkpoint {block - 1} missing for user {user_id}, not sealing")
+                return 0, block
+            prev_chain = previous['chain']
+        
+        sealed = 0
+        while block < head['next_seq'] // size:
+            start = block * size
+            logs = await storage.get_audit_logs_by_seq(user_id, start, start + size)
+            leaves = [audit_chain.leaf_hash(log_data) for log_data in logs]
+            if ([log_data.get('seq') for log_data in logs] != list(range(start, start + size))
+                    or any(leaf != log_data.get('hash_chain') for leaf, log_data in zip(leaves, logs))):
+                print(f"❌ Audit block {block} for user {user_id} is incomplete or altered, not sealing")
+                break
+            
+            nodes = audit_chain.merkle_nodes(leaves)
+            chain = audit_chain.chain_hash(prev_chain, nodes[-1])
+            await storage.save_audit_checkpoint(user_id, {
+                'user_id': user_id,
+                'index': block,
+                'start_seq': start,
+                'end_seq': start + size,
+                'root': nodes[-1],
+                'prev_chain': prev_chain,
+                'chain': chain,
+                'nodes': nodes,
+                'created_at': datetime.utcnow()
+            })
+            
+            prev_chain = chain
+            block += 1
+            sealed += 1
+        return sealed, block
+    
+    @classmethod
+    async def get_audit_proof(cls, user_id: str, log_id: str) -> Optional[Dict[str, Any]]:
+        """Inclusion proof of one audit log in its block's checkpoint
+        
+        Three point reads: the log, the chain head and the checkpoint. Returns None
+        when the log does not exist or belongs to another user; raises ValueError
+        for logs written before the chain existed.
+        """
+        storage = cls._get_storage()
+        log_data, head = await asyncio.gather(storage.get_audit_log(log_id), cls._get_audit_head(user_id))
+        if not log_data or log_data.get('user_id') != user_id:
+            return None
+        if log_data.get('seq') is None:
+            raise ValueError("Audit log predates the hash chain")
+        
+        seq = log_data['seq']
+        leaf = audit_chain.leaf_hash(log_data)
+        result: Dict[str, Any] = {
+            'id': log_id,
+            'seq': seq,
+            'leaf_hash': leaf,
+            'stored_hash': log_data.get('hash_chain'),
+            'sealed': False,
+            'checkpoint': None,
+            'proof': []
+        }
+        valid = leaf == log_data.get('hash_chain')
+        
+        checkpoint = None
+        if head:
+            block = seq // head['checkpoint_size']
+            checkpoint = (await storage.get_audit_checkpoints(user_id, [block])).get(block)
+        if checkpoint:
+            proof = audit_chain.inclusion_proof(checkpoint['nodes'], seq - checkpoint['start_seq'])
+            valid = (valid
+                     and audit_chain.root_from_proof(leaf, proof) == checkpoint['root']
+                     and audit_chain.chain_hash(checkpoint['prev_chain'], checkpoint['root']) == checkpoint['chain'])
+            result.update(sealed=True, proof=proof, checkpoint={
+                key: checkpoint[key] for key in ('index', 'start_seq', 'end_seq', 'root', 'prev_chain', 'chain')
+            })
+        result['valid'] = valid
+        return result
+    
+    @classmethod
+    async def verify_audit_chain(cls, user_id: str, from_seq: Optional[int] = None,
+                                 to_seq: Optional[int] = None) -> Dict[str, Any]:
+        """Verify a range of a user's audit chain (start inclusive, end exclusive)
+        
+        The range is widened to whole blocks. Every log in it is rehashed; sealed
+        blocks are also checked against their checkpoint's root and linked to the
+        previous checkpoint, so no history before the range is read. Defaults to
+        the latest AUDIT_VERIFY_MAX_ENTRIES entries, the most one call verifies.
+        
+        Only entries of sealed blocks count as verified_entries. Unsealed
+        entries (the tail of the chain) are only checked against their own
+        stored hash, which whoever rewrote an entry could recompute, so they are
+        reported as unverified_entries; `valid` says nothing about them.
+        """
+        storage = cls._get_storage()
+        max_entries = int(os.getenv("AUDIT_VERIFY_MAX_ENTRIES", 10000))
+        head = await cls._get_audit_head(user_id) or {'next_seq': 0, 'checkpoint_size': 1}
+        size = head['checkpoint_size']
+        next_seq = head['next_seq']
+        
+        end = next_seq if to_seq is None else min(to_seq, next_seq)
+        start = max(0, end - max_entries) if from_seq is None else from_seq
+        if end - start > max_entries:
+            raise ValueError(f"Cannot verify more than {max_entries} entries at once")
+        start = start // size * size
+        end = min(next_seq, -(-end // size) * size)
+        
+        blocks = range(start // size, -(-end // size)) if end > start else range(0)
+        wanted = list(blocks)
+        if blocks and blocks.start > 0:
+            wanted.append(blocks.start - 1)
+        checkpoints = await storage.get_audit_checkpoints(user_id, wanted) if wanted else {}
+        logs = await storage.get_audit_logs_by_seq(user_id, start, end) if blocks else []
+        if blocks and len(logs) < end - start:
+            from app.services.audit_archive import AuditArchive
+            present = {log_data['seq'] for log_data in logs}
+            logs += [log_data for log_data in await AuditArchive.logs_by_seq(user_id, start, end)
+                     if log_data['seq'] not in present]
+        by_seq = {log_data['seq']: log_data for log_data in logs}
+        
+        errors: List[Dict[str, Any]] = []
+        if len(by_seq) != len(logs):
+            errors.append({'error': 'duplicate sequence numbers'})
+        verified = unverified = 0
+        for block in blocks:
+            leaves = []
+            for seq in range(block * size, min((block + 1) * size, end)):
+                log_data = by_seq.get(seq)
+                if log_data is None:
+                    errors.append({'seq': seq, 'error': 'missing'})
+                    leaves.append(None)
+                    continue
+                leaf = audit_chain.leaf_hash(log_data)
+                if leaf != log_data.get('hash_chain'):
+                    errors.append({'seq': seq, 'id': log_data.get('id'), 'error': 'content does not match its hash'})
+                leaves.append(leaf)
+            
+            checkpoint = checkpoints.get(block)
+            if checkpoint is None:
+                unverified += len(leaves)
+                continue
+            verified += len(leaves)
+            if None in leaves or audit_chain.merkle_nodes(leaves)[-1] != checkpoint['root']:
+                errors.append({'checkpoint': block, 'error': 'entries do not match the checkpoint root'})
+            prev = checkpoints.get(block - 1, {}).get('chain') if block > 0 else audit_chain.GENESIS
+            if checkpoint['prev_chain'] != prev:
+                errors.append({'checkpoint': block, 'error': 'not linked to the previous checkpoint'})
+            if audit_chain.chain_hash(checkpoint['prev_chain'], checkpoint['root']) != checkpoint['chain']:
+                errors.append({'checkpoint': block, 'error': 'chain hash does not match'})
+        
+        return {
+            'valid': not errors,
+            'from_seq': start,
+            'to_seq': end,
+            'entries_checked': len(logs),
+            'checkpoints_checked': sum(1 for block in blocks if block in checkpoints),
+            'verified_entries': verified,
+            'unverified_entries': unverified,
+            'head_chain': head.get('last_chain'),
+            'errors': errors[:100]
+        }
+
+class UnitOfWork:
+    """Stages user and device writes and commits them in one storage batch
+
+    Each staging method returns the written data (or its id) straight away, so
+    callers never re-read what they just wrote. Cache invalidations for the
+    touched keys run once, after the batch commits:
+
+        uow = FirebaseService.unit_of_work()
+        user = await uow.create_user({...})
+        device_id = uow.create_device({...})
+        await uow.commit()
+
+    Audit logs for the flow go through AuditQueue once the commit succeeds.
+    """
+
+    def __init__(self, service):
+        self._service = service
+        self._batch = service._get_storage().batch()
+        self._invalidations: List[str] = []
+
+    async def create_user(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create the Firebase Auth account now and stage the profile; returns the profile"""
+        profile = await self._service._prepare_user_profile(user_data)
+        self._batch.create_user(profile)
+        self._invalidations += [f"user:{profile['id']}", f"user_email:{profile['email']}"]
+        user = dict(profile)
+        user.pop('password_hash', None)
+        return user
+
+    def create_device(self, device_data: Dict[str, Any]) -> str:
+        """Stage a new device, keyed by its signature when it has one; returns its id"""
+        device_signature = (device_data.get('metadata') or {}).get('device_signature')
+        device_id = self._service._stamp_device(device_data, device_id=(
+            self._service.device_id_for_signature(device_data['user_id'], device_signature)
+            if device_signature else None
+        ))
+        self._batch.create_device(device_data)
+        self._invalidations.append(f"devices:{device_data.get('user_id')}")
+        return device_id
+
+    def update_device_activity(self, device_id: str, user_id: str):
+        """Stage marking a device online and seen now"""
+        self._batch.update_device(device_id, self._service._device_activity_update())
+        self._invalidations.append(f"devices:{user_id}")
+
+    async def commit(self):
+        """Write everything staged in one round trip, then invalidate cached reads"""
+        await self._batch.commit()
+        if self._invalidations:
+            await CacheService.invalidate(*dict.fromkeys(self._invalidations))
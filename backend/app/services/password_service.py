@@ -0,0 +1,104 @@
+import os
+import hmac
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import bcrypt
+
+
+def _bcrypt_hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=rounds)).decode()
+
+
+def _bcrypt_check(password: str, password_hash: str) -> bool:
+    return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+
+def _warm_up() -> bool:
+    return True
+
+
+class PasswordService:
+    """bcrypt password hashing in a bounded process pool.
+
+    bcrypt is deliberately slow (hundreds of milliseconds at the default cost),
+    so hashing and checking run in worker processes and never block the event
+    loop. Hashes created before bcrypt are unsalted SHA-256 hex digests; verify()
+    still accepts them and reports that they need a rehash.
+
+    Workers start from a fork server (spawn where that is unavailable), never by
+    forking the app process: gRPC channels and thread pools do not survive a
+    fork. Initialize the pool before Firestore all the same, so the fork server
+    starts from a process without them.
+
+    Tuning:
+        BCRYPT_ROUNDS          bcrypt cost factor (default 12)
+        PASSWORD_HASH_WORKERS  worker processes (default min(4, CPU count))
+    """
+    _instance = None
+    _executor: Optional[ProcessPoolExecutor] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(PasswordService, cls).__new__(cls)
+        return cls._instance
+
+    @classmethod
+    def _rounds(cls) -> int:
+        return int(os.getenv("BCRYPT_ROUNDS", 12))
+
+    @classmethod
+    def _workers(cls) -> int:
+        return int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+
+    @classmethod
+    async def initialize(cls):
+        """Start the worker processes (otherwise they start on first use)"""
+        await cls._run(_warm_up)
+        print(f"✅ Password hashing pool ready ({cls._workers()} workers, bcrypt cost {cls._rounds()})")
+
+    @classmethod
+    async def close(cls):
+        """Shut down the worker processes"""
+        if cls._executor:
+            cls._executor.shutdown(wait=True)
+            cls._executor = None
+
+    @classmethod
+    async def _run(cls, func, *args):
+        if cls._executor is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            cls._executor = ProcessPoolExecutor(max_workers=cls._workers(),
+                                                mp_context=multiprocessing.get_context(method))
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(cls._executor, func, *args)
+
+    @staticmethod
+    def _legacy_hash(password: str) -> str:
+        """Unsalted SHA-256 used before bcrypt"""
+        return hashlib.sha256(password.encode()).hexdigest()
+
+    @classmethod
+    async def hash(cls, password: str) -> str:
+        """bcrypt hash of a password at the configured cost"""
+        return await cls._run(_bcrypt_hash, password, cls._rounds())
+
+    @classmethod
+    async def verify(cls, password: str, password_hash: str) -> Tuple[bool, bool]:
+        """Check a password against a stored hash; returns (valid, needs_rehash)
+
+        needs_rehash is True for a valid legacy SHA-256 hash, or a bcrypt hash made
+        with a lower cost than BCRYPT_ROUNDS.
+        """
+        if password_hash.startswith("$2"):
+            valid = await cls._run(_bcrypt_check, password, password_hash)
+            try:
+                cost = int(password_hash.split("$")[2])
+            except (IndexError, ValueError):
+                cost = cls._rounds()
+            return valid, valid and cost < cls._rounds()
+        valid = hmac.compare_digest(password_hash, cls._legacy_hash(password))
+        return valid, valid
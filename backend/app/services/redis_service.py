@@ -1,12 +1,16 @@
 import redis.asyncio as redis
 import json
 import os
-from typing import Optional, Any
+from typing import Optional, Any, Awaitable, Callable, Dict
 import asyncio
 
 class RedisService:
     _instance = None
     _redis = None
+    _pubsub = None
+    _listener_task = None
+    _listening = False
+    _handlers: Dict[str, Callable[[Any], Awaitable[None]]] = {}
     
     def __new__(cls):
         if cls._instance is None:
@@ -31,10 +35,100 @@ class RedisService:
     @classmethod
     async def close(cls):
         """Close Redis connection"""
+        if cls._listener_task:
+            # The flag stops the loop even if a cancellation races with a read completing
+            cls._listening = False
+            cls._listener_task.cancel()
+            await asyncio.wait([cls._listener_task], timeout=2)
+            cls._listener_task = None
+        if cls._pubsub:
+            await cls._pubsub.close()
+            cls._pubsub = None
+        cls._handlers.clear()
         if cls._redis:
             await cls._redis.close()
         print("❌ Redis disconnected")
     
+    @classmethod
+    def is_available(cls) -> bool:
+        """Whether a Redis connection was established"""
+        return cls._redis is not None
+    
+    @classmethod
+    async def publish(cls, channel: str, message: Any) -> bool:
+        """Publish a message (JSON-encoded if dict/list) on a pub/sub channel"""
+        if not cls._redis:
+            return False
+        
+        try:
+            if isinstance(message, (dict, list)):
+                message = json.dumps(message)
+            await cls._redis.publish(channel, message)
+            return True
+        except Exception as e:
+            print(f"Redis publish error: {e}")
+            return False
+    
+    @classmethod
+    async def subscribe(cls, channel: str, handler: Callable[[Any], Awaitable[None]]) -> bool:
+        """Subscribe to a channel; handler is awaited with each decoded message
+        
+        All subscriptions share one pub/sub connection and one listener task per process.
+        """
+        if not cls._redis:
+            return False
+        
+        try:
+            if cls._pubsub is None:
+                cls._pubsub = cls._redis.pubsub()
+            cls._handlers[channel] = handler
+            await cls._pubsub.subscribe(channel)
+            if cls._listener_task is None or cls._listener_task.done():
+                cls._listening = True
+                cls._listener_task = asyncio.create_task(cls._listen())
+            return True
+        except Exception as e:
+            print(f"Redis subscribe error: {e}")
+            cls._handlers.pop(channel, None)
+            return False
+    
+    @classmethod
+    async def unsubscribe(cls, channel: str) -> bool:
+        """Stop delivering messages from a channel"""
+        if not cls._pubsub or channel not in cls._handlers:
+            return False
+        
+        try:
+            cls._handlers.pop(channel, None)
+            await cls._pubsub.unsubscribe(channel)
+            return True
+        except Exception as e:
+            print(f"Redis unsubscribe error: {e}")
+            return False
+    
+    @classmethod
+    async def _listen(cls):
+        """Dispatch pub/sub messages to their channel handlers until close()"""
+        while cls._listening:
+            try:
+                message = await cls._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                handler = cls._handlers.get(message['channel'])
+                if handler is None:
+                    continue
+                data = message['data']
+                try:
+                    data = json.loads(data)
+                except (json.JSONDecodeError, TypeError):
+                    pass
+                await handler(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis listener error: {e}")
+                await asyncio.sleep(1)
+    
     @classmethod
     async def set(cls, key: str, value: Any, expire: Optional[int] = None) -> bool:
         """Set a key-value pair in Redis"""
@@ -0,0 +1,222 @@
+import os
+import json
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.firebase_service import FirebaseService
+from app.storage.base import as_utc
+
+# Collections created by create_firebase_database.py plus the engine's clipboard
+# blob and audit chain collections, with the index-only fields dropped on the
+# way. The stats rollups are not copied (the SQL engine aggregates on read), nor
+# are leases.
+COLLECTIONS: Dict[str, Tuple[str, ...]] = {
+    'users': (),
+    'devices': (),
+    'clipboard_items': ('search_terms',),
+    'clipboard_blobs': (),
+    'security_events': (),
+    'security_policies': (),
+    'sessions': (),
+    'audit_logs': ('search_tokens',),
+    'audit_chains': (),
+    'audit_checkpoints': (),
+    'audit_archive_segments': (),
+}
+
+# Keyed by user id instead of a record id field
+_WITHOUT_ID = ('audit_chains', 'audit_checkpoints')
+
+# Split points of the document id space: one range per leading character of
+# the ids ClipVault generates (uuid4s, Firebase uids), plus one on each side
+_SPLITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+_MODULUS = 2 ** 256
+
+
+def _checksum(record: Dict[str, Any]) -> int:
+    """Digest of a record's content, independent of key order and storage types"""
+    def tag(value):
+        if isinstance(value, datetime):
+            return {'$date': as_utc(value).isoformat()}
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+    canonical = json.dumps(record, default=tag, sort_keys=True, separators=(',', ':'))
+    return int.from_bytes(hashlib.sha256(canonical.encode()).digest(), 'big')
+
+
+def _ranges() -> List[Tuple[Optional[str], Optional[str]]]:
+    bounds = [None, *_SPLITS, None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class StorageMigration:
+    """Copies the Firestore collections into the SQL engine, resumably.
+
+    Each collection is split into document id ranges by leading character.
+    MIGRATION_READERS readers take (collection, range) tasks from a shared
+    queue, so skewed id distributions still spread over every reader, and page
+    through their range in document id order with start_after cursors, one
+    page in memory per reader. Every page is upserted into SQL in one
+    transaction, then the range's position, row count and checksum (a sum of
+    per-record SHA-256 digests, so order does not matter) are saved to the
+    checkpoint file. A rerun skips finished ranges and resumes the others after
+    their last saved page; a page imported again after a crash is harmless.
+
+    verify() compares, per collection, the Firestore count aggregation and the
+    checkpointed count and checksum with a scan of the SQL table. Pause writes
+    to Firestore during the final run so the three agree.
+
+    Tuning:
+        MIGRATION_READERS     parallel range readers (default 8)
+        MIGRATION_PAGE_SIZE   documents per read and insert batch (default 500)
+        MIGRATION_CHECKPOINT  checkpoint file (default ./migration_checkpoint.json)
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(StorageMigration, cls).__new__(cls)
+        return cls._instance
+
+    @staticmethod
+    def _checkpoint_path() -> str:
+        return os.getenv("MIGRATION_CHECKPOINT", "./migration_checkpoint.json")
+
+    @classmethod
+    def _load_checkpoint(cls) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        try:
+            with open(cls._checkpoint_path()) as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return {}
+
+    @classmethod
+    def _save_checkpoint(cls, progress: Dict[str, Dict[str, Dict[str, Any]]]):
+        # Write then rename, so a crash never leaves a truncated checkpoint
+        path = cls._checkpoint_path()
+        with open(f"{path}.tmp", "w") as handle:
+            json.dump(progress, handle)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def _range_key(low: Optional[str], high: Optional[str]) -> str:
+        return f"{low or ''}:{high or ''}"
+
+    @classmethod
+    def _range_query(cls, collection: str, low: Optional[str], high: Optional[str], after: Optional[str],
+                     page_size: int):
+        reference = FirebaseService._db.collection(collection)
+        query = reference.order_by('__name__')
+        if low:
+            query = query.where('__name__', '>=', reference.document(low))
+        if high:
+            query = query.where('__name__', '<', reference.document(high))
+        if after:
+            query = query.start_after({'__name__': after})
+        return query.limit(page_size)
+
+    @staticmethod
+    def _record(collection: str, doc) -> Dict[str, Any]:
+        record = doc.to_dict()
+        for field in COLLECTIONS[collection]:
+            record.pop(field, None)
+        if collection not in _WITHOUT_ID:
+            record.setdefault('id', doc.id)
+        return record
+
+    @classmethod
+    async def _copy_range(cls, target, collection: str, low: Optional[str], high: Optional[str],
+                          state: Dict[str, Any], progress: Dict[str, Any], page_size: int):
+        while not state['done']:
+            query = cls._range_query(collection, low, high, state['after'], page_size)
+            docs = await FirebaseService._execute(query.get)
+            records = [cls._record(collection, doc) for doc in docs]
+            await target.import_records(collection, records)
+
+            if docs:
+                state['after'] = docs[-1].id
+            state['count'] += len(records)
+            state['checksum'] = f"{(int(state['checksum'], 16) + sum(map(_checksum, records))) % _MODULUS:x}"
+            state['done'] = len(docs) < page_size
+            cls._save_checkpoint(progress)
+
+    @classmethod
+    async def run(cls, target, collections: Optional[List[str]] = None) -> Dict[str, int]:
+        """Copy (or finish copying) collections into `target`; returns rows copied per collection"""
+        collections = collections or list(COLLECTIONS)
+        unknown = [collection for collection in collections if collection not in COLLECTIONS]
+        if unknown:
+            raise ValueError(f"Unknown collections: {', '.join(unknown)}")
+        readers = int(os.getenv("MIGRATION_READERS", 8))
+        page_size = int(os.getenv("MIGRATION_PAGE_SIZE", 500))
+
+        progress = cls._load_checkpoint()
+        queue: asyncio.Queue = asyncio.Queue()
+        for collection in collections:
+            states = progress.setdefault(collection, {})
+            for low, high in _ranges():
+                state = states.setdefault(cls._range_key(low, high),
+                                          {'after': None, 'count': 0, 'checksum': '0', 'done': False})
+                if not state['done']:
+                    queue.put_nowait((collection, low, high, state))
+        pending = queue.qsize()
+        print(f"🚚 Migrating {', '.join(collections)}: {pending} id ranges left, {readers} readers")
+
+        async def reader():
+            while True:
+                try:
+                    collection, low, high, state = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await cls._copy_range(target, collection, low, high, state, progress, page_size)
+
+        tasks = [asyncio.create_task(reader()) for _ in range(readers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Stop the other readers if one fails, so none writes the checkpoint afterwards
+            for task in tasks:
+                task.cancel()
+        cls._save_checkpoint(progress)
+
+        copied = {collection: sum(state['count'] for state in progress[collection].values())
+                  for collection in collections}
+        for collection, count in copied.items():
+            print(f"✅ {collection}: {count} documents copied")
+        return copied
+
+    @classmethod
+    async def verify(cls, target, collections: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Compare Firestore, checkpoint and SQL counts and checksums per collection"""
+        collections = collections or list(COLLECTIONS)
+        progress = cls._load_checkpoint()
+        page_size = int(os.getenv("MIGRATION_PAGE_SIZE", 500))
+        results = {}
+        for collection in collections:
+            states = progress.get(collection, {})
+            copied = sum(state['count'] for state in states.values())
+            copied_checksum = sum(int(state['checksum'], 16) for state in states.values()) % _MODULUS
+
+            aggregate = await FirebaseService._execute(FirebaseService._db.collection(collection).count().get)
+            source_count = int(aggregate[0][0].value)
+
+            target_count, target_checksum = 0, 0
+            async for records in target.iter_imported_records(collection, page_size):
+                target_count += len(records)
+                target_checksum = (target_checksum + sum(map(_checksum, records))) % _MODULUS
+
+            complete = len(states) == len(_ranges()) and all(state['done'] for state in states.values())
+            results[collection] = {
+                'source_count': source_count,
+                'copied_count': copied,
+                'target_count': target_count,
+                'checksum_match': copied_checksum == target_checksum,
+                'ok': complete and source_count == copied == target_count and copied_checksum == target_checksum,
+            }
+            mark = "✅" if results[collection]['ok'] else "❌"
+            print(f"{mark} {collection}: Firestore {source_count}, copied {copied}, SQL {target_count}, "
+                  f"checksum {'matches' if copied_checksum == target_checksum else 'differs'}"
+                  f"{'' if complete else ' (copy incomplete)'}")
+        return results
@@ -0,0 +1,68 @@
+"""
+Text indexing helpers for ClipVault search.
+
+Turns free text into the terms stored in a document's `search_terms` array, so
+Firestore can answer `array_contains` queries from its own index:
+
+  w:<word>      every distinct lowercased word
+  t:<trigram>   distinct 3-character substrings of those words, up to the cap
+
+Word terms are never dropped, so whole-word search finds an item however long
+it is; only the trigram tier (substring search) is capped.
+
+Audit logs use prefix_terms() instead: every prefix of every word, so a single
+`array_contains` answers "a word starts with ..." queries.
+"""
+
+import re
+from typing import List, Set
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# English letters from most to least common; anything else counts as rare
+_LETTER_FREQUENCY = "etaoinsrhldcumfpgwybvkxjqz"
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words in order of appearance"""
+    return WORD_RE.findall((text or "").lower())
+
+
+def trigrams(word: str) -> Set[str]:
+    """All 3-character substrings of a word"""
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def index_terms(text: str, max_terms: int) -> List[str]:
+    """Prefixed index terms for a text: every word, then trigrams while the total
+    stays within max_terms"""
+    words = list(dict.fromkeys(tokenize(text)))
+    terms = [f"w:{word}" for word in words]
+    seen = set()
+    for word in words:
+        for trigram in sorted(trigrams(word)):
+            if len(terms) >= max_terms:
+                return terms
+            if trigram not in seen:
+                seen.add(trigram)
+                terms.append(f"t:{trigram}")
+    return terms
+
+
+def prefix_terms(text: str, max_terms: int, min_length: int = 2, max_length: int = 20) -> List[str]:
+    """Distinct word prefixes (min_length..max_length characters), shortest words first"""
+    terms = {}
+    for word in sorted(set(tokenize(text)), key=lambda word: (len(word), word)):
+        for end in range(min(len(word), max_length), min_length - 1, -1):
+            terms.setdefault(word[:end], None)
+    return list(terms)[:max_terms]
+
+
+def _rarity(trigram: str) -> int:
+    return sum(_LETTER_FREQUENCY.find(ch) if ch in _LETTER_FREQUENCY else len(_LETTER_FREQUENCY)
+               for ch in trigram)
+
+
+def rarest_trigram(word: str) -> str:
+    """Trigram of a word likely to have the shortest posting list"""
+    return max(sorted(trigrams(word)), key=_rarity)
@@ -0,0 +1,156 @@
+"""
+User-Agent parsing for ClipVault device detection.
+
+Each detection step (platform, device type, browser) is an if/elif chain of
+substring checks against the lowercased UA; the first branch that matches
+wins. Plain `in` checks are used rather than a rule table or a combined regex
+because both measured slower than the chain on strings this short (see
+benchmark_user_agent.py). Parsed results are kept in a bounded LRU keyed on
+the raw UA string (UA_CACHE_SIZE, default 1024), since a handful of UA strings
+account for nearly all logins, so the chain only runs on a cache miss.
+"""
+
+import os
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+DEVICE_NAME_PREFIXES = {"mobile": "Mobile ", "tablet": "Tablet ", "tv": "Smart TV "}
+
+
+def _platform(ua: str) -> Tuple[str, str]:
+    """(platform, OS version) of a lowercased UA
+
+    Versioned checks are nested under the substring they all contain, so a UA
+    only pays for the versions of its own family.
+    """
+    if "windows" in ua:
+        if "windows nt 10" in ua:
+            return "Windows", "10/11"
+        elif "windows nt 6.3" in ua:
+            return "Windows", "8.1"
+        elif "windows nt 6.2" in ua:
+            return "Windows", "8"
+        elif "windows nt 6.1" in ua:
+            return "Windows", "7"
+        return "Windows", "Unknown"
+    elif "mac os" in ua:
+        if "mac os x 10_15" in ua or "mac os x 10.15" in ua:
+            return "macOS", "Catalina"
+        elif "mac os x 11_" in ua or "mac os x 11." in ua:
+            return "macOS", "Big Sur"
+        elif "mac os x 12_" in ua or "mac os x 12." in ua:
+            return "macOS", "Monterey"
+        elif "mac os x 13_" in ua or "mac os x 13." in ua:
+            return "macOS", "Ventura"
+        elif "mac os x 14_" in ua or "mac os x 14." in ua:
+            return "macOS", "Sonoma"
+        return "macOS", "Unknown"
+    elif "macintosh" in ua:
+        return "macOS", "Unknown"
+    elif "ubuntu" in ua:
+        return "Ubuntu", "Unknown"
+    elif "linux" in ua:
+        return "Linux", "Unknown"
+    elif "android" in ua:
+        if "android 13" in ua:
+            return "Android", "13"
+        elif "android 12" in ua:
+            return "Android", "12"
+        elif "android 11" in ua:
+            return "Android", "11"
+        elif "android 10" in ua:
+            return "Android", "10"
+        return "Android", "Unknown"
+    elif "iphone" in ua:
+        if "iphone os 17_" in ua:
+            return "iOS", "17"
+        elif "iphone os 16_" in ua:
+            return "iOS", "16"
+        elif "iphone os 15_" in ua:
+            return "iOS", "15"
+        return "iOS", "Unknown"
+    elif "ipad" in ua:
+        return "iOS", "Unknown"
+    return "Unknown", "Unknown"
+
+
+def _device_type(ua: str) -> str:
+    """Device type of a lowercased UA"""
+    if "mobile" in ua or "android" in ua or "iphone" in ua:
+        return "mobile"
+    elif "tablet" in ua or "ipad" in ua:
+        return "tablet"
+    elif "tv" in ua or "smart" in ua:
+        return "tv"
+    return "desktop"
+
+
+def _browser(ua: str) -> Tuple[str, str]:
+    """(browser, case-sensitive marker preceding the version in the raw UA) of a lowercased UA"""
+    if "edg/" in ua:
+        return "Edge", "Edg/"
+    elif "chrome/" in ua and "edg" not in ua:
+        return "Chrome", "Chrome/"
+    elif "firefox/" in ua:
+        return "Firefox", "Firefox/"
+    elif "safari/" in ua and "chrome" not in ua:
+        return "Safari", "Version/"
+    elif "opera" in ua:
+        return "Opera", ""
+    return "Unknown", ""
+
+
+def _version_after(user_agent: str, marker: str) -> Optional[str]:
+    """First whitespace-separated token between the first and second occurrence of marker"""
+    if not marker:
+        return None
+    segment = user_agent.partition(marker)
+    if not segment[1]:
+        return None
+    tokens = segment[2].partition(marker)[0].split()
+    return tokens[0] if tokens else None
+
+
+@lru_cache(maxsize=int(os.getenv("UA_CACHE_SIZE", 1024)))
+def _parse(user_agent: str) -> Dict[str, str]:
+    user_agent_lower = user_agent.lower()
+    platform, os_version = _platform(user_agent_lower)
+    device_type = _device_type(user_agent_lower)
+    browser, version_marker = _browser(user_agent_lower)
+    browser_version = _version_after(user_agent, version_marker) or "Unknown"
+
+    device_name = platform
+    if os_version != "Unknown":
+        device_name += f" {os_version}"
+    if browser != "Unknown":
+        device_name += f" - {browser}"
+        if browser_version != "Unknown":
+            device_name += f" {browser_version.split('.')[0]}"  # Just major version
+    device_name = DEVICE_NAME_PREFIXES.get(device_type, "") + device_name
+
+    return {
+        "device_name": device_name,
+        "device_type": device_type,
+        "platform": platform,
+        "browser": browser,
+        "browser_version": browser_version,
+        "os_version": os_version
+    }
+
+
+def parse_user_agent(user_agent: str) -> Dict[str, str]:
+    """Device name, type, platform, browser details and OS version for a User-Agent"""
+    if not user_agent or user_agent == "unknown":
+        return {
+            "device_name": "Unknown Device",
+            "device_type": "desktop",
+            "platform": "Unknown",
+            "browser": "Unknown",
+            "os_version": "Unknown"
+        }
+    return dict(_parse(user_agent))
+
+
+def cache_info():
+    """Hit/miss counters of the parse cache"""
+    return _parse.cache_info()
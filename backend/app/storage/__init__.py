@@ -0,0 +1,29 @@
+from app.storage.base import StorageEngine, WriteBatch
+
+ENGINES = ("firestore", "memory", "sql", "log")
+
+
+def create_engine(name: str, **options) -> StorageEngine:
+    """Build the storage engine called `name` (see STORAGE_ENGINE)
+
+    The Firestore engine takes the connected client as options: db, mode and
+    executor (see FirestoreEngine). The SQL engine connects to DATABASE_URL
+    (see SqlEngine) and the log engine also keeps clipboard items in
+    LOG_STORAGE_DIR (see LogEngine); call open() on them before use.
+    """
+    if name == "firestore":
+        from app.storage.firestore import FirestoreEngine
+        return FirestoreEngine(**options)
+    if name == "memory":
+        from app.storage.memory import MemoryEngine
+        return MemoryEngine()
+    if name == "sql":
+        from app.storage.sql import SqlEngine
+        return SqlEngine(**options)
+    if name == "log":
+        from app.storage.log import LogEngine
+        return LogEngine(**options)
+    raise ValueError(f"Unknown STORAGE_ENGINE '{name}', expected one of: {', '.join(ENGINES)}")
+
+
+__all__ = ["ENGINES", "StorageEngine", "WriteBatch", "create_engine"]
@@ -0,0 +1,450 @@
+"""
+Storage engine interface for ClipVault.
+
+FirebaseService is a facade over one StorageEngine, chosen with STORAGE_ENGINE
+(see app.storage.create_engine). Engines store and query records; the facade
+keeps everything that does not depend on where records live: caching, password
+hashing, Firebase Auth, id stamping and the audit hash-chain algorithms
+(sealing, proofs, verification), which only use the chain primitives below.
+
+Records are plain dicts. Timestamps go in as UTC datetimes; reads return the
+JSON-ready API form (ISO strings) unless a method says it returns raw records.
+
+The module-level helpers are shared by every engine so they page, score and
+summarize identically.
+"""
+
+import base64
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.services import audit_chain, text_index
+
+
+# Cursors and timestamps
+
+def as_utc(moment: datetime) -> datetime:
+    """A datetime in UTC; naive datetimes are taken to be UTC already"""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def encode_cursor(created_at: Any, record_id: str) -> str:
+    """Encode a (created_at, id) keyset position as an opaque cursor token"""
+    if hasattr(created_at, 'isoformat'):
+        created_at = created_at.isoformat()
+    payload = json.dumps({'c': created_at, 'i': record_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor token into (created_at, id), raising ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return as_utc(datetime.fromisoformat(payload['c'])), str(payload['i'])
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+def hour_key(moment: datetime) -> str:
+    """Bucket id of the UTC hour containing `moment`"""
+    return moment.strftime('%Y%m%d%H')
+
+
+def recent_hours(count: int, now: Optional[datetime] = None) -> List[str]:
+    """Bucket ids of the current hour and the `count - 1` before it, newest first"""
+    now = now or datetime.utcnow()
+    return [hour_key(now - timedelta(hours=h)) for h in range(count)]
+
+
+def apply_update(record: Dict[str, Any], fields: Dict[str, Any]):
+    """Apply Firestore-style update fields to a record ("a.b" paths set nested values)"""
+    for path, value in fields.items():
+        target = record
+        *parents, name = path.split('.')
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = value
+
+
+def to_api(record: Dict[str, Any], hidden: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    """Copy of a record with datetimes as ISO strings and index-only fields removed"""
+    data = {key: value for key, value in record.items() if key not in hidden}
+    for field in ('created_at', 'last_seen', 'updated_at', 'last_copied_at'):
+        if hasattr(data.get(field), 'isoformat'):
+            data[field] = data[field].isoformat()
+    return data
+
+
+# Clipboard
+
+def clipboard_item_to_api(record: Dict[str, Any]) -> Dict[str, Any]:
+    data = to_api(record, hidden=('search_terms', 'content_hash'))
+    # Items stored before repeated copies were collapsed count as copied once
+    data.setdefault('copy_count', 1)
+    data.setdefault('last_copied_at', data.get('created_at'))
+    return data
+
+
+def split_clipboard_content(item: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+    """An item's record as stored, without its content, and the content for the blob store"""
+    record = {key: value for key, value in item.items() if key != 'content'}
+    return record, item.get('content') or ''
+
+
+def clipboard_copy(record: Dict[str, Any]) -> Dict[str, Any]:
+    """What create_clipboard_item returns for a copy collapsed into `record`"""
+    return {field: record[field] for field in ('id', 'created_at', 'copy_count', 'last_copied_at')}
+
+
+def clipboard_search_tiers(tokens: List[str]) -> Tuple[str, List[str]]:
+    """The driving token of a search and its index terms, best tier first
+
+        tier 0  items containing the longest query token as a whole word
+        tier 1  items containing it only as a substring, found via its rarest trigram
+    """
+    primary = max(tokens, key=len)
+    tiers = [f"w:{primary}"]
+    if len(primary) >= 3:
+        tiers.append(f"t:{text_index.rarest_trigram(primary)}")
+    return primary, tiers
+
+
+def clipboard_search_score(content: str, tokens: List[str], primary: str, tier: int,
+                           tier_count: int) -> Optional[float]:
+    """Relevance of an item found in `tier`, or None if it does not match or was
+    already returned by an earlier tier"""
+    content = (content or '').lower()
+    words = set(text_index.tokenize(content))
+    if tier == 1 and primary in words:
+        return None
+    if not all(token in content for token in tokens):
+        return None
+    occurrences = sum(content.count(token) for token in tokens)
+    exact_words = sum(1 for token in tokens if token in words)
+    return round((tier_count - tier) * 10 + exact_words + min(occurrences, 10) / 10, 2)
+
+
+def clipboard_stats_result(total_items: int, total_size_bytes: int, content_types: Dict[str, int],
+                           recent_items: int, unique_users: int, user_id: Optional[str]) -> Dict[str, Any]:
+    return {
+        "total_items": total_items,
+        "text_items": content_types.get('text', 0),
+        "image_items": content_types.get('image', 0),
+        "file_items": content_types.get('file', 0),
+        "recent_items": recent_items,
+        "total_size_mb": round(total_size_bytes / (1024 * 1024), 2),
+        "sync_count": total_items,  # Assuming each item represents a sync
+        "unique_users": unique_users,
+        "is_shared": user_id is None
+    }
+
+
+# Audit logs
+
+def audit_log_to_api(record: Dict[str, Any]) -> Dict[str, Any]:
+    data = to_api(record, hidden=('search_tokens',))
+    if 'created_at' in data:
+        data['timestamp'] = data['created_at']  # Also set timestamp for compatibility
+    return data
+
+
+def audit_search_text(log_data: Dict[str, Any]) -> str:
+    return f"{log_data.get('action', '')} {log_data.get('details', '')} {log_data.get('user', '')}"
+
+
+def audit_search_matcher(search: Optional[str]):
+    """(tokens, predicate): a log matches when every search word starts one of its words"""
+    tokens = list(dict.fromkeys(text_index.tokenize(search or '')))
+
+    def matches(log_data: Dict[str, Any]) -> bool:
+        words = text_index.tokenize(audit_search_text(log_data))
+        return all(any(word.startswith(token) for word in words) for token in tokens)
+    return tokens, matches
+
+
+def assign_audit_chain(logs: List[Dict[str, Any]], heads: Dict[str, Dict[str, Any]],
+                       checkpoint_size: int) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """Give each user's logs the next `seq` numbers and their leaf hash
+
+    `heads` maps user_id to its current chain head ({} for a new chain). Returns
+    the updated heads of the users written to and the users whose chain
+    completed a checkpoint block, which the caller seals.
+    """
+    updated: Dict[str, Dict[str, Any]] = {}
+    for log_data in logs:
+        user_id = log_data.get('user_id')
+        if not user_id:
+            continue
+        if user_id not in updated:
+            head = heads.get(user_id) or {}
+            updated[user_id] = {'user_id': user_id, 'next_seq': head.get('next_seq', 0),
+                                'checkpoint_size': head.get('checkpoint_size', checkpoint_size)}
+        log_data['seq'] = updated[user_id]['next_seq']
+        log_data['hash_chain'] = audit_chain.leaf_hash(log_data)
+        updated[user_id]['next_seq'] += 1
+
+    completed = [user_id for user_id, head in updated.items()
+                 if head['next_seq'] // head['checkpoint_size']
+                 > (heads.get(user_id) or {}).get('next_seq', 0) // head['checkpoint_size']]
+    return updated, completed
+
+
+def tally_audit_stats(counts: Dict[tuple, Dict[str, Any]], log_data: Dict[str, Any]):
+    """Add one audit log to rollups keyed ('total', user_id) and ('hour', user_id, hour)"""
+    user_id = log_data.get('user_id')
+    if not user_id:
+        return
+    status = log_data.get('status') or 'info'
+    for key in (('total', user_id), ('hour', user_id, hour_key(log_data['created_at']))):
+        entry = counts.setdefault(key, {'total': 0, 'by_status': {}})
+        entry['total'] += 1
+        entry['by_status'][status] = entry['by_status'].get(status, 0) + 1
+
+
+def audit_stats_result(totals: Dict[str, Any], hourly: Dict[str, Dict[str, int]], hours: List[str],
+                       window_hours: int) -> Dict[str, Any]:
+    """Stats response from all-time totals and per-hour status counts
+
+    `hours` are bucket ids newest first (see recent_hours); a window of N hours
+    sums the N + 1 buckets overlapping it, so counts are exact to the hour.
+    """
+    def window(n: int) -> Dict[str, int]:
+        by_status: Dict[str, int] = {}
+        for hour in hours[:n + 1]:
+            for status, count in (hourly.get(hour) or {}).items():
+                by_status[status] = by_status.get(status, 0) + count
+        return by_status
+
+    return audit_stats_response(totals.get('by_status') or {}, window(24), window(window_hours), window_hours)
+
+
+def audit_stats_response(by_status: Dict[str, int], last_24h_by_status: Dict[str, int],
+                         window_by_status: Dict[str, int], window_hours: int) -> Dict[str, Any]:
+    """Stats response from status counts: all time, the last 24h and the requested window"""
+    total_events = sum(by_status.values())
+    success_rate = (by_status.get('success', 0) / total_events * 100) if total_events > 0 else 100.0
+    return {
+        "total_events": total_events,
+        "success_rate": round(success_rate, 1),
+        "security_events": by_status.get('error', 0) + by_status.get('warning', 0),
+        "failed_attempts": by_status.get('error', 0),
+        "last_24h": sum(last_24h_by_status.values()),
+        "window_hours": window_hours,
+        "window_events": sum(window_by_status.values()),
+        "window_by_status": window_by_status
+    }
+
+
+class WriteBatch(ABC):
+    """User and device writes staged for one atomic commit (see UnitOfWork)"""
+
+    @abstractmethod
+    def create_user(self, profile: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def create_device(self, device: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def update_device(self, device_id: str, fields: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def commit(self):
+        ...
+
+
+class StorageEngine(ABC):
+    """Where FirebaseService keeps users, devices, clipboard items, security events and audit logs"""
+
+    name = "base"
+
+    async def open(self):
+        """Connect and prepare storage (tables, indexes) before first use"""
+
+    async def close(self):
+        """Release connections and workers"""
+
+    @abstractmethod
+    def batch(self) -> WriteBatch:
+        """A new WriteBatch for user and device writes committed together"""
+
+    # Users (raw records include password_hash)
+
+    @abstractmethod
+    async def create_user(self, profile: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Raw user record"""
+
+    @abstractmethod
+    async def find_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Raw user record"""
+
+    @abstractmethod
+    async def update_user(self, user_id: str, fields: Dict[str, Any]):
+        ...
+
+    # Devices
+
+    @abstractmethod
+    async def create_device(self, device: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def list_user_devices(self, user_id: str) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def find_device_by_signature(self, user_id: str, device_signature: str) -> Optional[Dict[str, Any]]:
+        """A device whose metadata.device_signature matches, whatever its id"""
+
+    @abstractmethod
+    async def update_device(self, device_id: str, fields: Dict[str, Any]):
+        """Update fields of an existing device; raises if it does not exist"""
+
+    @abstractmethod
+    async def delete_device(self, device_id: str):
+        ...
+
+    # Clipboard items
+
+    @abstractmethod
+    async def create_clipboard_item(self, item: Dict[str, Any],
+                                    copied_since: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        """Store an item (id, created_at, content_hash, size_bytes, copy_count and
+        last_copied_at already set) and count it in the stats
+
+        The content is stored once per content_hash in a blob that counts the
+        items referencing it; the item record keeps only the hash. If the same
+        user already has an item with that content created at or after
+        `copied_since`, nothing is stored: that item's copy_count and
+        last_copied_at are bumped and returned as clipboard_copy() of it.
+        Returns None when a new item was stored.
+
+        Items stored before content addressing keep their content inline; reads
+        return the content either way.
+        """
+
+    @abstractmethod
+    async def get_clipboard_page(self, user_id: Optional[str], limit: int, offset: int = 0,
+                                 cursor: Optional[str] = None) -> Dict[str, Any]:
+        """{'items', 'next_cursor'}, newest first; every user's items when user_id is None"""
+
+    @abstractmethod
+    async def search_clipboard_items(self, query_text: str, user_id: Optional[str], limit: int,
+                                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        """{'items', 'next_cursor'}; see FirebaseService.search_clipboard_items"""
+
+    @abstractmethod
+    async def get_clipboard_stats(self, user_id: Optional[str]) -> Dict[str, Any]:
+        """See clipboard_stats_result"""
+
+    @abstractmethod
+    async def delete_clipboard_item(self, item_id: str):
+        """Delete an item and release its reference to its content blob"""
+
+    async def reindex_clipboard_search(self, page_size: int = 500) -> int:
+        """Rebuild search indexes from the stored items; returns items indexed"""
+        return 0
+
+    async def rebuild_clipboard_stats(self, page_size: int = 500) -> Dict[str, int]:
+        """Recompute clipboard statistics from the stored items"""
+        return {'items': 0, 'users': 0}
+
+    # Security events
+
+    @abstractmethod
+    async def create_security_event(self, event: Dict[str, Any]):
+        ...
+
+    # Audit logs
+
+    @abstractmethod
+    async def write_audit_logs(self, logs: List[Dict[str, Any]], checkpoint_size: int) -> List[str]:
+        """Store stamped logs atomically with their chain positions and stats rollups
+
+        Reserves each user's next seq numbers (see assign_audit_chain) in the same
+        atomic write. Returns the users whose chain completed a checkpoint block.
+        """
+
+    @abstractmethod
+    async def get_user_audit_page(self, user_id: str, limit: int, offset: int = 0,
+                                  status_filter: Optional[str] = None, search: Optional[str] = None,
+                                  cursor: Optional[str] = None) -> Dict[str, Any]:
+        """{'items', 'next_cursor'}, newest first; see FirebaseService.get_user_audit_page"""
+
+    @abstractmethod
+    def iter_user_audit_logs(self, user_id: str, status_filter: Optional[str] = None,
+                             page_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Every audit log of a user, newest first, reading one page at a time"""
+
+    @abstractmethod
+    async def get_audit_stats(self, user_id: str, window_hours: int = 24) -> Dict[str, Any]:
+        """See audit_stats_result"""
+
+    async def rebuild_audit_stats(self, page_size: int = 500) -> Dict[str, int]:
+        """Recompute audit stats rollups from the stored logs"""
+        return {'logs': 0, 'users': 0}
+
+    async def reindex_audit_search(self, page_size: int = 500) -> int:
+        """Rebuild audit search indexes from the stored logs; returns logs indexed"""
+        return 0
+
+    # Audit hash chain primitives
+
+    @abstractmethod
+    async def get_audit_log(self, log_id: str) -> Optional[Dict[str, Any]]:
+        """Raw audit log"""
+
+    @abstractmethod
+    async def get_audit_chain_heads(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Chain heads (next_seq, checkpoint_size, sealed_blocks, last_chain) of users that have one"""
+
+    @abstractmethod
+    async def get_audit_logs_by_seq(self, user_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+        """A user's raw chained logs with start <= seq < end, in seq order"""
+
+    @abstractmethod
+    async def get_audit_checkpoints(self, user_id: str, blocks: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Existing checkpoints among `blocks`, by block index"""
+
+    @abstractmethod
+    async def save_audit_checkpoint(self, user_id: str, checkpoint: Dict[str, Any]):
+        """Store a checkpoint and record it as the chain head's latest sealed block"""
+
+    # Audit archive
+
+    @abstractmethod
+    def iter_audit_logs_before(self, cutoff: datetime, page_size: int = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Pages of raw audit logs (all users) created before `cutoff`, newest first"""
+
+    @abstractmethod
+    async def delete_audit_logs(self, log_ids: List[str]):
+        ...
+
+    @abstractmethod
+    async def add_audit_archive_segment(self, segment: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def get_audit_archive_segments(self, user_id: str) -> List[Dict[str, Any]]:
+        """A user's archived segments, newest first"""
+
+    # Coordination
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, holder: str, ttl_seconds: float) -> bool:
+        """Take or renew the named lease unless another holder's is still valid"""
@@ -0,0 +1,841 @@
+import os
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from firebase_admin import firestore
+
+from app.services import text_index
+from app.storage.base import (
+    StorageEngine, WriteBatch, as_utc, assign_audit_chain, audit_log_to_api, audit_search_matcher,
+    audit_search_text, audit_stats_result, clipboard_copy, clipboard_item_to_api, clipboard_search_score,
+    clipboard_search_tiers, clipboard_stats_result, decode_cursor, encode_cursor, hour_key,
+    recent_hours, split_clipboard_content, tally_audit_stats, to_api
+)
+
+
+class _FirestoreWriteBatch(WriteBatch):
+    """A Firestore WriteBatch of user and device writes"""
+
+    def __init__(self, engine: "FirestoreEngine"):
+        self._engine = engine
+        self._batch = engine._db.batch()
+
+    def create_user(self, profile: Dict[str, Any]):
+        self._batch.set(self._engine._db.collection('users').document(profile['id']), profile)
+
+    def create_device(self, device: Dict[str, Any]):
+        self._batch.set(self._engine._db.collection('devices').document(device['id']), device)
+
+    def update_device(self, device_id: str, fields: Dict[str, Any]):
+        self._batch.update(self._engine._db.collection('devices').document(device_id), fields)
+
+    async def commit(self):
+        await self._engine._execute(self._batch.commit)
+
+
+class FirestoreEngine(StorageEngine):
+    """Cloud Firestore storage
+
+    `mode` selects how calls are made: "async" awaits the native AsyncClient on
+    the event loop, "thread" runs the blocking client in `executor`.
+
+    Collections beyond the entity collections (users, devices, clipboard_items,
+    security_events, audit_logs):
+
+        clipboard_stats/shared/shards/{n}              totals and unique_users for all users,
+                                                       spread over CLIPBOARD_STATS_SHARDS docs
+                                                       to avoid the per-document write rate limit
+        clipboard_stats/user_{user_id}                 totals for one user
+        clipboard_stats_hourly/{scope}_{YYYYMMDD}      items created per hour of one UTC day,
+                                                       in the `hours` map keyed by HH
+        clipboard_blobs/{content_hash}                 content of clipboard items, stored once:
+                                                       content, size_bytes, refcount
+        audit_stats/user_{user_id}                     all-time audit totals per status
+        audit_stats_hourly/user_{user_id}_{YYYYMMDDHH} audit totals per status for one hour
+        audit_chains/user_{user_id}                    chain head: next_seq, checkpoint_size,
+                                                       sealed_blocks, last_chain
+        audit_checkpoints/user_{user_id}_{block}       Merkle tree and chain hash of a block
+        audit_archive_segments/{segment_id}            time index of archived segment files
+        leases/{name}                                  job leases
+
+    Counters and rollups are written in the same batch or transaction as the
+    records they count, so stats never scan items or logs. Hour buckets are
+    addressed by id, so a window of N hours is N point reads (clipboard hours
+    are grouped by day, so the last 24h of clipboard stats is two reads).
+    """
+
+    name = "firestore"
+
+    def __init__(self, db, mode: str, executor: ThreadPoolExecutor):
+        self._db = db
+        self.mode = mode
+        self._executor = executor
+
+    async def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        if self.mode == "async" and self._db:
+            self._db.close()
+
+    async def _run_in_executor(self, func, *args, **kwargs):
+        """Run Firestore operations in thread executor"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            lambda: func(*args, **kwargs)
+        )
+
+    async def _execute(self, func, *args, **kwargs):
+        """Run a Firestore operation on the configured mode
+
+        `func` is a bound method of a client object (e.g. `doc_ref.get`). In async
+        mode it returns a coroutine that is awaited directly; in thread mode it
+        blocks, so it is dispatched to the executor.
+        """
+        if self.mode == "async":
+            return await func(*args, **kwargs)
+        return await self._run_in_executor(func, *args, **kwargs)
+
+    async def _get_all(self, refs: List) -> List:
+        """Fetch many documents in one round trip in either mode"""
+        if not refs:
+            return []
+        if self.mode == "async":
+            return [snapshot async for snapshot in self._db.get_all(refs)]
+        return await self._run_in_executor(lambda: list(self._db.get_all(refs)))
+
+    async def _run_transaction(self, refs: List, apply, query=None):
+        """Read `refs` and stage writes in one Firestore transaction in either mode
+
+        `apply(transaction, snapshots)` stages writes with transaction.set() and
+        returns the result; it runs again if the transaction is retried on
+        contention, so it must not have other side effects. The documents
+        `query` returns, if given, follow the snapshots of `refs`.
+        """
+        if self.mode == "async":
+            @firestore.async_transactional
+            async def run(transaction):
+                snapshots = await asyncio.gather(*(ref.get(transaction=transaction) for ref in refs))
+                if query is not None:
+                    snapshots += await query.get(transaction=transaction)
+                return apply(transaction, snapshots)
+            return await run(self._db.transaction())
+
+        @firestore.transactional
+        def run_blocking(transaction):
+            snapshots = list(transaction.get_all(refs)) if refs else []
+            if query is not None:
+                snapshots += list(query.get(transaction=transaction))
+            return apply(transaction, snapshots)
+        return await self._run_in_executor(run_blocking, self._db.transaction())
+
+    @staticmethod
+    def _order_newest_first(query):
+        """Order a query by (created_at, id) descending, the keyset used by cursors"""
+        query = query.order_by('created_at', direction=firestore.Query.DESCENDING)
+        return query.order_by('__name__', direction=firestore.Query.DESCENDING)
+
+    @staticmethod
+    def _position(cursor: str) -> Dict[str, Any]:
+        """start_after() values of a cursor token"""
+        created_at, record_id = decode_cursor(cursor)
+        return {'created_at': created_at, '__name__': record_id}
+
+    def batch(self) -> WriteBatch:
+        return _FirestoreWriteBatch(self)
+
+    # Users
+
+    async def create_user(self, profile: Dict[str, Any]):
+        await self._execute(self._db.collection('users').document(profile['id']).set, profile)
+
+    async def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        doc = await self._execute(self._db.collection('users').document(user_id).get)
+        return doc.to_dict() if doc.exists else None
+
+    async def find_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        query = self._db.collection('users').where('email', '==', email).limit(1)
+        docs = await self._execute(query.get)
+        for doc in docs:
+            return dict(doc.to_dict(), id=doc.to_dict().get('id', doc.id))
+        return None
+
+    async def update_user(self, user_id: str, fields: Dict[str, Any]):
+        await self._execute(self._db.collection('users').document(user_id).update, fields)
+
+    # Devices
+
+    @staticmethod
+    def _device_from_doc(doc) -> Dict[str, Any]:
+        return to_api(dict(doc.to_dict(), id=doc.id))
+
+    async def create_device(self, device: Dict[str, Any]):
+        await self._execute(self._db.collection('devices').document(device['id']).set, device)
+
+    async def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
+        doc = await self._execute(self._db.collection('devices').document(device_id).get)
+        return self._device_from_doc(doc) if doc.exists else None
+
+    async def list_user_devices(self, user_id: str) -> List[Dict[str, Any]]:
+        docs = await self._execute(self._db.collection('devices').where('user_id', '==', user_id).get)
+        return [self._device_from_doc(doc) for doc in docs]
+
+    async def find_device_by_signature(self, user_id: str, device_signature: str) -> Optional[Dict[str, Any]]:
+        # Indexed on (user_id, metadata.device_signature)
+        query = (self._db.collection('devices')
+                 .where('user_id', '==', user_id)
+                 .where('metadata.device_signature', '==', device_signature)
+                 .limit(1))
+        docs = await self._execute(query.get)
+        for doc in docs:
+            return self._device_from_doc(doc)
+        return None
+
+    async def update_device(self, device_id: str, fields: Dict[str, Any]):
+        await self._execute(self._db.collection('devices').document(device_id).update, fields)
+
+    async def delete_device(self, device_id: str):
+        await self._execute(self._db.collection('devices').document(device_id).delete)
+
+    # Clipboard items
+
+    @classmethod
+    def _search_max_terms(cls) -> int:
+        return int(os.getenv("SEARCH_MAX_TERMS_PER_ITEM", 300))
+
+    @classmethod
+    def _stats_shard_count(cls) -> int:
+        return max(1, int(os.getenv("CLIPBOARD_STATS_SHARDS", 10)))
+
+    def _clipboard_stats_ref(self, user_id: str):
+        return self._db.collection('clipboard_stats').document(f"user_{user_id}")
+
+    def _clipboard_hourly_ref(self, scope: str, day: str):
+        return self._db.collection('clipboard_stats_hourly').document(f"{scope}_{day}")
+
+    def _clipboard_stats_updates(self, item: Dict[str, Any], new_user: bool) -> List:
+        """Counter increments (doc ref, fields) for one new clipboard item
+
+        `new_user` counts the item's user in unique_users (their first item).
+        """
+        content_type = item.get('content_type') or 'text'
+        size_bytes = item.get('size_bytes', len((item.get('content') or '').encode('utf-8')))
+        hour = hour_key(item['created_at'])
+        day, hour_of_day = hour[:8], hour[8:]
+        shard = random.randrange(self._stats_shard_count())
+        user_id = item.get('user_id')
+
+        totals = {
+            'total_items': firestore.Increment(1),
+            'total_size_bytes': firestore.Increment(size_bytes),
+            'content_types': {content_type: firestore.Increment(1)}
+        }
+        shared = dict(totals, unique_users=firestore.Increment(1)) if new_user else totals
+        counted = {'day': day, 'hours': {hour_of_day: firestore.Increment(1)}}
+        stats = self._db.collection('clipboard_stats')
+
+        updates = [
+            (stats.document('shared').collection('shards').document(str(shard)), shared),
+            (self._clipboard_hourly_ref('shared', day), dict(counted, scope='shared'))
+        ]
+        if user_id:
+            updates.append((self._clipboard_stats_ref(user_id), dict(totals, scope='user', user_id=user_id)))
+            updates.append((self._clipboard_hourly_ref(f"user_{user_id}", day),
+                            dict(counted, scope='user', user_id=user_id)))
+        return updates
+
+    async def create_clipboard_item(self, item: Dict[str, Any],
+                                    copied_since: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        # One transaction reads the blob and the user's newest item with the same
+        # content in the window (composite index on user_id, content_hash,
+        # created_at), so concurrent copies of the same content collapse into one
+        # item. The content is only written when its blob is created, and the
+        # user's stats doc is read to count the user's first item in unique_users.
+        record, content = split_clipboard_content(item)
+        items = self._db.collection('clipboard_items')
+        blob_ref = self._db.collection('clipboard_blobs').document(item['content_hash'])
+        refs = [blob_ref]
+        if item.get('user_id'):
+            refs.append(self._clipboard_stats_ref(item['user_id']))
+        recent = None
+        if copied_since:
+            recent = (items.where('user_id', '==', item.get('user_id'))
+                      .where('content_hash', '==', item['content_hash'])
+                      .where('created_at', '>=', as_utc(copied_since))
+                      .order_by('created_at', direction=firestore.Query.DESCENDING)
+                      .limit(1))
+
+        def apply(transaction, snapshots):
+            read = {snapshot.reference.path: snapshot for snapshot in snapshots[:len(refs)]}
+            blob, latest = read[blob_ref.path], snapshots[len(refs):]
+            if latest:
+                copied = dict(latest[0].to_dict(), id=latest[0].id)
+                copied['copy_count'] = copied.get('copy_count', 1) + 1
+                copied['last_copied_at'] = item['created_at']
+                transaction.update(latest[0].reference, {
+                    'copy_count': copied['copy_count'], 'last_copied_at': copied['last_copied_at']
+                })
+                return clipboard_copy(copied)
+
+            transaction.set(items.document(item['id']), dict(
+                record, search_terms=text_index.index_terms(content, self._search_max_terms())
+            ))
+            if blob.exists:
+                transaction.update(blob_ref, {'refcount': firestore.Increment(1)})
+            else:
+                transaction.create(blob_ref, {
+                    'content': content, 'size_bytes': len(content.encode('utf-8')), 'refcount': 1
+                })
+            new_user = len(refs) > 1 and not read[refs[1].path].exists
+            for ref, fields in self._clipboard_stats_updates(item, new_user):
+                transaction.set(ref, fields, merge=True)
+            return None
+
+        return await self._run_transaction(refs, apply, recent)
+
+    async def _clipboard_items_from_docs(self, docs: List) -> List[Dict[str, Any]]:
+        """API form of item documents, with their contents from one batched blob read"""
+        records = [dict(doc.to_dict(), id=doc.id) for doc in docs]
+        hashes = list(dict.fromkeys(record['content_hash'] for record in records
+                                    if 'content' not in record and record.get('content_hash')))
+        blobs = self._db.collection('clipboard_blobs')
+        contents = {snapshot.id: snapshot.get('content')
+                    for snapshot in await self._get_all([blobs.document(h) for h in hashes]) if snapshot.exists}
+        for record in records:
+            if 'content' not in record and record.get('content_hash'):
+                record['content'] = contents.get(record['content_hash'], '')
+        return [clipboard_item_to_api(record) for record in records]
+
+    async def get_clipboard_page(self, user_id: Optional[str], limit: int, offset: int = 0,
+                                 cursor: Optional[str] = None) -> Dict[str, Any]:
+        query = self._db.collection('clipboard_items')
+        if user_id:
+            query = query.where('user_id', '==', user_id)
+        query = self._order_newest_first(query)
+
+        if cursor:
+            query = query.start_after(self._position(cursor))
+        elif offset:
+            # Legacy offset paging: still billed per skipped document, prefer cursors
+            query = query.offset(offset)
+
+        # Fetch one extra document to learn whether another page exists
+        docs = await self._execute(query.limit(limit + 1).get)
+        has_more = len(docs) > limit
+        items = await self._clipboard_items_from_docs(docs[:limit])
+
+        next_cursor = None
+        if has_more and items:
+            next_cursor = encode_cursor(items[-1].get('created_at'), items[-1]['id'])
+        return {'items': items, 'next_cursor': next_cursor}
+
+    async def search_clipboard_items(self, query_text: str, user_id: Optional[str], limit: int,
+                                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        # Each item carries a `search_terms` array (see text_index), so Firestore's own
+        # index answers array_contains queries. Composite indexes on (search_terms,
+        # created_at) and (user_id, search_terms, created_at) cover both scopes. A
+        # search drives one query term per tier and verifies the rest in Python.
+        tokens = list(dict.fromkeys(text_index.tokenize(query_text)))
+        if not tokens:
+            return {'items': [], 'next_cursor': None}
+        primary, tiers = clipboard_search_tiers(tokens)
+
+        tier, position = 0, None
+        if cursor:
+            try:
+                tier_part, position_part = cursor.split('.', 1)
+                tier = int(tier_part)
+                position = self._position(position_part) if position_part else None
+            except ValueError:
+                raise ValueError("Invalid pagination cursor")
+            if not 0 <= tier < len(tiers):
+                raise ValueError("Invalid pagination cursor")
+
+        budget = int(os.getenv("SEARCH_SCAN_BUDGET", 500))
+        batch_size = min(budget, max(limit * 4, 50))
+        results = []
+        next_cursor = None
+        scanned = 0
+
+        while tier < len(tiers):
+            query = self._db.collection('clipboard_items').where('search_terms', 'array_contains', tiers[tier])
+            if user_id:
+                query = query.where('user_id', '==', user_id)
+            query = self._order_newest_first(query)
+            if position:
+                query = query.start_after(position)
+            docs = await self._execute(query.limit(batch_size).get)
+
+            for doc, item in zip(docs, await self._clipboard_items_from_docs(docs)):
+                scanned += 1
+                position = {'created_at': doc.get('created_at'), '__name__': doc.id}
+                score = clipboard_search_score(item.get('content'), tokens, primary, tier, len(tiers))
+                if score is not None:
+                    item['score'] = score
+                    results.append(item)
+                if len(results) >= limit or scanned >= budget:
+                    break
+
+            if len(results) >= limit or scanned >= budget:
+                if docs and (doc is not docs[-1] or len(docs) == batch_size):
+                    next_cursor = f"{tier}.{encode_cursor(position['created_at'], position['__name__'])}"
+                elif tier + 1 < len(tiers):
+                    next_cursor = f"{tier + 1}."
+                break
+            if len(docs) < batch_size:
+                tier, position = tier + 1, None
+
+        results.sort(key=lambda item: item['score'], reverse=True)
+        return {'items': results, 'next_cursor': next_cursor}
+
+    async def reindex_clipboard_search(self, page_size: int = 500) -> int:
+        max_terms = self._search_max_terms()
+        cursor = None
+        indexed = 0
+        while True:
+            page = await self.get_clipboard_page(None, limit=page_size, cursor=cursor)
+            batch = self._db.batch()
+            for item in page['items']:
+                terms = text_index.index_terms(item.get('content', ''), max_terms)
+                batch.update(self._db.collection('clipboard_items').document(item['id']), {'search_terms': terms})
+            if page['items']:
+                await self._execute(batch.commit)
+            indexed += len(page['items'])
+            cursor = page['next_cursor']
+            if not cursor:
+                return indexed
+
+    async def get_clipboard_stats(self, user_id: Optional[str]) -> Dict[str, Any]:
+        # Hour buckets overlapping the last 24h (hour resolution), in at most two day docs
+        hours = recent_hours(25)
+        days = sorted({hour[:8] for hour in hours})
+        stats = self._db.collection('clipboard_stats')
+
+        if user_id:
+            total_refs = [self._clipboard_stats_ref(user_id)]
+            day_refs = [self._clipboard_hourly_ref(f"user_{user_id}", day) for day in days]
+        else:
+            shards = range(self._stats_shard_count())
+            total_refs = [stats.document('shared').collection('shards').document(str(n)) for n in shards]
+            day_refs = [self._clipboard_hourly_ref('shared', day) for day in days]
+
+        snapshots = await self._get_all(total_refs + day_refs)
+
+        total_items = 0
+        total_size_bytes = 0
+        content_types: Dict[str, int] = {}
+        recent_items = 0
+        unique_users = 0
+        for snapshot in snapshots:
+            if not snapshot.exists:
+                continue
+            data = snapshot.to_dict()
+            if 'day' in data:
+                recent_items += sum(count for hour_of_day, count in (data.get('hours') or {}).items()
+                                    if data['day'] + hour_of_day in hours)
+                continue
+            unique_users += data.get('unique_users', 0)
+            total_items += data.get('total_items', 0)
+            total_size_bytes += data.get('total_size_bytes', 0)
+            for content_type, count in (data.get('content_types') or {}).items():
+                content_types[content_type] = content_types.get(content_type, 0) + count
+
+        if user_id:
+            unique_users = 1
+
+        return clipboard_stats_result(total_items, total_size_bytes, content_types, recent_items,
+                                      unique_users, user_id)
+
+    async def rebuild_clipboard_stats(self, page_size: int = 500) -> Dict[str, int]:
+        empty = lambda: {'total_items': 0, 'total_size_bytes': 0, 'content_types': {}}
+        shared = empty()
+        users: Dict[str, Dict[str, Any]] = {}
+        hours = recent_hours(25)
+        shared_hourly: Dict[str, int] = {}
+        user_hourly: Dict[tuple, int] = {}
+
+        cursor = None
+        scanned = 0
+        while True:
+            page = await self.get_clipboard_page(None, limit=page_size, cursor=cursor)
+            for item in page['items']:
+                content_type = item.get('content_type') or 'text'
+                size_bytes = item.get('size_bytes', len((item.get('content') or '').encode('utf-8')))
+                user_id = item.get('user_id')
+                targets = [shared] + ([users.setdefault(user_id, empty())] if user_id else [])
+                for totals in targets:
+                    totals['total_items'] += 1
+                    totals['total_size_bytes'] += size_bytes
+                    totals['content_types'][content_type] = totals['content_types'].get(content_type, 0) + 1
+
+                try:
+                    hour = hour_key(datetime.fromisoformat(str(item.get('created_at'))))
+                except ValueError:
+                    continue
+                if hour in hours:
+                    shared_hourly[hour] = shared_hourly.get(hour, 0) + 1
+                    if user_id:
+                        user_hourly[(user_id, hour)] = user_hourly.get((user_id, hour), 0) + 1
+            scanned += len(page['items'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+
+        stats = self._db.collection('clipboard_stats')
+        shards = range(self._stats_shard_count())
+
+        shared['unique_users'] = len(users)
+
+        # Everything lands on shard 0; the other shards are reset to zero
+        writes = [(stats.document('shared').collection('shards').document(str(n)), shared if n == 0 else empty())
+                  for n in shards]
+        writes += [(self._clipboard_stats_ref(uid), dict(totals, scope='user', user_id=uid))
+                   for uid, totals in users.items()]
+        writes += [(self._clipboard_hourly_ref('shared', day), {
+            'scope': 'shared', 'day': day,
+            'hours': {hour[8:]: count for hour, count in shared_hourly.items() if hour[:8] == day}
+        }) for day in sorted({hour[:8] for hour in hours})]
+        user_days: Dict[tuple, Dict[str, int]] = {}
+        for (uid, hour), count in user_hourly.items():
+            user_days.setdefault((uid, hour[:8]), {})[hour[8:]] = count
+        writes += [(self._clipboard_hourly_ref(f"user_{uid}", day),
+                    {'scope': 'user', 'user_id': uid, 'day': day, 'hours': counts})
+                   for (uid, day), counts in user_days.items()]
+        await self._commit_sets(writes)
+        return {'items': scanned, 'users': len(users)}
+
+    async def _commit_sets(self, writes: List):
+        """Overwrite documents in batches (Firestore batches are capped at 500 writes)"""
+        for start in range(0, len(writes), 500):
+            batch = self._db.batch()
+            for ref, fields in writes[start:start + 500]:
+                batch.set(ref, fields)
+            await self._execute(batch.commit)
+
+    async def delete_clipboard_item(self, item_id: str):
+        item_ref = self._db.collection('clipboard_items').document(item_id)
+        snapshot = await self._execute(item_ref.get)
+        if not snapshot.exists:
+            return
+        item = snapshot.to_dict()
+        if not item.get('content_hash'):
+            await self._execute(item_ref.delete)
+            return
+        blob_ref = self._db.collection('clipboard_blobs').document(item['content_hash'])
+
+        def apply(transaction, snapshots):
+            if not snapshots[0].exists:
+                return
+            transaction.delete(item_ref)
+            refcount = snapshots[1].get('refcount') if snapshots[1].exists else 0
+            if refcount > 1:
+                transaction.update(blob_ref, {'refcount': refcount - 1})
+            elif snapshots[1].exists:
+                transaction.delete(blob_ref)
+
+        await self._run_transaction([item_ref, blob_ref], apply)
+
+    # Security events
+
+    async def create_security_event(self, event: Dict[str, Any]):
+        await self._execute(self._db.collection('security_events').document(event['id']).set, event)
+
+    # Audit logs
+
+    @classmethod
+    def _audit_search_tokens(cls, log_data: Dict[str, Any]) -> List[str]:
+        """Word prefixes indexed in `search_tokens` for the audit log search"""
+        return text_index.prefix_terms(audit_search_text(log_data),
+                                       int(os.getenv("AUDIT_SEARCH_MAX_TERMS", 200)))
+
+    def _audit_stats_ref(self, key: tuple):
+        if key[0] == 'total':
+            return self._db.collection('audit_stats').document(f"user_{key[1]}")
+        return self._db.collection('audit_stats_hourly').document(f"user_{key[1]}_{key[2]}")
+
+    def _audit_stats_updates(self, logs: List[Dict[str, Any]]) -> List:
+        """Counter increments (doc ref, fields) for new audit logs, one per rollup doc"""
+        counts: Dict[tuple, Dict[str, Any]] = {}
+        for log_data in logs:
+            tally_audit_stats(counts, log_data)
+        updates = []
+        for key, entry in counts.items():
+            fields = {'user_id': key[1],
+                      'total': firestore.Increment(entry['total']),
+                      'by_status': {s: firestore.Increment(n) for s, n in entry['by_status'].items()}}
+            if key[0] == 'hour':
+                fields['hour'] = key[2]
+            updates.append((self._audit_stats_ref(key), fields))
+        return updates
+
+    @staticmethod
+    def _audit_write_keys(log_data: Dict[str, Any]) -> set:
+        """Documents other than the log itself that writing it touches"""
+        user_id = log_data.get('user_id')
+        if not user_id:
+            return set()
+        return {('total', user_id), ('hour', user_id, hour_key(log_data['created_at'])), ('chain', user_id)}
+
+    async def write_audit_logs(self, logs: List[Dict[str, Any]], checkpoint_size: int) -> List[str]:
+        # Each transaction holds its logs, one increment per rollup document and one
+        # chain head per user they touch, within Firestore's 500-write limit
+        completed: List[str] = []
+        chunk: List[Dict[str, Any]] = []
+        touched = set()
+        for log_data in logs:
+            keys = self._audit_write_keys(log_data)
+            if chunk and len(chunk) + 1 + len(touched | keys) > 500:
+                completed += await self._commit_audit_logs(chunk, checkpoint_size)
+                chunk, touched = [], set()
+            chunk.append(log_data)
+            touched |= keys
+        if chunk:
+            completed += await self._commit_audit_logs(chunk, checkpoint_size)
+        return list(dict.fromkeys(completed))
+
+    async def _commit_audit_logs(self, logs: List[Dict[str, Any]], checkpoint_size: int) -> List[str]:
+        """Write logs in one transaction that reserves each user's next `seq` numbers"""
+        chains = self._db.collection('audit_chains')
+        user_ids = list(dict.fromkeys(log['user_id'] for log in logs if log.get('user_id')))
+
+        def apply(transaction, snapshots):
+            heads = {snapshot.get('user_id'): snapshot.to_dict() for snapshot in snapshots if snapshot.exists}
+            updated, completed = assign_audit_chain(logs, heads, checkpoint_size)
+            for log_data in logs:
+                transaction.set(self._db.collection('audit_logs').document(log_data['id']),
+                                dict(log_data, search_tokens=self._audit_search_tokens(log_data)))
+            for ref, fields in self._audit_stats_updates(logs):
+                transaction.set(ref, fields, merge=True)
+            for user_id, head in updated.items():
+                transaction.set(chains.document(f"user_{user_id}"), head, merge=True)
+            return completed
+
+        return await self._run_transaction([chains.document(f"user_{uid}") for uid in user_ids], apply)
+
+    @staticmethod
+    def _audit_log_from_doc(doc) -> Dict[str, Any]:
+        return audit_log_to_api(dict(doc.to_dict(), id=doc.id))
+
+    async def get_user_audit_page(self, user_id: str, limit: int, offset: int = 0,
+                                  status_filter: Optional[str] = None, search: Optional[str] = None,
+                                  cursor: Optional[str] = None) -> Dict[str, Any]:
+        # Composite indexes on (user_id[, status][, search_tokens], created_at)
+        query = self._db.collection('audit_logs').where('user_id', '==', user_id)
+        if status_filter:
+            query = query.where('status', '==', status_filter)
+
+        tokens, matches = audit_search_matcher(search)
+        indexed = [token[:20] for token in tokens if len(token) >= 2]
+        if indexed:
+            query = query.where('search_tokens', 'array_contains', max(indexed, key=len))
+        ordered = query = self._order_newest_first(query)
+
+        if cursor:
+            query = query.start_after(self._position(cursor))
+        elif offset:
+            # Legacy offset paging: still billed per skipped document, prefer cursors
+            query = query.offset(offset)
+
+        if not tokens or (len(tokens) == 1 and indexed and indexed[0] == tokens[0]):
+            # The index answers the whole filter, unless the token was cut to 20 characters
+            docs = await self._execute(query.limit(limit + 1).get)
+            logs = [self._audit_log_from_doc(doc) for doc in docs[:limit]]
+            next_cursor = None
+            if len(docs) > limit and logs:
+                next_cursor = encode_cursor(logs[-1]['created_at'], logs[-1]['id'])
+            return {'items': logs, 'next_cursor': next_cursor}
+
+        budget = int(os.getenv("AUDIT_SEARCH_SCAN_BUDGET", 500))
+        batch_size = min(budget, max(limit * 4, 50))
+        logs, scanned, last, exhausted = [], 0, None, False
+        while len(logs) < limit and scanned < budget:
+            docs = await self._execute(query.limit(batch_size).get)
+            consumed = 0
+            for doc in docs:
+                consumed += 1
+                scanned += 1
+                last = self._audit_log_from_doc(doc)
+                if matches(last):
+                    logs.append(last)
+                if len(logs) >= limit or scanned >= budget:
+                    break
+            if consumed == len(docs) and len(docs) < batch_size:
+                exhausted = True
+                break
+            last_doc = docs[consumed - 1]
+            query = ordered.start_after({'created_at': last_doc.get('created_at'), '__name__': last_doc.id})
+
+        next_cursor = None
+        if last and not exhausted:
+            next_cursor = encode_cursor(last['created_at'], last['id'])
+        return {'items': logs, 'next_cursor': next_cursor}
+
+    async def iter_user_audit_logs(self, user_id: str, status_filter: Optional[str] = None,
+                                   page_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        # Async mode streams each page; thread mode fetches a page per executor call
+        # and never holds a thread between pages
+        query = self._db.collection('audit_logs').where('user_id', '==', user_id)
+        if status_filter:
+            query = query.where('status', '==', status_filter)
+        ordered = query = self._order_newest_first(query)
+
+        while True:
+            page = query.limit(page_size)
+            count, last = 0, None
+            if self.mode == "async":
+                async for doc in page.stream():
+                    count, last = count + 1, doc
+                    yield self._audit_log_from_doc(doc)
+            else:
+                for doc in await self._execute(page.get):
+                    count, last = count + 1, doc
+                    yield self._audit_log_from_doc(doc)
+            if count < page_size:
+                return
+            query = ordered.start_after({'created_at': last.get('created_at'), '__name__': last.id})
+
+    async def reindex_audit_search(self, page_size: int = 500) -> int:
+        query = self._order_newest_first(self._db.collection('audit_logs'))
+        indexed = 0
+        while True:
+            docs = await self._execute(query.limit(page_size).get)
+            batch = self._db.batch()
+            for doc in docs:
+                batch.update(doc.reference, {'search_tokens': self._audit_search_tokens(doc.to_dict())})
+            if docs:
+                await self._execute(batch.commit)
+            indexed += len(docs)
+            if len(docs) < page_size:
+                return indexed
+            last = docs[-1]
+            query = query.start_after({'created_at': last.get('created_at'), '__name__': last.id})
+
+    async def get_audit_stats(self, user_id: str, window_hours: int = 24) -> Dict[str, Any]:
+        hours = recent_hours(max(window_hours, 24) + 1)
+        refs = [self._audit_stats_ref(('total', user_id))]
+        refs += [self._audit_stats_ref(('hour', user_id, hour)) for hour in hours]
+
+        totals: Dict[str, Any] = {}
+        hourly: Dict[str, Dict[str, int]] = {}
+        for snapshot in await self._get_all(refs):
+            if not snapshot.exists:
+                continue
+            data = snapshot.to_dict()
+            if 'hour' in data:
+                hourly[data['hour']] = data.get('by_status') or {}
+            else:
+                totals = data
+        return audit_stats_result(totals, hourly, hours, window_hours)
+
+    async def rebuild_audit_stats(self, page_size: int = 500) -> Dict[str, int]:
+        counts: Dict[tuple, Dict[str, Any]] = {}
+        query = self._order_newest_first(self._db.collection('audit_logs'))
+        scanned = 0
+        while True:
+            docs = await self._execute(query.limit(page_size).get)
+            for doc in docs:
+                log_data = doc.to_dict()
+                if hasattr(log_data.get('created_at'), 'strftime'):
+                    tally_audit_stats(counts, log_data)
+            scanned += len(docs)
+            if len(docs) < page_size:
+                break
+            last = docs[-1]
+            query = query.start_after({'created_at': last.get('created_at'), '__name__': last.id})
+
+        writes = []
+        for key, entry in counts.items():
+            fields = dict(entry, user_id=key[1])
+            if key[0] == 'hour':
+                fields['hour'] = key[2]
+            writes.append((self._audit_stats_ref(key), fields))
+        await self._commit_sets(writes)
+        return {'logs': scanned, 'users': sum(1 for key in counts if key[0] == 'total')}
+
+    # Audit hash chain primitives
+
+    def _audit_checkpoint_ref(self, user_id: str, block: int):
+        return self._db.collection('audit_checkpoints').document(f"user_{user_id}_{block}")
+
+    async def get_audit_log(self, log_id: str) -> Optional[Dict[str, Any]]:
+        doc = await self._execute(self._db.collection('audit_logs').document(log_id).get)
+        return dict(doc.to_dict(), id=doc.id) if doc.exists else None
+
+    async def get_audit_chain_heads(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        refs = [self._db.collection('audit_chains').document(f"user_{user_id}") for user_id in user_ids]
+        return {snapshot.get('user_id'): snapshot.to_dict()
+                for snapshot in await self._get_all(refs) if snapshot.exists}
+
+    async def get_audit_logs_by_seq(self, user_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+        # Indexed on (user_id, seq)
+        page_size = 500
+        query = (self._db.collection('audit_logs')
+                 .where('user_id', '==', user_id)
+                 .where('seq', '>=', start)
+                 .where('seq', '<', end)
+                 .order_by('seq'))
+        logs: List[Dict[str, Any]] = []
+        while True:
+            docs = await self._execute(query.limit(page_size).get)
+            logs.extend(dict(doc.to_dict(), id=doc.id) for doc in docs)
+            if len(docs) < page_size:
+                return logs
+            query = query.start_after({'seq': docs[-1].get('seq')})
+
+    async def get_audit_checkpoints(self, user_id: str, blocks: List[int]) -> Dict[int, Dict[str, Any]]:
+        snapshots = await self._get_all([self._audit_checkpoint_ref(user_id, block) for block in blocks])
+        return {snapshot.get('index'): snapshot.to_dict() for snapshot in snapshots if snapshot.exists}
+
+    async def save_audit_checkpoint(self, user_id: str, checkpoint: Dict[str, Any]):
+        batch = self._db.batch()
+        batch.set(self._audit_checkpoint_ref(user_id, checkpoint['index']), checkpoint)
+        batch.set(self._db.collection('audit_chains').document(f"user_{user_id}"),
+                  {'sealed_blocks': checkpoint['index'] + 1, 'last_chain': checkpoint['chain']}, merge=True)
+        await self._execute(batch.commit)
+
+    # Audit archive
+
+    async def iter_audit_logs_before(self, cutoff: datetime, page_size: int = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+        ordered = query = self._order_newest_first(
+            self._db.collection('audit_logs').where('created_at', '<', cutoff))
+        while True:
+            docs = await self._execute(query.limit(page_size).get)
+            if docs:
+                yield [dict(doc.to_dict(), id=doc.id) for doc in docs]
+            if len(docs) < page_size:
+                return
+            last = docs[-1]
+            query = ordered.start_after({'created_at': last.get('created_at'), '__name__': last.id})
+
+    async def delete_audit_logs(self, log_ids: List[str]):
+        for start in range(0, len(log_ids), 500):
+            batch = self._db.batch()
+            for log_id in log_ids[start:start + 500]:
+                batch.delete(self._db.collection('audit_logs').document(log_id))
+            await self._execute(batch.commit)
+
+    async def add_audit_archive_segment(self, segment: Dict[str, Any]):
+        await self._execute(self._db.collection('audit_archive_segments').document(segment['id']).set, segment)
+
+    async def get_audit_archive_segments(self, user_id: str) -> List[Dict[str, Any]]:
+        query = self._db.collection('audit_archive_segments').where('user_id', '==', user_id)
+        docs = await self._execute(query.get)
+        return sorted((doc.to_dict() for doc in docs), key=lambda segment: segment['end_at'], reverse=True)
+
+    # Coordination
+
+    async def acquire_lease(self, name: str, holder: str, ttl_seconds: float) -> bool:
+        ref = self._db.collection('leases').document(name)
+        now = datetime.now(timezone.utc)
+
+        def apply(transaction, snapshots):
+            lease = snapshots[0].to_dict() if snapshots[0].exists else None
+            if lease and lease.get('holder') != holder and lease['expires_at'] > now:
+                return False
+            transaction.set(ref, {'holder': holder, 'expires_at': now + timedelta(seconds=ttl_seconds)})
+            return True
+
+        return await self._run_transaction([ref], apply)
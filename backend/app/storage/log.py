@@ -0,0 +1,456 @@
+import os
+import mmap
+import bisect
+import struct
+import hashlib
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, run a single process by hand
+    fcntl = None
+
+from app.services import text_index
+from app.storage.base import (
+    as_utc, clipboard_copy, clipboard_item_to_api, clipboard_search_score, clipboard_search_tiers,
+    clipboard_stats_result, decode_cursor, encode_cursor, split_clipboard_content
+)
+from app.storage.sql import SqlEngine, _dump, _load
+
+# Index file: a header (magic, entry count) followed by fixed-width entries in
+# append order, one per stored item, content blob, repeated copy or tombstone:
+#   created_at (microseconds since the epoch), segment, offset, length,
+#   user hash, content size in bytes, content type code, flags, ref, item id
+# An item's ref is its blob's entry number + 1 (0: content stored in the record),
+# a copy's ref the entry number of the item copied again. A blob's data is the
+# raw content and its id the SHA-256 digest of it.
+_HEADER = struct.Struct('<8sQ')
+_ENTRY = struct.Struct('<qIIIQIBBI2x40s')
+_KEY = struct.Struct('<q')
+_MAGIC = b'CVLOGIX1'
+_ID_BYTES = 40
+_TOMBSTONE = 1
+_BLOB = 2
+_COPY = 4
+
+# Content type codes; anything else is counted as "other"
+_CONTENT_TYPES = ('text', 'image', 'file', 'code', 'password')
+_OTHER = 255
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+Key = Tuple[int, bytes]
+
+
+def _micros(moment: datetime) -> int:
+    return (as_utc(moment) - _EPOCH) // timedelta(microseconds=1)
+
+
+def _user_hash(user_id: Optional[str]) -> int:
+    if not user_id:
+        return 0
+    return int.from_bytes(hashlib.blake2b(user_id.encode(), digest_size=8).digest(), 'little')
+
+
+def _id_bytes(item_id: str) -> bytes:
+    encoded = item_id.encode()
+    if len(encoded) > _ID_BYTES:
+        raise ValueError(f"Clipboard item ids are limited to {_ID_BYTES} bytes in the log engine")
+    return encoded.ljust(_ID_BYTES, b'\0')
+
+
+class _Mapped:
+    """A file mapped into memory that can grow"""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        self.map: Optional[mmap.mmap] = None
+        self.resize(max(size, os.fstat(self._file.fileno()).st_size))
+
+    @property
+    def size(self) -> int:
+        return len(self.map)
+
+    def resize(self, size: int):
+        # Unmap first: Windows cannot extend a mapped file
+        if self.map is not None:
+            self.map.close()
+        if os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)  # Sparse where the file system allows
+        self.map = mmap.mmap(self._file.fileno(), size)
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self._file.close()
+
+
+class LogEngine(SqlEngine):
+    """Append-only clipboard log on local disk, everything else in SQL
+
+    Clipboard items are never modified, so they are appended to segment files
+    in LOG_STORAGE_DIR instead of a database. Segments are preallocated,
+    memory-mapped and written in place; a new one starts when the current one
+    is full. Each item also appends an 80-byte entry to a memory-mapped index
+    file: (created_at, segment, offset, length) plus the user hash, size,
+    content type, blob reference and id. The data is written before its index
+    entry and only indexed records count, so a crash at worst leaves
+    unreferenced bytes.
+
+    Contents are appended once per hash as blob entries, found through a
+    digest -> entry map. The log never reclaims space, so blobs are kept for
+    good and carry no reference count. A repeated copy appends a copy entry
+    instead of an item; copy counts and times are kept in memory and applied
+    to the item on read.
+
+    On open the index is scanned once (segments are not read) into one sorted
+    array of entry numbers per user and one for all users, and the stats
+    counters. Pages and cursors are positions in those arrays found by
+    bisection, offset paging is a subtraction, and records are decoded straight
+    from the mapped segments without read calls. Items of all users are stored
+    in creation order, so scanning the shared clipboard is a sequential read.
+    Searches scan newest first, at most SEARCH_SCAN_BUDGET items per page, and
+    rank results within each page like the SQL engine.
+
+    Deletes append a tombstone entry (the API disables them anyway). Users,
+    devices, security events and audit logs are stored by the SQL engine at
+    DATABASE_URL (SQLite by default), so a single node needs no other service.
+    The log belongs to one process, enforced with a file lock where the OS
+    supports it, so run a single worker.
+
+    Tuning:
+        LOG_STORAGE_DIR    directory of the segment and index files (default ./clipboard_log)
+        LOG_SEGMENT_BYTES  size of each segment file (default 64 MiB)
+        LOG_FSYNC          "true" to flush every append to disk before returning (default false,
+                           appends survive a process crash but not a power loss)
+    """
+
+    name = "log"
+
+    def __init__(self, url: Optional[str] = None, directory: Optional[str] = None):
+        super().__init__(url)
+        self.directory = directory or os.getenv("LOG_STORAGE_DIR", "./clipboard_log")
+        self._segment_bytes = int(os.getenv("LOG_SEGMENT_BYTES", 64 * 1024 * 1024))
+        self._fsync = os.getenv("LOG_FSYNC", "false").lower() == "true"
+        self._lock_file = None
+        self._index: Optional[_Mapped] = None
+        self._count = 0
+        self._segments: List[_Mapped] = []
+        self._tail = 0
+        # Entry numbers sorted by (created_at, id), keyed by user hash (None for all users)
+        self._scopes: Dict[Optional[int], array] = {}
+        self._totals: Dict[Optional[int], Dict[str, Any]] = {}
+        # Blob entry numbers by content digest
+        self._blobs: Dict[bytes, int] = {}
+        # (copy_count, last copied at in microseconds) of items copied more than once
+        self._copies: Dict[int, Tuple[int, int]] = {}
+
+    # Files
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:08d}.seg")
+
+    async def open(self):
+        await super().open()
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(os.path.join(self.directory, "lock"), 'w')
+        if fcntl:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise Exception(f"Clipboard log {self.directory} is in use by another process")
+
+        self._index = _Mapped(os.path.join(self.directory, "index.bin"), _HEADER.size + 4096 * _ENTRY.size)
+        magic, count = _HEADER.unpack_from(self._index.map)
+        if magic != _MAGIC:
+            if count or any(self._index.map[:_HEADER.size]):
+                raise Exception(f"{self._index.path} is not a clipboard log index")
+            _HEADER.pack_into(self._index.map, 0, _MAGIC, 0)
+        self._count = min(count, (self._index.size - _HEADER.size) // _ENTRY.size)
+
+        number = 0
+        while os.path.exists(self._segment_path(number)):
+            self._segments.append(_Mapped(self._segment_path(number), 0))
+            number += 1
+        self._load_index()
+
+    def _load_index(self):
+        """Rebuild the scope arrays and counters from the index entries"""
+        self._scopes.clear()
+        self._totals.clear()
+        self._blobs.clear()
+        self._copies.clear()
+        for number in range(self._count):
+            _, segment, offset, length, _, _, _, flags, _, _ = self._entry(number)
+            if not flags & _TOMBSTONE and (segment >= len(self._segments)
+                                           or offset + length > self._segments[segment].size):
+                # Entry written without its data (the segment file was lost): stop here
+                print(f"⚠️ Clipboard log index truncated at entry {number} of {self._count}")
+                self._count = number
+                _HEADER.pack_into(self._index.map, 0, _MAGIC, number)
+                break
+
+        tails: Dict[int, int] = {}
+        flags_at = _HEADER.size + _ENTRY.size - _ID_BYTES - 7
+        deleted = {self._entry_key(number)[1] for number in range(self._count)
+                   if self._index.map[flags_at + number * _ENTRY.size] & _TOMBSTONE}
+        for number in range(self._count):
+            created_at, segment, offset, length, _, _, _, flags, ref, item_id = self._entry(number)
+            if flags & _TOMBSTONE:
+                continue
+            tails[segment] = max(tails.get(segment, 0), offset + length)
+            if flags & _BLOB:
+                self._blobs[item_id[:32]] = number
+            elif item_id in deleted:
+                continue
+            elif flags & _COPY:
+                self._copies[ref] = (self._copies.get(ref, (1, 0))[0] + 1, created_at)
+            else:
+                self._add_to_index(number)
+        if not self._segments:
+            self._segments.append(_Mapped(self._segment_path(0), self._segment_bytes))
+        self._tail = tails.get(len(self._segments) - 1, 0)
+        print(f"✅ Clipboard log opened: {self._count} entries in {len(self._segments)} segments")
+
+    async def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+        if self._index:
+            self._index.close()
+            self._index = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+        await super().close()
+
+    # Index
+
+    def _entry(self, number: int) -> tuple:
+        return _ENTRY.unpack_from(self._index.map, _HEADER.size + number * _ENTRY.size)
+
+    def _entry_key(self, number: int) -> Key:
+        position = _HEADER.size + number * _ENTRY.size
+        return (_KEY.unpack_from(self._index.map, position)[0],
+                self._index.map[position + _ENTRY.size - _ID_BYTES:position + _ENTRY.size])
+
+    @staticmethod
+    def _cursor_key(cursor: str) -> Key:
+        created_at, item_id = decode_cursor(cursor)
+        return _micros(created_at), _id_bytes(item_id)
+
+    def _append_entry(self, fields: tuple) -> int:
+        number = self._count
+        end = _HEADER.size + (number + 1) * _ENTRY.size
+        if end > self._index.size:
+            self._index.resize(max(end, self._index.size * 2))
+        _ENTRY.pack_into(self._index.map, end - _ENTRY.size, *fields)
+        # Count the entry only once it is complete
+        self._count = number + 1
+        _HEADER.pack_into(self._index.map, 0, _MAGIC, self._count)
+        return number
+
+    def _scopes_of(self, number: int) -> List[Optional[int]]:
+        user = self._entry(number)[4]
+        return [None, user] if user else [None]
+
+    def _add_to_index(self, number: int):
+        key = self._entry_key(number)
+        _, _, _, _, user, size, code, _, _, _ = self._entry(number)
+        content_type = _CONTENT_TYPES[code] if code < len(_CONTENT_TYPES) else 'other'
+        for scope in self._scopes_of(number):
+            numbers = self._scopes.setdefault(scope, array('Q'))
+            if not numbers or self._entry_key(numbers[-1]) <= key:
+                numbers.append(number)  # Items nearly always arrive in order
+            else:
+                numbers.insert(bisect.bisect_right(numbers, key, key=self._entry_key), number)
+            totals = self._totals.setdefault(scope, {'total_items': 0, 'total_size_bytes': 0, 'content_types': {}})
+            totals['total_items'] += 1
+            totals['total_size_bytes'] += size
+            totals['content_types'][content_type] = totals['content_types'].get(content_type, 0) + 1
+
+    def _unindex(self, number: int):
+        key = self._entry_key(number)
+        _, _, _, _, _, size, code, _, _, _ = self._entry(number)
+        content_type = _CONTENT_TYPES[code] if code < len(_CONTENT_TYPES) else 'other'
+        for scope in self._scopes_of(number):
+            numbers = self._scopes[scope]
+            position = bisect.bisect_left(numbers, key, key=self._entry_key)
+            while numbers[position] != number:
+                position += 1
+            del numbers[position]
+            totals = self._totals[scope]
+            totals['total_items'] -= 1
+            totals['total_size_bytes'] -= size
+            totals['content_types'][content_type] -= 1
+
+    def _read_item(self, number: int) -> Dict[str, Any]:
+        _, segment, offset, length, _, _, _, _, ref, _ = self._entry(number)
+        record = _load(self._segments[segment].map[offset:offset + length])
+        if ref:
+            _, segment, offset, length, _, _, _, _, _, _ = self._entry(ref - 1)
+            record['content'] = self._segments[segment].map[offset:offset + length].decode('utf-8')
+        if number in self._copies:
+            record['copy_count'], last_copied_at = self._copies[number]
+            record['last_copied_at'] = _EPOCH + timedelta(microseconds=last_copied_at)
+        return record
+
+    def _log_positions(self, user_id: Optional[str], before: Optional[Key], offset: int = 0):
+        """(entry numbers newest first from the page start, total in the scope)"""
+        numbers = self._scopes.get(_user_hash(user_id) if user_id else None)
+        if not numbers:
+            return [], 0
+        end = bisect.bisect_left(numbers, before, key=self._entry_key) if before else len(numbers) - offset
+        return numbers, max(end, 0)
+
+    def _scoped(self, user_id: Optional[str], record: Dict[str, Any]) -> bool:
+        # Guards against user hash collisions
+        return user_id is None or record.get('user_id') == user_id
+
+    # Clipboard items
+
+    def _append_data(self, data: bytes) -> Tuple[int, int]:
+        """Write `data` at the tail of the current segment (or a new one); returns (segment, offset)"""
+        if self._tail + len(data) > self._segments[-1].size:
+            number = len(self._segments)
+            self._segments.append(_Mapped(self._segment_path(number), max(self._segment_bytes, len(data))))
+            self._tail = 0
+        segment = self._segments[-1]
+        offset = self._tail
+        segment.map[offset:offset + len(data)] = data
+        self._tail += len(data)
+        if self._fsync:
+            segment.flush()
+        return len(self._segments) - 1, offset
+
+    def _recent_copy(self, user_id: Optional[str], blob: int, since: int) -> Optional[int]:
+        """Entry number of the user's newest item of a blob created at or after `since` (microseconds)"""
+        user = _user_hash(user_id)
+        numbers = self._scopes.get(user if user_id else None) or ()
+        for position in range(len(numbers) - 1, -1, -1):
+            number = numbers[position]
+            created_at, _, _, _, entry_user, _, _, _, ref, _ = self._entry(number)
+            if created_at < since:
+                return None
+            if ref == blob + 1 and entry_user == user and self._read_item(number).get('user_id') == user_id:
+                return number
+        return None
+
+    async def create_clipboard_item(self, item: Dict[str, Any],
+                                    copied_since: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        item_id = _id_bytes(item['id'])
+        record, content = split_clipboard_content(item)
+        digest = bytes.fromhex(item['content_hash'])
+        blob = self._blobs.get(digest)
+        if blob is not None and copied_since:
+            copied = self._recent_copy(item.get('user_id'), blob, _micros(copied_since))
+            if copied is not None:
+                fields = list(self._entry(copied))
+                fields[0], fields[7], fields[8] = _micros(item['created_at']), _COPY, copied
+                self._append_entry(tuple(fields))
+                if self._fsync:
+                    self._index.flush()
+                self._copies[copied] = (self._copies.get(copied, (1, 0))[0] + 1, fields[0])
+                return clipboard_copy(self._read_item(copied))
+
+        encoded = content.encode('utf-8')
+        if blob is None:
+            segment, offset = self._append_data(encoded)
+            blob = self._append_entry((_micros(item['created_at']), segment, offset, len(encoded), 0,
+                                       len(encoded), 0, _BLOB, 0, digest.ljust(_ID_BYTES, b'\0')))
+            self._blobs[digest] = blob
+
+        data = _dump(record).encode()
+        segment, offset = self._append_data(data)
+        content_type = item.get('content_type') or 'text'
+        code = _CONTENT_TYPES.index(content_type) if content_type in _CONTENT_TYPES else _OTHER
+        size = item.get('size_bytes', len(encoded))
+        number = self._append_entry((_micros(item['created_at']), segment, offset, len(data),
+                                     _user_hash(item.get('user_id')), size, code, 0, blob + 1, item_id))
+        if self._fsync:
+            self._index.flush()
+        self._add_to_index(number)
+        return None
+
+    async def get_clipboard_page(self, user_id: Optional[str], limit: int, offset: int = 0,
+                                 cursor: Optional[str] = None) -> Dict[str, Any]:
+        before = self._cursor_key(cursor) if cursor else None
+        numbers, end = self._log_positions(user_id, before, 0 if before else offset)
+        items, position = [], end
+        while position > 0 and len(items) < limit:
+            position -= 1
+            record = self._read_item(numbers[position])
+            if self._scoped(user_id, record):
+                items.append(clipboard_item_to_api(record))
+        next_cursor = None
+        if position > 0 and items:
+            next_cursor = encode_cursor(items[-1]['created_at'], items[-1]['id'])
+        return {'items': items, 'next_cursor': next_cursor}
+
+    async def search_clipboard_items(self, query_text: str, user_id: Optional[str], limit: int,
+                                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        tokens = list(dict.fromkeys(text_index.tokenize(query_text)))
+        if not tokens:
+            return {'items': [], 'next_cursor': None}
+        primary, tiers = clipboard_search_tiers(tokens)
+
+        numbers, position = self._log_positions(user_id, self._cursor_key(cursor) if cursor else None)
+        budget = int(os.getenv("SEARCH_SCAN_BUDGET", 500))
+        results, scanned, last = [], 0, None
+        while position > 0:
+            if len(results) >= limit or scanned >= budget:
+                return {'items': sorted(results, key=lambda item: item['score'], reverse=True),
+                        'next_cursor': encode_cursor(last['created_at'], last['id'])}
+            position -= 1
+            scanned += 1
+            last = self._read_item(numbers[position])
+            if not self._scoped(user_id, last):
+                continue
+            content = last.get('content')
+            # Score as the tier that would have found the item: whole word, else substring
+            tier = 0 if primary in text_index.tokenize(content) else 1
+            score = clipboard_search_score(content, tokens, primary, tier, len(tiers)) if tier < len(tiers) else None
+            if score is not None:
+                results.append(dict(clipboard_item_to_api(last), score=score))
+        results.sort(key=lambda item: item['score'], reverse=True)
+        return {'items': results, 'next_cursor': None}
+
+    async def get_clipboard_stats(self, user_id: Optional[str]) -> Dict[str, Any]:
+        scope = _user_hash(user_id) if user_id else None
+        totals = self._totals.get(scope) or {}
+        numbers = self._scopes.get(scope) or array('Q')
+        # Hour-aligned like the other engines' hourly counters
+        now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        since = bisect.bisect_left(numbers, (_micros(now - timedelta(hours=24)), b''), key=self._entry_key)
+        until = bisect.bisect_left(numbers, (_micros(now + timedelta(hours=1)), b''), key=self._entry_key)
+        unique_users = 1 if user_id else sum(1 for key, entry in self._totals.items()
+                                             if key is not None and entry['total_items'])
+        content_types = {name: count for name, count in (totals.get('content_types') or {}).items() if count}
+        return clipboard_stats_result(totals.get('total_items', 0), totals.get('total_size_bytes', 0),
+                                      content_types, until - since, unique_users, user_id)
+
+    async def rebuild_clipboard_stats(self, page_size: int = 500) -> Dict[str, int]:
+        """Counters are rebuilt from the index on open; this reloads it"""
+        self._load_index()
+        return {'items': self._totals.get(None, {}).get('total_items', 0),
+                'users': sum(1 for key, entry in self._totals.items() if key is not None and entry['total_items'])}
+
+    async def delete_clipboard_item(self, item_id: str):
+        # Items are immutable, so deleting means indexing a tombstone (found by a scan, deletes are rare)
+        target = _id_bytes(item_id)
+        for number in self._scopes.get(None, ()):
+            if self._entry_key(number)[1] == target:
+                fields = list(self._entry(number))
+                fields[7] |= _TOMBSTONE
+                self._append_entry(tuple(fields))
+                if self._fsync:
+                    self._index.flush()
+                self._unindex(number)
+                self._copies.pop(number, None)
+                return
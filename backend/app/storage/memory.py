@@ -0,0 +1,527 @@
+import os
+import copy
+import bisect
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from app.services import text_index
+from app.storage.base import (
+    StorageEngine, WriteBatch, apply_update, as_utc, assign_audit_chain, audit_log_to_api, audit_search_matcher,
+    audit_stats_result, clipboard_copy, clipboard_item_to_api, clipboard_search_score, clipboard_search_tiers,
+    clipboard_stats_result, decode_cursor, encode_cursor, hour_key, recent_hours, split_clipboard_content,
+    tally_audit_stats, to_api
+)
+
+Key = Tuple[datetime, str]
+
+
+class _KeysetIndex:
+    """Sorted (created_at, id) keys, read newest first like a Firestore keyset query"""
+
+    def __init__(self):
+        self._keys: List[Key] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: Key):
+        bisect.insort(self._keys, key)
+
+    def remove(self, key: Key):
+        position = bisect.bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def newest_first(self, before: Optional[Key] = None) -> Iterator[Key]:
+        """Keys strictly older than `before` (all keys when None), newest first
+
+        Must be consumed before the index is modified.
+        """
+        end = bisect.bisect_left(self._keys, before) if before else len(self._keys)
+        for position in range(end - 1, -1, -1):
+            yield self._keys[position]
+
+
+def _stored(value: Any) -> Any:
+    """Deep copy of a record as Firestore would store it: datetimes in aware UTC"""
+    if isinstance(value, datetime):
+        return as_utc(value)
+    if isinstance(value, dict):
+        return {key: _stored(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_stored(item) for item in value]
+    return copy.deepcopy(value)
+
+
+def _key(record: Dict[str, Any]) -> Key:
+    return record['created_at'], record['id']
+
+
+class _MemoryWriteBatch(WriteBatch):
+    """Staged user and device writes, applied together on commit"""
+
+    def __init__(self, engine: "MemoryEngine"):
+        self._engine = engine
+        self._users: List[Dict[str, Any]] = []
+        self._devices: List[Dict[str, Any]] = []
+        self._updates: List[Tuple[str, Dict[str, Any]]] = []
+
+    def create_user(self, profile: Dict[str, Any]):
+        self._users.append(_stored(profile))
+
+    def create_device(self, device: Dict[str, Any]):
+        self._devices.append(_stored(device))
+
+    def update_device(self, device_id: str, fields: Dict[str, Any]):
+        self._updates.append((device_id, fields))
+
+    async def commit(self):
+        # Check every update first so a failed commit writes nothing
+        staged = {device['id'] for device in self._devices}
+        for device_id, _ in self._updates:
+            if device_id not in staged and device_id not in self._engine._devices:
+                raise KeyError(f"Device {device_id} not found")
+        for profile in self._users:
+            self._engine._put_user(profile)
+        for device in self._devices:
+            self._engine._put_device(device)
+        for device_id, fields in self._updates:
+            apply_update(self._engine._devices[device_id], _stored(fields))
+
+
+class MemoryEngine(StorageEngine):
+    """Process-local storage for load tests and local development
+
+    Records live in dicts keyed by id, with secondary indexes for every lookup
+    the service makes: users by email, devices by user and signature, and
+    sorted (created_at, id) keyset indexes for clipboard items and audit logs
+    (overall, per user and per user and status), so pages, cursors and exports
+    behave as on Firestore. Clipboard search uses the same index terms as the
+    Firestore engine in a term -> keyset index map, and stats are counters
+    updated on write. Contents are kept once per hash in a blob map with a
+    reference count; a repeated copy is found by walking the user's index back
+    to the dedup window. Reads and writes copy records, so callers never share
+    state with the store.
+
+    Nothing is persisted and each worker process has its own data, so run a
+    single worker. Every method completes without awaiting, which makes it
+    atomic on the event loop.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._user_ids_by_email: Dict[str, str] = {}
+
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._device_ids_by_user: Dict[str, Dict[str, None]] = {}
+        self._device_ids_by_signature: Dict[Tuple[str, str], str] = {}
+
+        self._clipboard: Dict[str, Dict[str, Any]] = {}
+        # Keyed by content_hash: {'content', 'size_bytes', 'refcount'}
+        self._clipboard_blobs: Dict[str, Dict[str, Any]] = {}
+        # Keyed by user_id, None for every user's items
+        self._clipboard_index: Dict[Optional[str], _KeysetIndex] = {}
+        self._clipboard_terms: Dict[Tuple[Optional[str], str], _KeysetIndex] = {}
+        self._clipboard_totals: Dict[Optional[str], Dict[str, Any]] = {}
+        self._clipboard_hourly: Dict[Tuple[Optional[str], str], int] = {}
+
+        self._security_events: Dict[str, Dict[str, Any]] = {}
+
+        self._audit_logs: Dict[str, Dict[str, Any]] = {}
+        # Keyed by (user_id, status); None matches every user or status
+        self._audit_index: Dict[Tuple[Optional[str], Optional[str]], _KeysetIndex] = {}
+        self._audit_ids_by_seq: Dict[str, Dict[int, str]] = {}
+        self._audit_counts: Dict[tuple, Dict[str, Any]] = {}
+        self._audit_heads: Dict[str, Dict[str, Any]] = {}
+        self._audit_checkpoints: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self._audit_segments: Dict[str, List[Dict[str, Any]]] = {}
+
+        self._leases: Dict[str, Dict[str, Any]] = {}
+
+    def batch(self) -> WriteBatch:
+        return _MemoryWriteBatch(self)
+
+    @staticmethod
+    def _position(cursor: Optional[str]) -> Optional[Key]:
+        return decode_cursor(cursor) if cursor else None
+
+    @staticmethod
+    def _page_keys(index: Optional[_KeysetIndex], limit: int, offset: int = 0,
+                   before: Optional[Key] = None) -> Tuple[List[Key], bool]:
+        """Up to `limit` keys of a keyset page and whether more follow"""
+        if index is None:
+            return [], False
+        keys = list(islice(index.newest_first(before), offset, offset + limit + 1))
+        return keys[:limit], len(keys) > limit
+
+    # Users
+
+    def _put_user(self, profile: Dict[str, Any]):
+        previous = self._users.get(profile['id'])
+        if previous and previous.get('email') != profile.get('email'):
+            self._user_ids_by_email.pop(previous.get('email'), None)
+        self._users[profile['id']] = profile
+        if profile.get('email'):
+            self._user_ids_by_email[profile['email']] = profile['id']
+
+    async def create_user(self, profile: Dict[str, Any]):
+        self._put_user(_stored(profile))
+
+    async def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        user = self._users.get(user_id)
+        return _stored(user) if user else None
+
+    async def find_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        user_id = self._user_ids_by_email.get(email)
+        return await self.get_user(user_id) if user_id else None
+
+    async def update_user(self, user_id: str, fields: Dict[str, Any]):
+        if user_id not in self._users:
+            raise KeyError(f"User {user_id} not found")
+        user = _stored(self._users[user_id])
+        apply_update(user, _stored(fields))
+        self._put_user(user)
+
+    # Devices
+
+    @staticmethod
+    def _signature(device: Dict[str, Any]) -> Optional[str]:
+        return (device.get('metadata') or {}).get('device_signature')
+
+    def _put_device(self, device: Dict[str, Any]):
+        self._drop_device(device['id'])
+        self._devices[device['id']] = device
+        self._device_ids_by_user.setdefault(device.get('user_id'), {})[device['id']] = None
+        if self._signature(device):
+            self._device_ids_by_signature[(device.get('user_id'), self._signature(device))] = device['id']
+
+    def _drop_device(self, device_id: str):
+        device = self._devices.pop(device_id, None)
+        if device is None:
+            return
+        self._device_ids_by_user.get(device.get('user_id'), {}).pop(device_id, None)
+        signature_key = (device.get('user_id'), self._signature(device))
+        if self._device_ids_by_signature.get(signature_key) == device_id:
+            del self._device_ids_by_signature[signature_key]
+
+    async def create_device(self, device: Dict[str, Any]):
+        self._put_device(_stored(device))
+
+    async def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
+        device = self._devices.get(device_id)
+        return to_api(_stored(device)) if device else None
+
+    async def list_user_devices(self, user_id: str) -> List[Dict[str, Any]]:
+        return [to_api(_stored(self._devices[device_id]))
+                for device_id in self._device_ids_by_user.get(user_id, {})]
+
+    async def find_device_by_signature(self, user_id: str, device_signature: str) -> Optional[Dict[str, Any]]:
+        device_id = self._device_ids_by_signature.get((user_id, device_signature))
+        return await self.get_device(device_id) if device_id else None
+
+    async def update_device(self, device_id: str, fields: Dict[str, Any]):
+        if device_id not in self._devices:
+            raise KeyError(f"Device {device_id} not found")
+        device = _stored(self._devices[device_id])
+        apply_update(device, _stored(fields))
+        self._put_device(device)
+
+    async def delete_device(self, device_id: str):
+        self._drop_device(device_id)
+
+    # Clipboard items
+
+    def _count_clipboard_item(self, item: Dict[str, Any], hours: Optional[set] = None):
+        content_type = item.get('content_type') or 'text'
+        size_bytes = item.get('size_bytes', len((item.get('content') or '').encode('utf-8')))
+        hour = hour_key(item['created_at'])
+        for scope in {None, item.get('user_id')}:
+            totals = self._clipboard_totals.setdefault(scope, {
+                'total_items': 0, 'total_size_bytes': 0, 'content_types': {}
+            })
+            totals['total_items'] += 1
+            totals['total_size_bytes'] += size_bytes
+            totals['content_types'][content_type] = totals['content_types'].get(content_type, 0) + 1
+            if hours is None or hour in hours:
+                self._clipboard_hourly[(scope, hour)] = self._clipboard_hourly.get((scope, hour), 0) + 1
+
+    def _clipboard_scopes(self, item: Dict[str, Any]) -> List[Optional[str]]:
+        return [None, item['user_id']] if item.get('user_id') else [None]
+
+    async def create_clipboard_item(self, item: Dict[str, Any],
+                                    copied_since: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        item, content = split_clipboard_content(_stored(item))
+        if copied_since:
+            copied = self._recent_copy(item, as_utc(copied_since))
+            if copied:
+                copied['copy_count'] = copied.get('copy_count', 1) + 1
+                copied['last_copied_at'] = item['created_at']
+                return clipboard_copy(copied)
+
+        blob = self._clipboard_blobs.setdefault(item['content_hash'], {
+            'content': content, 'size_bytes': len(content.encode('utf-8')), 'refcount': 0
+        })
+        blob['refcount'] += 1
+        key = _key(item)
+        terms = text_index.index_terms(content, int(os.getenv("SEARCH_MAX_TERMS_PER_ITEM", 300)))
+        self._clipboard[item['id']] = dict(item, search_terms=terms)
+        for scope in self._clipboard_scopes(item):
+            self._clipboard_index.setdefault(scope, _KeysetIndex()).add(key)
+            for term in terms:
+                self._clipboard_terms.setdefault((scope, term), _KeysetIndex()).add(key)
+        self._count_clipboard_item(item)
+        return None
+
+    def _recent_copy(self, item: Dict[str, Any], since: datetime) -> Optional[Dict[str, Any]]:
+        """The newest item of the same user and content created at or after `since`"""
+        index = self._clipboard_index.get(item.get('user_id'))
+        for created_at, item_id in index.newest_first() if index else ():
+            if created_at < since:
+                break
+            stored = self._clipboard[item_id]
+            if stored.get('content_hash') == item['content_hash'] and stored.get('user_id') == item.get('user_id'):
+                return stored
+        return None
+
+    def _clipboard_item(self, item_id: str) -> Dict[str, Any]:
+        """API form of a stored item, with its content from the blob store"""
+        item = self._clipboard[item_id]
+        if 'content' not in item and item.get('content_hash') in self._clipboard_blobs:
+            item = dict(item, content=self._clipboard_blobs[item['content_hash']]['content'])
+        return clipboard_item_to_api(_stored(item))
+
+    async def get_clipboard_page(self, user_id: Optional[str], limit: int, offset: int = 0,
+                                 cursor: Optional[str] = None) -> Dict[str, Any]:
+        before = self._position(cursor)
+        keys, has_more = self._page_keys(self._clipboard_index.get(user_id), limit,
+                                         0 if before else offset, before)
+        items = [self._clipboard_item(item_id) for _, item_id in keys]
+        next_cursor = encode_cursor(*keys[-1]) if has_more and keys else None
+        return {'items': items, 'next_cursor': next_cursor}
+
+    async def search_clipboard_items(self, query_text: str, user_id: Optional[str], limit: int,
+                                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        # Same tiers, scoring, scan budget and cursor format as the Firestore engine
+        tokens = list(dict.fromkeys(text_index.tokenize(query_text)))
+        if not tokens:
+            return {'items': [], 'next_cursor': None}
+        primary, tiers = clipboard_search_tiers(tokens)
+
+        tier, position = 0, None
+        if cursor:
+            try:
+                tier_part, position_part = cursor.split('.', 1)
+                tier = int(tier_part)
+                position = decode_cursor(position_part) if position_part else None
+            except ValueError:
+                raise ValueError("Invalid pagination cursor")
+            if not 0 <= tier < len(tiers):
+                raise ValueError("Invalid pagination cursor")
+
+        budget = int(os.getenv("SEARCH_SCAN_BUDGET", 500))
+        results = []
+        scanned = 0
+        next_cursor = None
+        while tier < len(tiers) and next_cursor is None:
+            index = self._clipboard_terms.get((user_id, tiers[tier]))
+            for key in index.newest_first(position) if index else ():
+                if len(results) >= limit or scanned >= budget:
+                    next_cursor = f"{tier}.{encode_cursor(*position) if position else ''}"
+                    break
+                scanned += 1
+                position = key
+                item = self._clipboard_item(key[1])
+                score = clipboard_search_score(item.get('content'), tokens, primary, tier, len(tiers))
+                if score is not None:
+                    item['score'] = score
+                    results.append(item)
+            else:
+                tier, position = tier + 1, None
+                if tier < len(tiers) and (len(results) >= limit or scanned >= budget):
+                    next_cursor = f"{tier}."
+
+        results.sort(key=lambda item: item['score'], reverse=True)
+        return {'items': results, 'next_cursor': next_cursor}
+
+    async def get_clipboard_stats(self, user_id: Optional[str]) -> Dict[str, Any]:
+        totals = self._clipboard_totals.get(user_id) or {}
+        recent_items = sum(self._clipboard_hourly.get((user_id, hour), 0) for hour in recent_hours(25))
+        unique_users = 1 if user_id else sum(1 for scope in self._clipboard_totals if scope is not None)
+        return clipboard_stats_result(totals.get('total_items', 0), totals.get('total_size_bytes', 0),
+                                      dict(totals.get('content_types') or {}), recent_items,
+                                      unique_users, user_id)
+
+    async def rebuild_clipboard_stats(self, page_size: int = 500) -> Dict[str, int]:
+        self._clipboard_totals.clear()
+        self._clipboard_hourly.clear()
+        # Like the Firestore rebuild, only the hours the stats read are restored
+        hours = set(recent_hours(25))
+        for item in self._clipboard.values():
+            self._count_clipboard_item(item, hours)
+        return {'items': len(self._clipboard), 'users': sum(1 for scope in self._clipboard_totals if scope)}
+
+    async def delete_clipboard_item(self, item_id: str):
+        item = self._clipboard.pop(item_id, None)
+        if item is None:
+            return
+        key = _key(item)
+        for scope in self._clipboard_scopes(item):
+            self._clipboard_index[scope].remove(key)
+            for term in item.get('search_terms', []):
+                self._clipboard_terms[(scope, term)].remove(key)
+        blob = self._clipboard_blobs.get(item.get('content_hash'))
+        if blob:
+            blob['refcount'] -= 1
+            if blob['refcount'] <= 0:
+                del self._clipboard_blobs[item['content_hash']]
+
+    # Security events
+
+    async def create_security_event(self, event: Dict[str, Any]):
+        self._security_events[event['id']] = _stored(event)
+
+    # Audit logs
+
+    @staticmethod
+    def _audit_scopes(log_data: Dict[str, Any]) -> List[Tuple[Optional[str], Optional[str]]]:
+        scopes = [(None, None)]
+        if log_data.get('user_id'):
+            scopes += [(log_data['user_id'], None), (log_data['user_id'], log_data.get('status'))]
+        return scopes
+
+    async def write_audit_logs(self, logs: List[Dict[str, Any]], checkpoint_size: int) -> List[str]:
+        updated, completed = assign_audit_chain(logs, self._audit_heads, checkpoint_size)
+        for log_data in logs:
+            record = _stored(log_data)
+            self._audit_logs[record['id']] = record
+            for scope in self._audit_scopes(record):
+                self._audit_index.setdefault(scope, _KeysetIndex()).add(_key(record))
+            if record.get('seq') is not None:
+                self._audit_ids_by_seq.setdefault(record['user_id'], {})[record['seq']] = record['id']
+            tally_audit_stats(self._audit_counts, record)
+        for user_id, head in updated.items():
+            self._audit_heads.setdefault(user_id, {}).update(head)
+        return completed
+
+    async def get_user_audit_page(self, user_id: str, limit: int, offset: int = 0,
+                                  status_filter: Optional[str] = None, search: Optional[str] = None,
+                                  cursor: Optional[str] = None) -> Dict[str, Any]:
+        index = self._audit_index.get((user_id, status_filter or None))
+        before = self._position(cursor)
+        tokens, matches = audit_search_matcher(search)
+        if not tokens:
+            keys, has_more = self._page_keys(index, limit, 0 if before else offset, before)
+            logs = [audit_log_to_api(_stored(self._audit_logs[log_id])) for _, log_id in keys]
+            return {'items': logs, 'next_cursor': encode_cursor(*keys[-1]) if has_more and keys else None}
+
+        # Searches scan at most AUDIT_SEARCH_SCAN_BUDGET logs per page, as on Firestore
+        budget = int(os.getenv("AUDIT_SEARCH_SCAN_BUDGET", 500))
+        keys = index.newest_first(before) if index else iter(())
+        if offset and not before:
+            keys = islice(keys, offset, None)
+        logs, scanned, last = [], 0, None
+        for key in keys:
+            if len(logs) >= limit or scanned >= budget:
+                return {'items': logs, 'next_cursor': encode_cursor(*last)}
+            scanned += 1
+            last = key
+            log_data = audit_log_to_api(_stored(self._audit_logs[key[1]]))
+            if matches(log_data):
+                logs.append(log_data)
+        return {'items': logs, 'next_cursor': None}
+
+    async def iter_user_audit_logs(self, user_id: str, status_filter: Optional[str] = None,
+                                   page_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        index = self._audit_index.get((user_id, status_filter or None))
+        before = None
+        while True:
+            keys, has_more = self._page_keys(index, page_size, before=before)
+            # Copy the page before yielding, since the store may change in between
+            logs = [audit_log_to_api(_stored(self._audit_logs[log_id])) for _, log_id in keys]
+            for log_data in logs:
+                yield log_data
+            if not has_more:
+                return
+            before = keys[-1]
+
+    async def get_audit_stats(self, user_id: str, window_hours: int = 24) -> Dict[str, Any]:
+        hours = recent_hours(max(window_hours, 24) + 1)
+        hourly = {hour: self._audit_counts[('hour', user_id, hour)]['by_status']
+                  for hour in hours if ('hour', user_id, hour) in self._audit_counts}
+        totals = self._audit_counts.get(('total', user_id)) or {}
+        return audit_stats_result(copy.deepcopy(totals), copy.deepcopy(hourly), hours, window_hours)
+
+    async def rebuild_audit_stats(self, page_size: int = 500) -> Dict[str, int]:
+        self._audit_counts.clear()
+        for log_data in self._audit_logs.values():
+            tally_audit_stats(self._audit_counts, log_data)
+        return {'logs': len(self._audit_logs), 'users': sum(1 for key in self._audit_counts if key[0] == 'total')}
+
+    # Audit hash chain primitives
+
+    async def get_audit_log(self, log_id: str) -> Optional[Dict[str, Any]]:
+        log_data = self._audit_logs.get(log_id)
+        return _stored(log_data) if log_data else None
+
+    async def get_audit_chain_heads(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        return {user_id: _stored(self._audit_heads[user_id]) for user_id in user_ids if user_id in self._audit_heads}
+
+    async def get_audit_logs_by_seq(self, user_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+        ids = self._audit_ids_by_seq.get(user_id, {})
+        if end - start > len(ids):
+            seqs = sorted(seq for seq in ids if start <= seq < end)
+        else:
+            seqs = [seq for seq in range(start, end) if seq in ids]
+        return [_stored(self._audit_logs[ids[seq]]) for seq in seqs]
+
+    async def get_audit_checkpoints(self, user_id: str, blocks: List[int]) -> Dict[int, Dict[str, Any]]:
+        return {block: _stored(self._audit_checkpoints[(user_id, block)])
+                for block in blocks if (user_id, block) in self._audit_checkpoints}
+
+    async def save_audit_checkpoint(self, user_id: str, checkpoint: Dict[str, Any]):
+        self._audit_checkpoints[(user_id, checkpoint['index'])] = _stored(checkpoint)
+        self._audit_heads.setdefault(user_id, {'user_id': user_id}).update(
+            sealed_blocks=checkpoint['index'] + 1, last_chain=checkpoint['chain'])
+
+    # Audit archive
+
+    async def iter_audit_logs_before(self, cutoff: datetime, page_size: int = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+        index = self._audit_index.get((None, None))
+        before: Key = (as_utc(cutoff), '')
+        while True:
+            keys, has_more = self._page_keys(index, page_size, before=before)
+            if keys:
+                yield [_stored(self._audit_logs[log_id]) for _, log_id in keys]
+            if not has_more:
+                return
+            before = keys[-1]
+
+    async def delete_audit_logs(self, log_ids: List[str]):
+        for log_id in log_ids:
+            log_data = self._audit_logs.pop(log_id, None)
+            if log_data is None:
+                continue
+            for scope in self._audit_scopes(log_data):
+                self._audit_index[scope].remove(_key(log_data))
+            if log_data.get('seq') is not None:
+                self._audit_ids_by_seq[log_data['user_id']].pop(log_data['seq'], None)
+
+    async def add_audit_archive_segment(self, segment: Dict[str, Any]):
+        self._audit_segments.setdefault(segment['user_id'], []).append(_stored(segment))
+
+    async def get_audit_archive_segments(self, user_id: str) -> List[Dict[str, Any]]:
+        return sorted((_stored(segment) for segment in self._audit_segments.get(user_id, [])),
+                      key=lambda segment: segment['end_at'], reverse=True)
+
+    # Coordination
+
+    async def acquire_lease(self, name: str, holder: str, ttl_seconds: float) -> bool:
+        now = datetime.now(timezone.utc)
+        lease = self._leases.get(name)
+        if lease and lease['holder'] != holder and lease['expires_at'] > now:
+            return False
+        self._leases[name] = {'holder': holder, 'expires_at': now + timedelta(seconds=ttl_seconds)}
+        return True
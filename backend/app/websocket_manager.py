@@ -1,55 +1,295 @@
 from fastapi import WebSocket
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Set
+import asyncio
 import json
+import os
+import time
+
+from app.services.redis_service import RedisService
+
+OVERFLOW_POLICIES = ("disconnect", "drop_oldest", "drop_newest")
+
+# Backplane channels: one per user with local sockets, plus one for shared-feed subscribers
+USER_CHANNEL = "ws:user:{}"
+SHARED_CHANNEL = "ws:shared"
+
+class _Connection:
+    """A WebSocket with its bounded outbound queue, writer task and delivery metrics"""
+
+    def __init__(self, websocket: WebSocket, client_id: str, user_id: Optional[str], queue_size: int):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        # No client or user ids: /metrics is unauthenticated
+        return {
+            "queue_depth": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "last_lag_ms": round(self.last_lag_ms, 1),
+            "max_lag_ms": round(self.max_lag_ms, 1)
+        }
 
 class WebSocketManager:
-    def __init__(self):
+    """Tracks WebSocket connections and delivers messages to them
+
+    Every connection has a bounded outbound queue drained by its own writer task,
+    so a slow client never delays delivery to the others. When a queue is full the
+    overflow policy decides what happens:
+
+        disconnect   close the slow client (code 1013); it reconnects and re-syncs
+        drop_oldest  discard the oldest queued message to make room
+        drop_newest  discard the message being enqueued
+
+    Configured with WS_QUEUE_SIZE (default 256), WS_OVERFLOW_POLICY (default
+    "disconnect") and WS_SEND_TIMEOUT_SECONDS (default 10; a send slower than this
+    disconnects the client).
+
+    With Redis available (see start()), clipboard items travel over a pub/sub
+    backplane so every worker process delivers them to the sockets it holds. A
+    worker only subscribes to the channels of users connected to it, and to the
+    shared channel while it has shared-feed subscribers. Without Redis, delivery
+    falls back to this process's sockets only.
+    """
+
+    def __init__(self, queue_size: Optional[int] = None, overflow_policy: Optional[str] = None,
+                 send_timeout: Optional[float] = None):
+        self.queue_size = queue_size or int(os.getenv("WS_QUEUE_SIZE", 256))
+        self.overflow_policy = overflow_policy or os.getenv("WS_OVERFLOW_POLICY", "disconnect")
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown WS_OVERFLOW_POLICY '{self.overflow_policy}', expected one of {OVERFLOW_POLICIES}")
+        self.send_timeout = send_timeout or float(os.getenv("WS_SEND_TIMEOUT_SECONDS", 10))
         self.active_connections: Dict[str, WebSocket] = {}
-    
-    async def connect(self, websocket: WebSocket, client_id: str):
-        """Accept a WebSocket connection and store it"""
+        self.connections: Dict[str, _Connection] = {}
+        # Routing indexes for clipboard fan-out
+        self.user_clients: Dict[str, Set[str]] = {}
+        self.shared_clients: Set[str] = set()
+        self.overflow_disconnects = 0
+        self.backplane = False
+        self._channels: Set[str] = set()
+        self._channel_lock = asyncio.Lock()
+
+    async def start(self):
+        """Join the Redis backplane (call after RedisService.initialize)"""
+        self.backplane = RedisService.is_available()
+        if self.backplane:
+            print("✅ WebSocket backplane connected")
+        else:
+            print("⚠️ WebSocket backplane unavailable, delivering to local connections only")
+
+    async def connect(self, websocket: WebSocket, client_id: str, user_id: Optional[str] = None,
+                      shared: bool = False):
+        """Accept a WebSocket connection and store it
+
+        Connections with a user_id receive that user's new clipboard items; shared
+        connections additionally receive every user's items.
+        """
         await websocket.accept()
+        if client_id in self.active_connections:
+            self.disconnect(client_id)
+        connection = _Connection(websocket, client_id, user_id, self.queue_size)
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.connections[client_id] = connection
         self.active_connections[client_id] = websocket
+        if user_id:
+            self.user_clients.setdefault(user_id, set()).add(client_id)
+        if shared:
+            self.shared_clients.add(client_id)
         print(f"🔌 WebSocket connected: {client_id}")
-    
-    def disconnect(self, client_id: str):
-        """Remove a WebSocket connection"""
+        if user_id:
+            await self._reconcile_channel(USER_CHANNEL.format(user_id))
+        await self._reconcile_channel(SHARED_CHANNEL)
+
+    def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        """Remove a WebSocket connection
+
+        When websocket is given, only remove it if it is still the client's current
+        connection (a reconnect with the same client_id replaces the old one).
+        """
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+            connection = self.connections.pop(client_id)
+            if connection.writer and connection.writer is not asyncio.current_task():
+                connection.writer.cancel()
+            user_id = connection.user_id
+            if user_id and user_id in self.user_clients:
+                self.user_clients[user_id].discard(client_id)
+                if not self.user_clients[user_id]:
+                    del self.user_clients[user_id]
+            self.shared_clients.discard(client_id)
             print(f"🔌 WebSocket disconnected: {client_id}")
-    
-    async def send_personal_message(self, message: str, client_id: str):
-        """Send a message to a specific client"""
-        if client_id in self.active_connections:
+            if user_id:
+                self._schedule_reconcile(USER_CHANNEL.format(user_id))
+            self._schedule_reconcile(SHARED_CHANNEL)
+
+    def set_shared(self, client_id: str, shared: bool):
+        """Opt a connection in or out of the shared clipboard feed"""
+        if shared and client_id in self.active_connections:
+            self.shared_clients.add(client_id)
+        else:
+            self.shared_clients.discard(client_id)
+        self._schedule_reconcile(SHARED_CHANNEL)
+
+    def _channel_needed(self, channel: str) -> bool:
+        if channel == SHARED_CHANNEL:
+            return bool(self.shared_clients)
+        return channel[len(USER_CHANNEL.format("")):] in self.user_clients
+
+    async def _reconcile_channel(self, channel: str):
+        """Subscribe to or leave a backplane channel to match the local sockets"""
+        if not self.backplane:
+            return
+        async with self._channel_lock:
+            needed = self._channel_needed(channel)
+            if needed and channel not in self._channels:
+                handler = self._on_shared_message if channel == SHARED_CHANNEL else self._on_user_message
+                if await RedisService.subscribe(channel, handler):
+                    self._channels.add(channel)
+            elif not needed and channel in self._channels:
+                self._channels.discard(channel)
+                await RedisService.unsubscribe(channel)
+
+    def _schedule_reconcile(self, channel: str):
+        """Reconcile a channel from synchronous code paths (disconnect, set_shared)"""
+        if not self.backplane or self._channel_needed(channel) == (channel in self._channels):
+            return
+        try:
+            asyncio.get_running_loop().create_task(self._reconcile_channel(channel))
+        except RuntimeError:
+            pass
+
+    async def _on_user_message(self, envelope: Any):
+        """Backplane delivery to the owner's sockets (shared subscribers get the shared copy)"""
+        if isinstance(envelope, dict):
+            self._deliver_to_user(envelope.get("user_id"), envelope.get("message"))
+
+    async def _on_shared_message(self, envelope: Any):
+        """Backplane delivery to shared-feed subscribers"""
+        if isinstance(envelope, dict):
+            self._deliver_to_shared(envelope.get("message"))
+
+    def _deliver_to_user(self, user_id: Optional[str], message: str):
+        for client_id in self.user_clients.get(user_id, set()) - self.shared_clients:
+            self._enqueue(client_id, message)
+
+    def _deliver_to_shared(self, message: str):
+        for client_id in list(self.shared_clients):
+            self._enqueue(client_id, message)
+
+    async def _writer(self, connection: _Connection):
+        """Drain one connection's queue onto its socket"""
+        while True:
+            enqueued_at, message = await connection.queue.get()
             try:
-                await self.active_connections[client_id].send_text(message)
+                await asyncio.wait_for(connection.websocket.send_text(message), self.send_timeout)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                print(f"Error sending message to {client_id}: {e}")
-                self.disconnect(client_id)
-    
+                print(f"Error sending message to {connection.client_id}: {e}")
+                self._drop_connection(connection)
+                return
+            lag_ms = (time.monotonic() - enqueued_at) * 1000
+            connection.sent += 1
+            connection.last_lag_ms = lag_ms
+            connection.max_lag_ms = max(connection.max_lag_ms, lag_ms)
+
+    def _drop_connection(self, connection: _Connection, code: int = 1011):
+        """Forget a connection and close its socket in the background"""
+        self.disconnect(connection.client_id, connection.websocket)
+
+        async def close():
+            try:
+                await connection.websocket.close(code=code)
+            except Exception:
+                pass
+        asyncio.create_task(close())
+
+    def _enqueue(self, client_id: str, message: str):
+        """Queue a serialized message for one client, applying the overflow policy"""
+        connection = self.connections.get(client_id)
+        if connection is None:
+            return
+        item = (time.monotonic(), message)
+        try:
+            connection.queue.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == "drop_oldest":
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(item)
+            connection.dropped += 1
+        elif self.overflow_policy == "drop_newest":
+            connection.dropped += 1
+        else:
+            print(f"⚠️ WebSocket {client_id} fell {connection.queue.qsize()} messages behind, disconnecting")
+            self.overflow_disconnects += 1
+            self._drop_connection(connection, code=1013)
+
+    async def send_personal_message(self, message: str, client_id: str):
+        """Send a message to a specific client"""
+        self._enqueue(client_id, message)
+
     async def broadcast(self, message: str):
         """Send a message to all connected clients"""
-        disconnected_clients = []
-        for client_id, connection in self.active_connections.items():
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                print(f"Error broadcasting to {client_id}: {e}")
-                disconnected_clients.append(client_id)
-        
-        # Clean up disconnected clients
-        for client_id in disconnected_clients:
-            self.disconnect(client_id)
-    
+        for client_id in list(self.connections):
+            self._enqueue(client_id, message)
+
+    async def publish_clipboard_item(self, item: Dict[str, Any]):
+        """Push a new clipboard item to its owner's devices and to shared subscribers
+
+        Through the backplane when connected, so sockets on every worker receive it;
+        a channel that cannot be published to is delivered locally instead.
+        """
+        await self._publish_clipboard(item.get("user_id"), {"type": "clipboard_item", "item": item})
+
+    async def publish_clipboard_copy(self, user_id: str, copy: Dict[str, Any]):
+        """Tell the same clients that an existing item was copied again
+
+        `copy` carries the item's id, copy_count and last_copied_at.
+        """
+        await self._publish_clipboard(user_id, {"type": "clipboard_copy", "item": copy})
+
+    async def _publish_clipboard(self, user_id: Optional[str], data: Dict[str, Any]):
+        message = json.dumps(data, default=str)
+        envelope = {"user_id": user_id, "message": message}
+        if user_id and not (self.backplane and await RedisService.publish(USER_CHANNEL.format(user_id), envelope)):
+            self._deliver_to_user(user_id, message)
+        if not (self.backplane and await RedisService.publish(SHARED_CHANNEL, envelope)):
+            self._deliver_to_shared(message)
+
     async def send_json(self, data: dict, client_id: str):
         """Send JSON data to a specific client"""
-        if client_id in self.active_connections:
-            try:
-                await self.active_connections[client_id].send_text(json.dumps(data))
-            except Exception as e:
-                print(f"Error sending JSON to {client_id}: {e}")
-                self.disconnect(client_id)
-    
+        self._enqueue(client_id, json.dumps(data))
+
     def get_connected_clients(self) -> List[str]:
         """Get list of connected client IDs"""
-        return list(self.active_connections.keys())
\ No newline at end of file
+        return list(self.active_connections.keys())
+
+    def get_stats(self, top: int = 50) -> Dict[str, Any]:
+        """Delivery metrics, with the `top` most lagging connections listed individually"""
+        connections = sorted(self.connections.values(),
+                             key=lambda c: (c.queue.qsize(), c.last_lag_ms), reverse=True)
+        return {
+            "connections": len(self.connections),
+            "shared_subscribers": len(self.shared_clients),
+            "backplane": self.backplane,
+            "backplane_channels": len(self._channels),
+            "queue_size": self.queue_size,
+            "overflow_policy": self.overflow_policy,
+            "overflow_disconnects": self.overflow_disconnects,
+            "queued_messages": sum(c.queue.qsize() for c in connections),
+            "dropped_messages": sum(c.dropped for c in connections),
+            "max_lag_ms": round(max((c.max_lag_ms for c in connections), default=0.0), 1),
+            "lagging_connections": [c.stats() for c in connections[:top]]
+        }
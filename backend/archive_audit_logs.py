@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Archive audit logs older than the retention age into segment files.
+
+Does the same work as the periodic job started by the app (see AuditArchive),
+once. AUDIT_ARCHIVE_URL must be set; pass a number of days to override
+AUDIT_RETENTION_DAYS:
+
+    python archive_audit_logs.py [days]
+"""
+import asyncio
+import sys
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from app.services.firebase_service import FirebaseService
+from app.services.audit_archive import AuditArchive
+
+async def archive(days=None):
+    await FirebaseService.initialize()
+    try:
+        result = await AuditArchive.run_once(days)
+        print(f"✅ Archived {result['archived']} audit logs into {result['segments']} segments")
+    finally:
+        await FirebaseService.close()
+
+if __name__ == "__main__":
+    asyncio.run(archive(float(sys.argv[1]) if len(sys.argv) > 1 else None))
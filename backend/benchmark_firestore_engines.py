@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Firestore Engine Concurrency Benchmark
+
+Compares the "thread" engine (blocking client in a ThreadPoolExecutor) with the
+"async" engine (native AsyncClient awaited on the event loop) as the number of
+in-flight requests grows past the executor size.
+
+Both modes drive the real FirebaseService.get_user_by_id code path:
+
+  python benchmark_firestore_engines.py              # simulated Firestore latency
+  python benchmark_firestore_engines.py --live USER  # real Firestore, reads users/USER
+
+Simulated mode runs FirebaseService on a Firestore storage engine over a stand-in
+client whose document reads take --latency-ms (time.sleep for the thread engine, asyncio.sleep for the
+async engine), so it needs no credentials and isolates dispatch overhead.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from app.services.firebase_service import FirebaseService
+from app.storage import create_engine
+
+
+class _Snapshot:
+    exists = True
+
+    def to_dict(self):
+        return {"id": "bench-user", "email": "bench@clipvault.dev", "name": "Bench"}
+
+
+class _BlockingDocument:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get(self):
+        time.sleep(self.latency)
+        return _Snapshot()
+
+
+class _AsyncDocument:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def get(self):
+        await asyncio.sleep(self.latency)
+        return _Snapshot()
+
+
+class _SimulatedClient:
+    """Minimal stand-in for the Firestore client: collection(...).document(...).get()"""
+
+    def __init__(self, document):
+        self._document = document
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return self._document
+
+
+def use_simulated_engine(engine: str, latency: float, workers: int):
+    document = _AsyncDocument(latency) if engine == "async" else _BlockingDocument(latency)
+    FirebaseService._engine = engine
+    FirebaseService._db = _SimulatedClient(document)
+    FirebaseService._executor = ThreadPoolExecutor(max_workers=workers)
+    FirebaseService._storage = create_engine("firestore", db=FirebaseService._db, mode=engine,
+                                             executor=FirebaseService._executor)
+
+
+async def run_level(user_id: str, concurrency: int, requests: int):
+    """Issue `requests` reads with at most `concurrency` in flight; return latencies in ms"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await FirebaseService.get_user_by_id(user_id)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", metavar="USER_ID", help="benchmark against real Firestore reading users/USER_ID")
+    parser.add_argument("--latency-ms", type=float, default=25.0, help="simulated read latency (default 25ms)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("FIRESTORE_EXECUTOR_WORKERS", 10)),
+                        help="thread engine executor size (default 10)")
+    parser.add_argument("--levels", default="1,5,10,20,50,100,200", help="comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=400, help="requests per level")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(",")]
+    user_id = args.live or "bench-user"
+
+    print("📊 Firestore engine concurrency benchmark")
+    if args.live:
+        load_dotenv()
+        print(f"   mode: live Firestore, reading users/{user_id}")
+    else:
+        print(f"   mode: simulated, {args.latency_ms:.0f}ms per read, {args.workers} executor threads")
+    print(f"   {args.requests} requests per level\n")
+    print(f"{'engine':<8}{'in-flight':>10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+
+    for engine in ("thread", "async"):
+        if args.live:
+            os.environ["FIRESTORE_EXECUTOR_WORKERS"] = str(args.workers)
+            await FirebaseService.initialize(engine=engine)
+        else:
+            use_simulated_engine(engine, args.latency_ms / 1000, args.workers)
+
+        for concurrency in levels:
+            latencies, elapsed = await run_level(user_id, concurrency, args.requests)
+            print(f"{engine:<8}{concurrency:>10}{args.requests / elapsed:>10.0f}"
+                  f"{statistics.median(latencies):>10.1f}{percentile(latencies, 99):>10.1f}")
+
+        if args.live:
+            await FirebaseService.close()
+        else:
+            FirebaseService._executor.shutdown(wait=True)
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
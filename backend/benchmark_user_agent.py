@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+User-Agent Parser Benchmark
+
+Compares the cached parser behind auth.extract_device_info, and its uncached
+miss path, with a verbatim copy of the original if/elif implementation, over a
+hand-written corpus of common User-Agent strings with weights that mimic login
+traffic (a few UAs dominate):
+
+  python benchmark_user_agent.py                  # 200k lookups, best of 5 passes
+  python benchmark_user_agent.py --lookups 50000 --repeat 3
+
+Before timing, every corpus entry (and case/whitespace variants of it) is
+checked to parse identically under both implementations.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.user_agent import parse_user_agent, cache_info, _parse
+
+# (weight, User-Agent), hand-written; weights are illustrative, not measured
+CORPUS = [
+    (30, "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"),
+    (18, "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"),
+    (12, "Mozilla/5.0 (iPhone; CPU iPhone OS 17_1_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1.2 Mobile/15E148 Safari/604.1"),
+    (10, "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0"),
+    (8, "Mozilla/5.0 (Linux; Android 13; SM-S911B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.6045.163 Mobile Safari/537.36"),
+    (6, "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15"),
+    (5, "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0"),
+    (3, "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"),
+    (2, "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0"),
+    (2, "Mozilla/5.0 (iPad; CPU OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1"),
+    (1, "Mozilla/5.0 (Linux; Android 12; Pixel 6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Mobile Safari/537.36"),
+    (1, "Mozilla/5.0 (Linux; Android 11; SM-T500) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36"),
+    (1, "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/23.0 Chrome/115.0.0.0 Mobile Safari/537.36"),
+    (1, "Mozilla/5.0 (Linux; Android 9; SM-G960F) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Mobile Safari/537.36"),
+    (1, "Mozilla/5.0 (iPhone; CPU iPhone OS 16_7_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/120.0.6099.119 Mobile/15E148 Safari/604.1"),
+    (1, "Mozilla/5.0 (iPhone; CPU iPhone OS 15_8 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.6.6 Mobile/15E148 Safari/604.1"),
+    (1, "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_1) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1 Safari/605.1.15"),
+    (1, "Mozilla/5.0 (Macintosh; Intel Mac OS X 13.5; rv:109.0) Gecko/20100101 Firefox/118.0"),
+    (1, "Mozilla/5.0 (Macintosh; Intel Mac OS X 12_6_8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36"),
+    (1, "Mozilla/5.0 (Macintosh; Intel Mac OS X 11_7_10) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Safari/605.1.15"),
+    (1, "Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36"),
+    (1, "Mozilla/5.0 (Windows NT 6.3; Win64; x64; rv:115.0) Gecko/20100101 Firefox/115.0"),
+    (1, "Mozilla/5.0 (Windows NT 6.2; WOW64; Trident/7.0; rv:11.0) like Gecko"),
+    (1, "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 OPR/105.0.0.0"),
+    (1, "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.102 Safari/537.36 Edge/18.19045"),
+    (1, "Opera/9.80 (Windows NT 6.1; U; en) Presto/2.12.388 Version/12.18"),
+    (1, "Mozilla/5.0 (SMART-TV; Linux; Tizen 6.0) AppleWebKit/538.1 (KHTML, like Gecko) Version/6.0 TV Safari/538.1"),
+    (1, "Mozilla/5.0 (Linux; Android 9; AFTMM Build/PS7233) AppleWebKit/537.36 (KHTML, like Gecko) Silk/120.3.1 like Chrome/120.0.6099.230 Safari/537.36"),
+    (1, "Mozilla/5.0 (X11; CrOS x86_64 15474.84.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"),
+    (1, "curl/8.4.0"),
+    (1, "python-requests/2.31.0"),
+    (1, "PostmanRuntime/7.35.0"),
+    (1, "ClipVault/1.0 (Electron; Windows NT 10.0)"),
+]
+
+
+def legacy_extract_device_info(user_agent: str) -> dict:
+    """Verbatim copy of auth.extract_device_info before the cached parser"""
+    if not user_agent or user_agent == "unknown":
+        return {
+            "device_name": "Unknown Device",
+            "device_type": "desktop",
+            "platform": "Unknown",
+            "browser": "Unknown",
+            "os_version": "Unknown"
+        }
+    
+    user_agent_lower = user_agent.lower()
+    
+    # Detect platform/OS with version
+    platform = "Unknown"
+    os_version = "Unknown"
+    
+    if "windows nt 10" in user_agent_lower:
+        platform = "Windows"
+        os_version = "10/11"
+    elif "windows nt 6.3" in user_agent_lower:
+        platform = "Windows"
+        os_version = "8.1"
+    elif "windows nt 6.2" in user_agent_lower:
+        platform = "Windows"
+        os_version = "8"
+    elif "windows nt 6.1" in user_agent_lower:
+        platform = "Windows"
+        os_version = "7"
+    elif "windows" in user_agent_lower:
+        platform = "Windows"
+        os_version = "Unknown"
+    elif "mac os x 10_15" in user_agent_lower or "mac os x 10.15" in user_agent_lower:
+        platform = "macOS"
+        os_version = "Catalina"
+    elif "mac os x 11_" in user_agent_lower or "mac os x 11." in user_agent_lower:
+        platform = "macOS"
+        os_version = "Big Sur"
+    elif "mac os x 12_" in user_agent_lower or "mac os x 12." in user_agent_lower:
+        platform = "macOS"
+        os_version = "Monterey"
+    elif "mac os x 13_" in user_agent_lower or "mac os x 13." in user_agent_lower:
+        platform = "macOS"
+        os_version = "Ventura"
+    elif "mac os x 14_" in user_agent_lower or "mac os x 14." in user_agent_lower:
+        platform = "macOS"
+        os_version = "Sonoma"
+    elif "macintosh" in user_agent_lower or "mac os" in user_agent_lower:
+        platform = "macOS"
+        os_version = "Unknown"
+    elif "ubuntu" in user_agent_lower:
+        platform = "Ubuntu"
+    elif "linux" in user_agent_lower:
+        platform = "Linux"
+    elif "android 13" in user_agent_lower:
+        platform = "Android"
+        os_version = "13"
+    elif "android 12" in user_agent_lower:
+        platform = "Android"
+        os_version = "12"
+    elif "android 11" in user_agent_lower:
+        platform = "Android"
+        os_version = "11"
+    elif "android 10" in user_agent_lower:
+        platform = "Android"
+        os_version = "10"
+    elif "android" in user_agent_lower:
+        platform = "Android"
+        os_version = "Unknown"
+    elif "iphone os 17_" in user_agent_lower:
+        platform = "iOS"
+        os_version = "17"
+    elif "iphone os 16_" in user_agent_lower:
+        platform = "iOS"
+        os_version = "16"
+    elif "iphone os 15_" in user_agent_lower:
+        platform = "iOS"
+        os_version = "15"
+    elif "iphone" in user_agent_lower or "ipad" in user_agent_lower:
+        platform = "iOS"
+        os_version = "Unknown"
+    
+    # Detect device type with more accuracy
+    device_type = "desktop"
+    if "mobile" in user_agent_lower or "android" in user_agent_lower or "iphone" in user_agent_lower:
+        device_type = "mobile"
+    elif "tablet" in user_agent_lower or "ipad" in user_agent_lower:
+        device_type = "tablet"
+    elif "tv" in user_agent_lower or "smart" in user_agent_lower:
+        device_type = "tv"
+    
+    # Detect browser with version
+    browser = "Unknown"
+    browser_version = "Unknown"
+    
+    if "edg/" in user_agent_lower:
+        browser = "Edge"
+        try:
+            browser_version = user_agent.split("Edg/")[1].split()[0]
+        except:
+            pass
+    elif "chrome/" in user_agent_lower and "edg" not in user_agent_lower:
+        browser = "Chrome"
+        try:
+            browser_version = user_agent.split("Chrome/")[1].split()[0]
+        except:
+            pass
+    elif "firefox/" in user_agent_lower:
+        browser = "Firefox"
+        try:
+            browser_version = user_agent.split("Firefox/")[1].split()[0]
+        except:
+            pass
+    elif "safari/" in user_agent_lower and "chrome" not in user_agent_lower:
+        browser = "Safari"
+        try:
+            browser_version = user_agent.split("Version/")[1].split()[0]
+        except:
+            pass
+    elif "opera" in user_agent_lower:
+        browser = "Opera"
+    
+    # Generate comprehensive device name
+    device_name = f"{platform}"
+    if os_version != "Unknown":
+        device_name += f" {os_version}"
+    
+    if browser != "Unknown":
+        device_name += f" - {browser}"
+        if browser_version != "Unknown":
+            device_name += f" {browser_version.split('.')[0]}"  # Just major version
+    
+    if device_type == "mobile":
+        device_name = f"Mobile {device_name}"
+    elif device_type == "tablet":
+        device_name = f"Tablet {device_name}"
+    elif device_type == "tv":
+        device_name = f"Smart TV {device_name}"
+    
+    return {
+        "device_name": device_name,
+        "device_type": device_type,
+        "platform": platform,
+        "browser": browser,
+        "browser_version": browser_version,
+        "os_version": os_version
+    }
+
+
+def variants(user_agent: str):
+    """Corpus entry plus variants that exercise case and marker edge cases"""
+    yield user_agent
+    yield user_agent.upper()
+    yield user_agent.lower()
+    yield user_agent + " "
+    yield user_agent.replace("/", "/ ")
+
+
+def verify() -> int:
+    checked = 0
+    for _, corpus_agent in CORPUS:
+        for user_agent in variants(corpus_agent):
+            expected = legacy_extract_device_info(user_agent)
+            actual = parse_user_agent(user_agent)
+            if actual != expected:
+                raise SystemExit(f"❌ Mismatch for {user_agent!r}:\n  legacy: {expected}\n  parser: {actual}")
+            checked += 1
+    for user_agent in ("", "unknown"):
+        assert parse_user_agent(user_agent) == legacy_extract_device_info(user_agent)
+    return checked
+
+
+def timed(func, agents, repeat: int, before=None) -> float:
+    """Best of `repeat` passes over agents, calling before() ahead of each pass"""
+    best = float("inf")
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        for user_agent in agents:
+            func(user_agent)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookups", type=int, default=200000, help="lookups per implementation (default 200000)")
+    parser.add_argument("--repeat", type=int, default=5, help="passes per implementation, best is kept (default 5)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print("📊 User-Agent parser benchmark")
+    print(f"   ✅ {verify()} corpus variants parse identically\n")
+
+    rng = random.Random(args.seed)
+    weights, agents = zip(*CORPUS)
+    traffic = rng.choices(agents, weights=weights, k=args.lookups)
+    unique = list(dict.fromkeys(traffic))
+
+    legacy = timed(legacy_extract_device_info, traffic, args.repeat)
+    uncached = timed(_parse.__wrapped__, traffic, args.repeat)
+    cached = timed(parse_user_agent, traffic, args.repeat, before=_parse.cache_clear)
+
+    print(f"{'implementation':<26}{'us/lookup':>12}{'speedup':>10}")
+    print(f"{'legacy if/elif':<26}{legacy / len(traffic) * 1e6:>12.2f}{1:>10.1f}x")
+    print(f"{'parser, uncached':<26}{uncached / len(traffic) * 1e6:>12.2f}{legacy / uncached:>10.1f}x")
+    print(f"{'parser, LRU':<26}{cached / len(traffic) * 1e6:>12.2f}{legacy / cached:>10.1f}x")
+    print(f"\n   {len(traffic)} lookups over {len(unique)} distinct UAs, cache: {cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,8 @@ from app.services.firebase_service import FirebaseService
 async def list_all_users():
     """List all users in Firebase to see what's stored"""
     try:
-        await FirebaseService.initialize()
+        # Synchronous stream() below needs the blocking client
+        await FirebaseService.initialize(engine="thread")
         print("✅ Firebase initialized")
         
         # Get all users from the users collection
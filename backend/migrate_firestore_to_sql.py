@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Copy the Firestore collections into the SQL storage engine at DATABASE_URL.
+
+Resumable: progress is checkpointed to MIGRATION_CHECKPOINT after every batch,
+so rerun the same command after a crash to continue (see StorageMigration).
+Counts and checksums are verified at the end; pass --verify to only verify.
+
+    python migrate_firestore_to_sql.py [--verify] [collection ...]
+"""
+import asyncio
+import sys
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from app.services.firebase_service import FirebaseService
+from app.services.storage_migration import StorageMigration
+from app.storage import create_engine
+
+async def migrate(collections, verify_only=False):
+    # The source is always Firestore, whatever STORAGE_ENGINE the app now uses
+    os.environ["STORAGE_ENGINE"] = "firestore"
+    await FirebaseService.initialize()
+    target = create_engine("sql")
+    await target.open()
+    try:
+        if not verify_only:
+            await StorageMigration.run(target, collections)
+        results = await StorageMigration.verify(target, collections)
+        if not all(result['ok'] for result in results.values()):
+            print("❌ Verification failed, rerun to resume the copy")
+            sys.exit(1)
+        print("✅ Migration verified")
+    finally:
+        await target.close()
+        await FirebaseService.close()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(migrate([arg for arg in args if arg != "--verify"] or None, "--verify" in args))
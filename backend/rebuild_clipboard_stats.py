@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Rebuild the materialized clipboard statistics from the clipboard_items collection.
+
+Run once after deploying the counter-based stats (or whenever the counters need
+to be reconciled). Pause clipboard writes while it runs.
+"""
+import asyncio
+import sys
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from app.services.firebase_service import FirebaseService
+
+async def rebuild():
+    await FirebaseService.initialize()
+    try:
+        result = await FirebaseService.rebuild_clipboard_stats()
+        print(f"✅ Rebuilt clipboard stats: {result['items']} items, {result['users']} users")
+    finally:
+        await FirebaseService.close()
+
+if __name__ == "__main__":
+    asyncio.run(rebuild())
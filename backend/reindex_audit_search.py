@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Backfill the audit log search index (the `search_tokens` field) for existing logs.
+
+New logs are indexed when they are written; run this once for logs written
+before search indexing existed.
+"""
+import asyncio
+import sys
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from app.services.firebase_service import FirebaseService
+
+async def reindex():
+    await FirebaseService.initialize()
+    try:
+        indexed = await FirebaseService.reindex_audit_search()
+        print(f"✅ Indexed {indexed} audit logs")
+    finally:
+        await FirebaseService.close()
+
+if __name__ == "__main__":
+    asyncio.run(reindex())
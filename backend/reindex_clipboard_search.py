@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Backfill the clipboard search index (the `search_terms` field) for existing items.
+
+New items are indexed when they are created; run this once for items written
+before search indexing existed.
+"""
+import asyncio
+import sys
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from app.services.firebase_service import FirebaseService
+
+async def reindex():
+    await FirebaseService.initialize()
+    try:
+        indexed = await FirebaseService.reindex_clipboard_search()
+        print(f"✅ Indexed {indexed} clipboard items")
+    finally:
+        await FirebaseService.close()
+
+if __name__ == "__main__":
+    asyncio.run(reindex())
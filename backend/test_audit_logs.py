@@ -32,7 +32,7 @@ async def test_audit_logs():
         print('📋 Checking all audit logs in collection...')
         try:
             query = FirebaseService._db.collection('audit_logs').limit(10)
-            docs = await FirebaseService._run_in_executor(query.get)
+            docs = await FirebaseService._execute(query.get)
             print(f'Found {len(docs)} total audit log documents')
             
             for doc in docs:
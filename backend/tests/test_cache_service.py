@@ -0,0 +1,97 @@
+"""
+Tests for the in-process tier of CacheService.
+
+Redis is not initialized here, so RedisService calls are no-ops; writes to it
+are recorded through a patched RedisService.set.
+"""
+
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+from app.services.cache_service import CacheService
+from app.services.redis_service import RedisService
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def redis_writes(monkeypatch):
+    monkeypatch.setattr(CacheService, "_local", OrderedDict())
+    monkeypatch.setattr(CacheService, "_inflight", {})
+    monkeypatch.setattr(CacheService, "_generations", {})
+    monkeypatch.setattr(CacheService, "_stats", {})
+    writes = []
+
+    async def record_set(key, value, expire=None):
+        writes.append(key)
+        return True
+
+    monkeypatch.setattr(RedisService, "set", record_set)
+    return writes
+
+
+def slow_loader(values):
+    """A loader that returns the next value once released"""
+    release = asyncio.Event()
+
+    async def loader():
+        await release.wait()
+        return values.pop(0)
+
+    return loader, release
+
+
+async def test_get_or_load_caches_the_loaded_value(redis_writes):
+    loader, release = slow_loader([{"name": "first"}])
+    release.set()
+
+    assert await CacheService.get_or_load("user:1", loader) == {"name": "first"}
+    assert await CacheService.get_or_load("user:1", loader) == {"name": "first"}
+    assert redis_writes == ["cache:user:1"]
+    assert CacheService.get_stats()["namespaces"]["user"]["local_hits"] == 1
+
+
+@pytest.mark.parametrize("remote", [False, True])
+async def test_invalidate_during_load_skips_caching(redis_writes, remote):
+    loader, release = slow_loader([{"name": "stale"}, {"name": "fresh"}])
+    load = asyncio.create_task(CacheService.get_or_load("user:1", loader))
+    await asyncio.sleep(0)
+
+    if remote:
+        await CacheService._on_invalidation({"origin": "another-worker", "keys": ["user:1"]})
+    else:
+        await CacheService.invalidate("user:1")
+    release.set()
+
+    assert await load == {"name": "stale"}
+    assert redis_writes == []
+    assert "user:1" not in CacheService._local
+    assert await CacheService.get_or_load("user:1", loader) == {"name": "fresh"}
+    assert redis_writes == ["cache:user:1"]
+    assert CacheService._inflight == {} and CacheService._generations == {}
+
+
+async def test_caller_after_invalidate_does_not_share_the_stale_load(redis_writes):
+    stale_loader, release_stale = slow_loader([{"name": "stale"}])
+    fresh_loader, release_fresh = slow_loader([{"name": "fresh"}])
+    stale = asyncio.create_task(CacheService.get_or_load("user:1", stale_loader))
+    await asyncio.sleep(0)
+
+    await CacheService.invalidate("user:1")
+    fresh = asyncio.create_task(CacheService.get_or_load("user:1", fresh_loader))
+    await asyncio.sleep(0)
+    release_fresh.set()
+    assert await fresh == {"name": "fresh"}
+    release_stale.set()
+    assert await stale == {"name": "stale"}
+
+    assert redis_writes == ["cache:user:1"]
+    assert await CacheService.get_or_load("user:1", stale_loader) == {"name": "fresh"}
+    assert CacheService._inflight == {} and CacheService._generations == {}
@@ -0,0 +1,323 @@
+"""
+Contract tests for the storage engines behind FirebaseService.
+
+Every test runs against the memory engine, the SQL engine on SQLite and the
+log engine, each in a temporary directory, so they need no credentials.
+"""
+
+import os
+import hashlib
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.firebase_service import FirebaseService
+from app.services.storage_migration import _checksum
+from app.storage import create_engine
+
+pytestmark = pytest.mark.anyio
+
+ENGINES = ["memory", "sql", "log"]
+
+# Recent enough to count in the 24 hour stats
+BASE = datetime.utcnow() - timedelta(hours=2)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def open_engine(tmp_path, monkeypatch):
+    """Opens an engine on the test's files, closing the one opened before"""
+    opened = []
+
+    async def open_engine(name):
+        if opened:
+            await opened.pop().close()
+        options = {}
+        if name in ("sql", "log"):
+            options["url"] = f"sqlite+aiosqlite:///{tmp_path / 'clipvault.db'}"
+        if name == "log":
+            options["directory"] = str(tmp_path / "clipboard_log")
+        storage = create_engine(name, **options)
+        await storage.open()
+        monkeypatch.setattr(FirebaseService, "_storage", storage)
+        opened.append(storage)
+        return storage
+
+    yield open_engine
+    if opened:
+        await opened.pop().close()
+
+
+@pytest.fixture(params=ENGINES)
+async def engine(request, open_engine):
+    return await open_engine(request.param)
+
+
+def clipboard_item(item_id, user_id, content, created_at, content_type="text"):
+    encoded = content.encode("utf-8")
+    return {
+        "id": item_id,
+        "user_id": user_id,
+        "content": content,
+        "content_type": content_type,
+        "created_at": created_at,
+        "content_hash": hashlib.sha256(encoded).hexdigest(),
+        "size_bytes": len(encoded),
+        "copy_count": 1,
+        "last_copied_at": created_at,
+    }
+
+
+async def all_pages(storage, user_id, limit):
+    ids, cursor = [], None
+    while True:
+        page = await storage.get_clipboard_page(user_id, limit, cursor=cursor)
+        ids += [item["id"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return ids
+
+
+# Clipboard items
+
+async def test_pages_follow_cursors_newest_first(engine):
+    for i in range(10):
+        await engine.create_clipboard_item(
+            clipboard_item(f"item-{i}", f"user-{i % 2}", f"clip number {i}", BASE + timedelta(minutes=i)))
+
+    assert await all_pages(engine, "user-0", 2) == ["item-8", "item-6", "item-4", "item-2", "item-0"]
+    assert await all_pages(engine, None, 3) == [f"item-{i}" for i in range(9, -1, -1)]
+
+    page = await engine.get_clipboard_page(None, 3, offset=4)
+    assert [item["id"] for item in page["items"]] == ["item-5", "item-4", "item-3"]
+    assert page["items"][0]["content"] == "clip number 5"
+
+    with pytest.raises(ValueError):
+        await engine.get_clipboard_page(None, 3, cursor="not-a-cursor")
+
+
+async def test_search_ranks_whole_words_first(engine):
+    contents = ["deploy the foobar service", "xfoobarz is not a word", "nothing to see", "foobar again"]
+    for i, content in enumerate(contents):
+        await engine.create_clipboard_item(
+            clipboard_item(f"item-{i}", "user-1" if i < 3 else "user-2", content, BASE + timedelta(minutes=i)))
+
+    result = await engine.search_clipboard_items("foobar", None, 10)
+    assert [item["id"] for item in result["items"]][:2] in (["item-3", "item-0"], ["item-0", "item-3"])
+    assert [item["id"] for item in result["items"]][2:] == ["item-1"]
+    assert "search_terms" not in result["items"][0]
+
+    result = await engine.search_clipboard_items("foobar deploy", "user-1", 10)
+    assert [item["id"] for item in result["items"]] == ["item-0"]
+    assert (await engine.search_clipboard_items("absent", None, 10))["items"] == []
+
+
+async def test_search_finds_every_word_of_long_items(engine):
+    content = " ".join(f"word{i}x" for i in range(400))
+    await engine.create_clipboard_item(clipboard_item("long", "user-1", content, BASE))
+
+    for word in ("word4x", "word350x"):
+        result = await engine.search_clipboard_items(word, "user-1", 10)
+        assert [item["id"] for item in result["items"]] == ["long"]
+
+
+async def test_stats_count_items_per_scope(engine):
+    await engine.create_clipboard_item(clipboard_item("a", "user-1", "one", BASE))
+    await engine.create_clipboard_item(clipboard_item("b", "user-1", "two", BASE + timedelta(minutes=1), "code"))
+    await engine.create_clipboard_item(clipboard_item("c", "user-2", "three", BASE + timedelta(minutes=2)))
+    await engine.create_clipboard_item(clipboard_item("d", "user-2", "old", BASE - timedelta(days=3)))
+
+    shared = await engine.get_clipboard_stats(None)
+    assert (shared["total_items"], shared["text_items"], shared["recent_items"]) == (4, 3, 3)
+    assert (shared["unique_users"], shared["is_shared"]) == (2, True)
+
+    own = await engine.get_clipboard_stats("user-1")
+    assert (own["total_items"], own["text_items"], own["recent_items"], own["is_shared"]) == (2, 1, 2, False)
+
+
+# Deduplication
+
+async def test_copies_within_the_window_collapse(engine):
+    first = clipboard_item("first", "user-1", "same text", BASE)
+    assert await engine.create_clipboard_item(first) is None
+
+    again = clipboard_item("again", "user-1", "same text", BASE + timedelta(minutes=2))
+    copied = await engine.create_clipboard_item(again, copied_since=again["created_at"] - timedelta(minutes=5))
+    assert copied["id"] == "first"
+    assert copied["copy_count"] == 2
+
+    page = await engine.get_clipboard_page("user-1", 10)
+    assert [item["id"] for item in page["items"]] == ["first"]
+    assert page["items"][0]["copy_count"] == 2
+    assert page["items"][0]["content"] == "same text"
+    assert "content_hash" not in page["items"][0]
+
+    # Another user's copy is their own item
+    other = clipboard_item("other", "user-2", "same text", BASE + timedelta(minutes=3))
+    assert await engine.create_clipboard_item(other, copied_since=other["created_at"] - timedelta(minutes=5)) is None
+
+
+async def test_window_runs_from_the_first_copy(engine):
+    await engine.create_clipboard_item(clipboard_item("first", "user-1", "same text", BASE))
+    later = clipboard_item("later", "user-1", "same text", BASE + timedelta(minutes=10))
+    assert await engine.create_clipboard_item(later, copied_since=later["created_at"] - timedelta(minutes=5)) is None
+
+    assert await all_pages(engine, "user-1", 10) == ["later", "first"]
+    await engine.delete_clipboard_item("first")
+    page = await engine.get_clipboard_page("user-1", 10)
+    assert [(item["id"], item["content"]) for item in page["items"]] == [("later", "same text")]
+
+
+async def test_facade_returns_the_collapsed_item(engine, monkeypatch):
+    monkeypatch.setenv("CLIPBOARD_DEDUP_WINDOW_SECONDS", "300")
+    first = {"content": "copied twice", "user_id": "user-1", "content_type": "text"}
+    second = dict(first)
+    item_id = await FirebaseService.create_clipboard_item(first)
+    assert await FirebaseService.create_clipboard_item(second) == item_id
+    assert second["copy_count"] == 2
+    for item in (first, second):
+        assert item["created_at"].utcoffset() == timedelta(0)
+        assert item["last_copied_at"].utcoffset() == timedelta(0)
+    assert second["last_copied_at"] > second["created_at"] == first["created_at"]
+
+    monkeypatch.setenv("CLIPBOARD_DEDUP_WINDOW_SECONDS", "0")
+    assert await FirebaseService.create_clipboard_item(dict(first)) != item_id
+
+
+# Audit chain
+
+def audit_log(number, user_id="user-1"):
+    log_data = {"action": "User Login", "details": f"attempt {number}", "user": "a@example.com",
+                "status": "success", "user_id": user_id, "ip_address": "127.0.0.1", "device": "test"}
+    FirebaseService._stamp_audit_log(log_data)
+    log_data["created_at"] = BASE + timedelta(seconds=number)
+    return log_data
+
+
+async def test_audit_chain_seals_verifies_and_proves(engine):
+    logs = [audit_log(i) for i in range(10)]
+    completed = await engine.write_audit_logs(logs[:6], 4)
+    completed += await engine.write_audit_logs(logs[6:], 4)
+    assert set(completed) == {"user-1"}
+    assert await FirebaseService.seal_audit_checkpoints("user-1") == 2
+
+    result = await FirebaseService.verify_audit_chain("user-1")
+    assert result["valid"], result["errors"]
+    assert (result["entries_checked"], result["checkpoints_checked"]) == (10, 2)
+    assert (result["verified_entries"], result["unverified_entries"]) == (8, 2)
+
+    proof = await FirebaseService.get_audit_proof("user-1", logs[5]["id"])
+    assert (proof["seq"], proof["valid"], proof["sealed"]) == (5, True, True)
+    assert proof["checkpoint"]["index"] == 1
+    unsealed = await FirebaseService.get_audit_proof("user-1", logs[9]["id"])
+    assert (unsealed["valid"], unsealed["sealed"]) == (True, False)
+    assert await FirebaseService.get_audit_proof("user-2", logs[5]["id"]) is None
+
+
+async def test_failed_seal_is_retried(engine, monkeypatch):
+    monkeypatch.setattr(FirebaseService, "_pending_seals", {})
+    monkeypatch.setenv("AUDIT_SEAL_RETRY_SECONDS", "0")
+    await engine.write_audit_logs([audit_log(i) for i in range(4)], 4)
+
+    async def unavailable(user_id, checkpoint):
+        raise ConnectionError("storage unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(engine, "save_audit_checkpoint", unavailable)
+        await FirebaseService._seal_in_background("user-1")
+    assert "user-1" in FirebaseService._pending_seals
+
+    await FirebaseService.retry_audit_seals()
+    assert FirebaseService._pending_seals == {}
+    result = await FirebaseService.verify_audit_chain("user-1")
+    assert (result["valid"], result["verified_entries"], result["unverified_entries"]) == (True, 4, 0)
+
+
+async def test_audit_pages_filter_and_search(engine):
+    logs = [audit_log(i) for i in range(6)]
+    logs[1].update(status="error", action="Export Data")
+    await engine.write_audit_logs(logs, 4)
+
+    page = await engine.get_user_audit_page("user-1", 4)
+    assert [log["id"] for log in page["items"]] == [log["id"] for log in logs[::-1][:4]]
+    rest = await engine.get_user_audit_page("user-1", 4, cursor=page["next_cursor"])
+    assert [log["id"] for log in rest["items"]] == [logs[1]["id"], logs[0]["id"]]
+    assert rest["next_cursor"] is None
+
+    errors = await engine.get_user_audit_page("user-1", 10, status_filter="error")
+    assert [log["id"] for log in errors["items"]] == [logs[1]["id"]]
+    found = await engine.get_user_audit_page("user-1", 10, search="expo")
+    assert [log["id"] for log in found["items"]] == [logs[1]["id"]]
+
+
+# Migration
+
+async def test_sql_imports_records_seeded_with_iso_timestamps(open_engine):
+    storage = await open_engine("sql")
+    created_at = BASE.isoformat()
+    # As written by create_firebase_database.py: string timestamps, and a
+    # content_hash on an item that keeps its content inline
+    records = {
+        "clipboard_items": [{"id": "clip-001", "user_id": "user-1", "content": "Welcome to ClipVault!",
+                             "content_type": "text", "content_hash": "sample_hash_001", "created_at": created_at}],
+        "audit_logs": [{"id": "audit-001", "user_id": "user-1", "action": "database_initialized",
+                        "details": {"setup_version": "1.0.0"}, "status": "success", "hash_chain": None,
+                        "created_at": created_at}],
+        "devices": [{"id": "device-001", "user_id": "user-1", "name": "Test device",
+                     "last_seen": created_at, "created_at": created_at}],
+    }
+    for collection, source in records.items():
+        await storage.import_records(collection, source)
+        imported = [record async for page in storage.iter_imported_records(collection) for record in page]
+        assert sorted(map(_checksum, imported)) == sorted(map(_checksum, source))
+
+    page = await storage.get_clipboard_page("user-1", 10)
+    assert [(item["id"], item["content"]) for item in page["items"]] == [("clip-001", "Welcome to ClipVault!")]
+    logs = await storage.get_user_audit_page("user-1", 10)
+    assert [log["id"] for log in logs["items"]] == ["audit-001"]
+
+
+# Persistence
+
+@pytest.mark.parametrize("name", ["sql", "log"])
+async def test_items_survive_a_reopen(name, open_engine):
+    storage = await open_engine(name)
+    for i in range(5):
+        await storage.create_clipboard_item(
+            clipboard_item(f"item-{i}", "user-1", f"clip {i % 2}", BASE + timedelta(minutes=i)))
+    again = clipboard_item("again", "user-1", "clip 0", BASE + timedelta(minutes=6))
+    assert (await storage.create_clipboard_item(again, copied_since=BASE + timedelta(minutes=3)))["id"] == "item-4"
+    await storage.delete_clipboard_item("item-1")
+    before = await storage.get_clipboard_page("user-1", 10)
+
+    storage = await open_engine(name)
+    after = await storage.get_clipboard_page("user-1", 10)
+    assert after == before
+    assert [item["id"] for item in after["items"]] == ["item-4", "item-3", "item-2", "item-0"]
+    assert after["items"][0]["copy_count"] == 2
+    assert (await storage.get_clipboard_stats("user-1"))["total_items"] == 4
+
+
+async def test_log_drops_entries_of_a_lost_segment(open_engine, tmp_path, monkeypatch):
+    monkeypatch.setenv("LOG_SEGMENT_BYTES", "1024")
+    storage = await open_engine("log")
+    for i in range(12):
+        await storage.create_clipboard_item(
+            clipboard_item(f"item-{i:02d}", "user-1", f"{i:02d} " + "x" * 200, BASE + timedelta(minutes=i)))
+    await storage.close()  # Nothing is open while the segment goes missing
+
+    segments = sorted(name for name in os.listdir(tmp_path / "clipboard_log") if name.endswith(".seg"))
+    assert len(segments) > 1
+    os.remove(tmp_path / "clipboard_log" / segments[-1])
+
+    storage = await open_engine("log")
+    kept = await all_pages(storage, "user-1", 5)
+    assert kept and len(kept) < 12
+    assert kept == [f"item-{i:02d}" for i in range(len(kept) - 1, -1, -1)]
+
+    await storage.create_clipboard_item(clipboard_item("after", "user-1", "after recovery", BASE + timedelta(hours=1)))
+    assert (await storage.get_clipboard_page("user-1", 1))["items"][0]["content"] == "after recovery"